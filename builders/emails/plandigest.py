@@ -0,0 +1,200 @@
+# This code composes a single digest email for many Terraform Cloud runs. The
+# plan summaries of the runs are fetched concurrently through one shared
+# session, with a bounded number of requests in flight, and the digest is
+# rendered from `tfcplandigest_template.html` in one pass.
+#
+# Runs which ended before their plan did, like errored or canceled runs, are
+# listed without a plan instead of aborting the digest.
+#
+# The rendered section of every run which has ended or whose plan has finished
+# is cached by run ID in `CACHE_DIRECTORY`, so composing the digest again (for
+# example, to re-send it) makes no API calls for those runs. The environment
+# variables required for this script are as follows:
+#
+# `TF_API_TOKEN`: A user token which has access to the runs' workspaces.
+#
+# Sample usage:
+# $ python3 plandigest.py run-CZcmD7eagjhyX0vN run-8ZfNj3FV6xUtqVbG
+# Digest of 2 plan(s): 3 to add, 0 to change, 1 to destroy.
+# Mail composed and saved as 'tfcplandigest.html'.
+
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from pathlib import Path
+from string import Template
+
+import ijson
+import requests
+from requests.adapters import HTTPAdapter
+from plansummary import (TEMPLATE_DIRECTORY, TFC_API_URL,
+                         fetch_plan_summary, get_session,
+                         render_resource_rows)
+
+TFC_APP_URL = 'https://app.terraform.io/app'
+CACHE_DIRECTORY = Path('.plandigest-cache')
+
+# Maximum number of runs fetched concurrently.
+MAX_WORKERS = 8
+
+# Statuses of a run after which its plan does not change anymore.
+FINAL_RUN_STATUSES = {
+    'planned', 'planned_and_finished', 'cost_estimated', 'policy_checked',
+    'confirmed', 'applying', 'applied', 'discarded', 'errored', 'canceled',
+    'force_canceled',
+}
+
+# Templates are compiled once, and reused for every render.
+DIGEST_TEMPLATE = Template(
+    (TEMPLATE_DIRECTORY / 'tfcplandigest_template.html').read_text())
+RUN_SECTION_TEMPLATE = Template(
+    '    <h3>${workspace}</h3>\n'
+    '    <code>Plan: ${add} to add, ${change} to change, '
+    '${destroy} to destroy.</code><br />\n'
+    '    <table>\n'
+    '      <tr><th align="left">Resource type</th><th align="left">Action</th>'
+    '<th align="right">Count</th></tr>\n'
+    '${resource_rows}\n'
+    '    </table>\n'
+    '    Click <a href="${run_link}">here</a> to view the plan '
+    'on Terraform Cloud.<br /><br />')
+# Section of a run which ended before its plan did, like an errored or
+# canceled run, and so has no JSON plan.
+NO_PLAN_SECTION_TEMPLATE = Template(
+    '    <h3>${workspace}</h3>\n'
+    '    <code>No plan: the run is ${status}.</code><br />\n'
+    '    Click <a href="${run_link}">here</a> to view the run '
+    'on Terraform Cloud.<br /><br />')
+
+
+def _get_cache_path(run_id):
+    return CACHE_DIRECTORY / f'{run_id}.json'
+
+
+def _read_cache(run_id):
+    try:
+        return json.loads(_get_cache_path(run_id).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_cache(run_id, run_digest):
+    CACHE_DIRECTORY.mkdir(exist_ok=True)
+    _get_cache_path(run_id).write_text(json.dumps(run_digest))
+
+
+def fetch_run_digest(session, run_id):
+    cached = _read_cache(run_id)
+    if cached:
+        return cached
+
+    response = session.get(
+        f'{TFC_API_URL}/runs/{run_id}', params={'include': 'workspace,plan'})
+    response.raise_for_status()
+    run = response.json()
+    included = {item['type']: item for item in run['included']}
+    workspace = included['workspaces']
+    workspace_name = workspace['attributes']['name']
+    organization_name = \
+        workspace['relationships']['organization']['data']['id']
+    run_link = \
+        f'{TFC_APP_URL}/{organization_name}/workspaces/{workspace_name}/runs/{run_id}'
+    status = run['data']['attributes']['status']
+
+    # The JSON plan only exists once the plan has finished.
+    if included['plans']['attributes']['status'] != 'finished':
+        run_digest = {
+            'add': 0,
+            'change': 0,
+            'destroy': 0,
+            'section': NO_PLAN_SECTION_TEMPLATE.substitute(
+                workspace=escape(workspace_name),
+                status=escape(status),
+                run_link=escape(run_link),
+            ),
+        }
+        if status in FINAL_RUN_STATUSES:
+            _write_cache(run_id, run_digest)
+        return run_digest
+
+    summary = fetch_plan_summary(session, run_id)
+    run_digest = {
+        'add': summary['add'],
+        'change': summary['change'],
+        'destroy': summary['destroy'],
+        'section': RUN_SECTION_TEMPLATE.substitute(
+            workspace=escape(workspace_name),
+            add=summary['add'],
+            change=summary['change'],
+            destroy=summary['destroy'],
+            resource_rows=render_resource_rows(summary['resources']),
+            run_link=escape(run_link),
+        ),
+    }
+    # Plans of runs which are still in progress may change, so they are not
+    # cached.
+    if status in FINAL_RUN_STATUSES:
+        _write_cache(run_id, run_digest)
+    return run_digest
+
+
+def fetch_run_digests(session, run_ids, max_workers=MAX_WORKERS):
+    # Make the connection pool of the shared session as big as the number of
+    # concurrent requests, so that every connection is reused.
+    adapter = HTTPAdapter(pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            lambda run_id: fetch_run_digest(session, run_id), run_ids))
+
+
+def render_digest(run_digests):
+    totals = {
+        key: sum(run_digest[key] for run_digest in run_digests)
+        for key in ('add', 'change', 'destroy')
+    }
+    return totals, DIGEST_TEMPLATE.substitute(
+        run_count=len(run_digests),
+        sections='\n'.join(run_digest['section'] for run_digest in run_digests),
+        **totals,
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compose a digest email of many Terraform Cloud plans.')
+    parser.add_argument(
+        'run_ids', nargs='+', help='IDs of the Terraform Cloud runs.')
+    parser.add_argument(
+        '--output',
+        default='tfcplandigest.html',
+        help='Path of the composed email.')
+    parser.add_argument(
+        '--max-workers',
+        type=int,
+        default=MAX_WORKERS,
+        help='Maximum number of runs fetched concurrently.')
+    args = parser.parse_args()
+
+    try:
+        tf_token = os.environ['TF_API_TOKEN']
+    except KeyError as ke:
+        # Log the missing environment variable and exit.
+        print(f'Unable to find required environment variable: {ke}')
+        exit(1)
+
+    try:
+        run_digests = fetch_run_digests(
+            get_session(tf_token), args.run_ids, args.max_workers)
+    except (requests.RequestException, ijson.JSONError) as plan_error:
+        print('Failed to fetch plans of the runs.')
+        print(plan_error)
+        exit(2)
+
+    totals, digest = render_digest(run_digests)
+    print(f"Digest of {len(run_digests)} plan(s): {totals['add']} to add, "
+          f"{totals['change']} to change, {totals['destroy']} to destroy.")
+    Path(args.output).write_text(digest)
+    print(f"Mail composed and saved as '{args.output}'.")
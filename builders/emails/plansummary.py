@@ -0,0 +1,150 @@
+# This code summarises a Terraform Cloud run's plan and composes an email from
+# it. The JSON execution plan of the run is fetched from Terraform Cloud and
+# parsed as a stream, so memory usage stays bounded no matter how big the plan
+# is. The resource changes in the plan are counted by resource type and action,
+# and the email is rendered from `tfcplanoutput_template.html`. The environment
+# variables required for this script are as follows:
+#
+# `TF_API_TOKEN`: A user token which has access to the run's workspace.
+#
+# Sample usage:
+# $ python3 plansummary.py run-CZcmD7eagjhyX0vN https://app.terraform.io/app/...
+# Plan: 2 to add, 0 to change, 1 to destroy.
+# Mail composed and saved as 'tfcplanoutput.html'.
+
+import argparse
+import os
+from collections import Counter
+from html import escape
+from pathlib import Path
+from string import Template
+
+import ijson
+import requests
+
+TFC_API_URL = 'https://app.terraform.io/api/v2'
+
+# Templates are compiled once, and reused for every render.
+TEMPLATE_DIRECTORY = Path(__file__).resolve().parent
+PLAN_TEMPLATE = Template(
+    (TEMPLATE_DIRECTORY / 'tfcplanoutput_template.html').read_text())
+RESOURCE_ROW_TEMPLATE = Template(
+    '      <tr><td><code>${type}</code></td><td>${action}</td>'
+    '<td align="right">${count}</td></tr>')
+
+# Prefixes of the JSON plan which are of interest. Everything else in the plan,
+# including the potentially huge `before` and `after` values of each resource,
+# is skipped by the parser without being built into Python objects.
+RESOURCE_CHANGE_PREFIX = 'resource_changes.item'
+RESOURCE_TYPE_PREFIX = 'resource_changes.item.type'
+RESOURCE_ACTION_PREFIX = 'resource_changes.item.change.actions.item'
+
+
+def get_session(tf_token):
+    # A single session is shared for all calls so that connections are reused.
+    session = requests.Session()
+    session.headers.update({
+        'Authorization': f'Bearer {tf_token}',
+        'Content-Type': 'application/vnd.api+json',
+    })
+    return session
+
+
+def _get_action(actions):
+    # Map the list of actions of a resource change to a single action, the
+    # same way `terraform plan` does.
+    if actions in (['delete', 'create'], ['create', 'delete']):
+        return 'replace'
+    if actions == ['no-op']:
+        return None
+    return actions[0]
+
+
+def parse_plan(stream):
+    resources = Counter()
+    resource_type = None
+    actions = []
+
+    for prefix, event, value in ijson.parse(stream):
+        if prefix == RESOURCE_TYPE_PREFIX:
+            resource_type = value
+        elif prefix == RESOURCE_ACTION_PREFIX:
+            actions.append(value)
+        elif prefix == RESOURCE_CHANGE_PREFIX and event == 'end_map':
+            action = _get_action(actions)
+            if action:
+                resources[(resource_type, action)] += 1
+            resource_type = None
+            actions = []
+
+    return summarise_resources(resources)
+
+
+def summarise_resources(resources):
+    actions = Counter()
+    for (_, action), count in resources.items():
+        actions[action] += count
+    return {
+        'add': actions['create'] + actions['replace'],
+        'change': actions['update'],
+        'destroy': actions['delete'] + actions['replace'],
+        'resources': resources,
+    }
+
+
+def fetch_plan_summary(session, run_id):
+    # The JSON plan is served through a redirect to a temporary URL. The
+    # response body is streamed into the parser instead of being downloaded.
+    url = f'{TFC_API_URL}/runs/{run_id}/plan/json-output'
+    with session.get(url, stream=True, allow_redirects=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return parse_plan(response.raw)
+
+
+def render_resource_rows(resources):
+    return '\n'.join(
+        RESOURCE_ROW_TEMPLATE.substitute(
+            type=escape(resource_type), action=action, count=count)
+        for (resource_type, action), count in sorted(resources.items()))
+
+
+def render(summary, run_link):
+    return PLAN_TEMPLATE.substitute(
+        add=summary['add'],
+        change=summary['change'],
+        destroy=summary['destroy'],
+        resource_rows=render_resource_rows(summary['resources']),
+        run_link=escape(run_link),
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compose an email summarising a Terraform Cloud plan.')
+    parser.add_argument('run_id', help='ID of the Terraform Cloud run.')
+    parser.add_argument('run_link', help='Link to the run on Terraform Cloud.')
+    parser.add_argument(
+        '--output',
+        default='tfcplanoutput.html',
+        help='Path of the composed email.')
+    args = parser.parse_args()
+
+    try:
+        tf_token = os.environ['TF_API_TOKEN']
+    except KeyError as ke:
+        # Log the missing environment variable and exit.
+        print(f'Unable to find required environment variable: {ke}')
+        exit(1)
+
+    try:
+        summary = fetch_plan_summary(get_session(tf_token), args.run_id)
+    except (requests.RequestException, ijson.JSONError) as plan_error:
+        print(f"Failed to fetch plan of run '{args.run_id}'.")
+        print(plan_error)
+        exit(2)
+
+    print(f"Plan: {summary['add']} to add, {summary['change']} to change, "
+          f"{summary['destroy']} to destroy.")
+    Path(args.output).write_text(render(summary, args.run_link))
+    print(f"Mail composed and saved as '{args.output}'.")
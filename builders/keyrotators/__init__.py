@@ -12,6 +12,9 @@
 # which occurs during key rotation to a file called 'keyrotation-error.log'.
 # Like the 'keyrotation.log' file, this can also be exported as an artifact
 # during workflow run.
+#
+# Both files are only created once something is logged to them, so importing
+# the package (for example, to run `keyrotators.logstats`) leaves no empty logs.
 import logging
 
 # Initialize the logger.
@@ -30,13 +33,13 @@ consolePrintHandler.setFormatter(consoleFormatter)
 logger.addHandler(consolePrintHandler)
 
 # Define log handler for writing info logs to file.
-logFileHandler = logging.FileHandler('keyrotation.log')
+logFileHandler = logging.FileHandler('keyrotation.log', delay=True)
 logFileHandler.setLevel(logging.INFO)
 logFileHandler.setFormatter(formatter)
 logger.addHandler(logFileHandler)
 
 # Define error handler for writing error logs to file.
-errorFileHandler = logging.FileHandler('keyrotation-error.log')
+errorFileHandler = logging.FileHandler('keyrotation-error.log', delay=True)
 errorFileHandler.setLevel(logging.ERROR)
 errorFileHandler.setFormatter(formatter)
 logger.addHandler(errorFileHandler)
@@ -1,6 +1,39 @@
 import argparse
+import re
+from datetime import timedelta
+
+from keyrotators import keyrotator, status
+from keyrotators.backends import hedging
+
+# Units of durations, like '7d' or '12h'.
+DURATION_UNITS = {
+    's': 'seconds',
+    'm': 'minutes',
+    'h': 'hours',
+    'd': 'days',
+    'w': 'weeks',
+}
+
+
+def parse_duration(value):
+    match = re.fullmatch(r'(\d+)([smhdw])', value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not a duration like '7d', '12h' or '2w'.")
+    amount, unit = match.groups()
+    return timedelta(**{DURATION_UNITS[unit]: int(amount)})
+
+
+def parse_percentile(value):
+    try:
+        percentile = float(value)
+    except ValueError:
+        percentile = None
+    if percentile is None or not 0 <= percentile <= 100:
+        raise argparse.ArgumentTypeError(
+            f"'{value}' is not a percentile between 0 and 100.")
+    return percentile
 
-from keyrotators import keyrotator
 
 # Flag to track if any argument was provided.
 no_arguments_provided = True
@@ -26,18 +59,154 @@ parser.add_argument(
          'and Terraform variable set.'
 )
 
+# Argument for AWS key rotation in the accounts of an organization.
+parser.add_argument(
+    '--aws-org',
+    action='store_true',
+    help='Rotate AWS IAM access and secret keys of a user in every account of '
+         'the AWS organization, by assuming a role in each of them.'
+)
+
+# Argument for reporting the rotation result to rotation history.
+parser.add_argument(
+    '--report-url',
+    metavar='URL',
+    help='Post the rotation result to the rotation history ingestion API '
+         'at URL. Requires the ROTATION_HISTORY_TOKEN environment variable.'
+)
+
+# Argument for skipping the checks made before any change.
+parser.add_argument(
+    '--skip-preflight',
+    action='store_true',
+    help='Do not check configuration and access before rotating.'
+)
+
+# Argument for writing secrets and variables even if they are up to date.
+parser.add_argument(
+    '--force-writes',
+    action='store_true',
+    help='Write secrets and variables even if the recorded fingerprint shows '
+         'that the value is already published.'
+)
+
+# Argument for hedging metadata reads which are slower than usual.
+parser.add_argument(
+    '--hedge',
+    type=parse_percentile,
+    nargs='?',
+    const=95,
+    metavar='PERCENTILE',
+    help='Repeat Github and Terraform Cloud metadata reads which take longer '
+         'than PERCENTILE (default: 95) of observed latencies, using the '
+         'first answer.'
+)
+
+# Argument for only rotating credentials which are old enough.
+parser.add_argument(
+    '--if-older-than',
+    type=parse_duration,
+    metavar='DURATION',
+    help="Only rotate credentials older than DURATION, like '7d' or '12h'. "
+         'Checking the age takes a single API call.'
+)
+
+# Argument for keeping the previous AWS key active for a while.
+parser.add_argument(
+    '--overlap',
+    type=parse_duration,
+    metavar='DURATION',
+    help='Keep the previous AWS key active until the new one is propagated, '
+         "and then for up to DURATION, like '48h', or until it is not used "
+         'anymore. Later runs deactivate it.'
+)
+
+# Argument for keeping a tested credential ready for urgent rotations.
+parser.add_argument(
+    '--prepare-standby',
+    action='store_true',
+    help='After any rotation, create and test a standby AWS key or Terraform '
+         'token, kept encrypted in the local standby file, so that the next '
+         'rotation only has to promote it. The encryption key is given, hex '
+         'encoded, in the KEYROTATION_STANDBY_KEY environment variable.'
+)
+
+# Argument for rotating at once with the standby credential.
+parser.add_argument(
+    '--promote-standby',
+    action='store_true',
+    help='Rotate right away, as after a leak: promote the standby credential '
+         'to every target and revoke the current one, ignoring '
+         '--if-older-than and --overlap.'
+)
+
+# Argument for spreading the rotations of many credentials over time.
+parser.add_argument(
+    '--schedule',
+    type=parse_duration,
+    metavar='WINDOW',
+    help="Spread the rotations of --aws-org over WINDOW, like '1h', giving "
+         'every account the same slot in each run and keeping request rates '
+         'under the ceilings in KEYROTATION_RATE_CEILINGS.'
+)
+
+# Argument for reporting the age of all credentials instead of rotating.
+parser.add_argument(
+    '--status',
+    action='store_true',
+    help='Report the age of AWS keys, Terraform Cloud tokens and Github '
+         'secrets of every target.'
+)
+
+# Argument for printing the status as JSON.
+parser.add_argument(
+    '--json',
+    action='store_true',
+    help='Print the status as JSON instead of a table.'
+)
+
+# Argument for reusing a recent status.
+parser.add_argument(
+    '--cache-ttl',
+    type=int,
+    default=0,
+    metavar='SECONDS',
+    help='Reuse the status reported in the last SECONDS seconds.'
+)
+
 # Parse the arguments.
 args = parser.parse_args()
 
+# Enable hedging before any API call is made.
+if args.hedge is not None:
+    hedging.percentile = args.hedge
+
 # Check if Terraform key is to be rotated.
 if args.terraform:
     no_arguments_provided = False
-    keyrotator.terraform_rotator()
+    keyrotator.terraform_rotator(
+        args.report_url, args.skip_preflight, args.force_writes,
+        args.if_older_than, args.prepare_standby, args.promote_standby)
 
 # Check if AWS keys are to be rotated.
 if args.aws:
     no_arguments_provided = False
-    keyrotator.aws_rotator()
+    keyrotator.aws_rotator(
+        args.report_url, args.skip_preflight, args.force_writes,
+        args.if_older_than, args.overlap, args.prepare_standby,
+        args.promote_standby)
+
+# Check if AWS keys are to be rotated in all accounts of the organization.
+if args.aws_org:
+    no_arguments_provided = False
+    keyrotator.aws_org_rotator(
+        args.report_url, args.skip_preflight, args.force_writes,
+        args.if_older_than, args.schedule)
+
+# Check if the status is to be reported.
+if args.status:
+    no_arguments_provided = False
+    status.print_status(args.json, args.cache_ttl)
 
 # Check if no arguments were provided.
 if no_arguments_provided:
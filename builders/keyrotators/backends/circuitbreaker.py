@@ -0,0 +1,222 @@
+import logging
+import threading
+from collections import deque
+from time import monotonic
+from urllib.parse import urlparse
+
+import requests
+from keyrotators.backends import transports
+from terrasnek.exceptions import (TFCHTTPAPIRequestRateLimit,
+                                  TFCHTTPInternalServerError,
+                                  TFCHTTPUnclassified)
+
+logger = logging.getLogger(__name__)
+
+# Circuit breakers per backend host, shared by all concurrent rotations. Once
+# enough of the recent calls to a host have failed, the breaker opens, and
+# calls to the host fail at once instead of waiting out their timeouts. After
+# a while, a single call is let through as a probe. If it succeeds the breaker
+# closes again, and if it fails the breaker stays open for another while.
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Number of recent calls from which the failure rate is computed, and the
+# fewest of them needed before the breaker can open.
+WINDOW_SIZE = 20
+MIN_CALLS = 5
+FAILURE_RATE_THRESHOLD = 0.5
+# Seconds a breaker stays open before letting a probe through.
+OPEN_SECONDS = 30
+# Seconds after which a probe whose outcome was never recorded counts as
+# failed, longer than the timeouts of the HTTP transports and of the AWS
+# clients. Calls of `terrasnek` to Terraform Cloud have no timeout, so a
+# probe to it which hangs only counts as failed after this.
+PROBE_SECONDS = 30
+
+# Errors which mean that the host is unavailable, rather than that the call
+# was wrong.
+HOST_ERRORS = transports.TRANSPORT_ERRORS + (
+    TFCHTTPAPIRequestRateLimit, TFCHTTPInternalServerError, TFCHTTPUnclassified)
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+class CircuitOpenError(requests.RequestException):
+    """The breaker of `host` is open. As a `requests.RequestException`, it is
+    handled wherever a call could not be made at all."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"circuit breaker of '{host}' is open")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, host):
+        self.host = host
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=WINDOW_SIZE)
+        self._opened_at = None
+        self._probing = False
+        self._probe_started = None
+
+    def retry_after(self):
+        if self.state == CLOSED:
+            return 0
+        return max(0, self._opened_at + OPEN_SECONDS - monotonic())
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = monotonic()
+        self._probing = False
+        self._outcomes.clear()
+
+    def allow(self):
+        """Whether a call may be made now. In the half-open state, only the
+        probe may be made."""
+        with _lock:
+            if self.state == HALF_OPEN and self._probing and \
+                    monotonic() - self._probe_started > PROBE_SECONDS:
+                logger.warning(f"Probe of '{self.host}' got no answer. "
+                               'Keeping its circuit breaker open.')
+                self._open()
+            if self.state == OPEN and not self.retry_after():
+                logger.info(f"Circuit breaker of '{self.host}' is half-open. "
+                            'Letting a probe through.')
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                self._probe_started = monotonic()
+                return True
+            return False
+
+    def record(self, success):
+        with _lock:
+            if self.state == HALF_OPEN and self._probing:
+                if success:
+                    logger.info(f"Probe of '{self.host}' succeeded. Closing "
+                                'its circuit breaker.')
+                    self.state = CLOSED
+                    self._probing = False
+                else:
+                    logger.warning(f"Probe of '{self.host}' failed. Keeping "
+                                   f'its circuit breaker open.')
+                    self._open()
+                return
+            if self.state != CLOSED:
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= MIN_CALLS and \
+                    failures / len(self._outcomes) >= FAILURE_RATE_THRESHOLD:
+                logger.warning(
+                    f"{failures} of the last {len(self._outcomes)} calls to "
+                    f"'{self.host}' failed. Opening its circuit breaker for "
+                    f'{OPEN_SECONDS}s.')
+                self._open()
+
+
+def get_host(url):
+    return urlparse(url).netloc
+
+
+def get_breaker(host):
+    with _lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = _breakers[host] = CircuitBreaker(host)
+    return breaker
+
+
+def check(*hosts):
+    """Raise `CircuitOpenError` if the breaker of any of `hosts` is open.
+
+    Called before destructive steps, so that a rotation stops before it
+    changes anything when a backend it needs is down. A half-open breaker
+    does not stop the rotation, as its probe is still to be made.
+    """
+    for host in hosts:
+        breaker = get_breaker(host)
+        with _lock:
+            open_for = breaker.retry_after() if breaker.state == OPEN else 0
+        if open_for:
+            raise CircuitOpenError(host, open_for)
+
+
+def _is_failure(response):
+    status_code = getattr(response, 'status_code', 0)
+    return status_code >= 500 or status_code == 429
+
+
+def guard(host, function, *args, **kwargs):
+    """Call `function` if the breaker of `host` allows it, and record whether
+    the host answered. Raises `CircuitOpenError` otherwise."""
+    breaker = get_breaker(host)
+    if not breaker.allow():
+        raise CircuitOpenError(host, breaker.retry_after())
+    try:
+        response = function(*args, **kwargs)
+    except HOST_ERRORS:
+        breaker.record(False)
+        raise
+    except Exception:
+        # The host answered, but the call was wrong.
+        breaker.record(True)
+        raise
+    breaker.record(not _is_failure(response))
+    return response
+
+
+class GuardedSession:
+    """Session of `transports` whose calls go through the breaker of the host
+    they are made to."""
+
+    def __init__(self, session):
+        self._session = session
+
+    def get(self, url, **kwargs):
+        return guard(get_host(url), self._session.get, url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return guard(get_host(url), self._session.put, url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return guard(get_host(url), self._session.delete, url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+# Hooks for `botocore` clients. A call to a host whose breaker is open is
+# answered with an error in place of the service, so that it raises a
+# `ClientError` at once, without being retried.
+SHORT_CIRCUIT_ERROR_CODE = 'CircuitOpen'
+
+
+class _ShortCircuitResponse:
+    status_code = 503
+
+
+def before_aws_call(host, context, **kwargs):
+    if get_breaker(host).allow():
+        return None
+    context['circuit_open'] = True
+    return _ShortCircuitResponse(), {
+        'Error': {
+            'Code': SHORT_CIRCUIT_ERROR_CODE,
+            'Message': f"Circuit breaker of '{host}' is open.",
+        },
+        'ResponseMetadata': {'HTTPStatusCode': 503},
+    }
+
+
+def after_aws_call(host, context, http_response=None, exception=None,
+                   **kwargs):
+    if context.get('circuit_open'):
+        return
+    get_breaker(host).record(
+        exception is None and not _is_failure(http_response))
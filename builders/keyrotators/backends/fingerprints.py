@@ -0,0 +1,127 @@
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+from hashlib import sha256
+from os import environ as os_environ
+
+logger = logging.getLogger(__name__)
+
+# Local state file with a fingerprint of the value last published to every
+# target, such as a Github secret or a Terraform variable. A write of a value
+# which is already published is skipped, so reruns of a rotation make no
+# write calls. The fingerprints are HMACs, so the file never contains, and
+# cannot be used to guess, the values themselves.
+#
+# Runners of GitHub Actions start without the files of earlier runs, so the
+# workflows restore the state file from the Actions cache, and give the key in
+# the `KEYROTATION_FINGERPRINT_KEY` secret. Without the key, a generated one
+# would be lost with the runner, so no fingerprint is used there and every
+# value is written.
+STATE_FILE = '.keyrotation-state.json'
+# File with the HMAC key, used outside of GitHub Actions when none is given in
+# the `KEYROTATION_FINGERPRINT_KEY` environment variable.
+KEY_FILE = '.keyrotation-fingerprint.key'
+
+# Whether writes are made even when the value is already published.
+force_writes = False
+
+_lock = threading.Lock()
+_key = None
+_without_key = False
+_fingerprints = None
+
+
+def _get_state_file():
+    return os_environ.get('KEYROTATION_STATE_FILE', STATE_FILE)
+
+
+def _get_key():
+    # None when fingerprints cannot be used.
+    global _key, _without_key
+    if _key is not None or _without_key:
+        return _key
+    # An empty value is what an undefined secret of GitHub Actions gives.
+    if os_environ.get('KEYROTATION_FINGERPRINT_KEY'):
+        _key = os_environ['KEYROTATION_FINGERPRINT_KEY'].encode()
+        return _key
+    if os_environ.get('GITHUB_ACTIONS') == 'true':
+        logger.warning("No secret named 'KEYROTATION_FINGERPRINT_KEY'. Every "
+                       'value is written, even if it is published already.')
+        _without_key = True
+        return None
+    logger.debug('No fingerprint key in environment variables. '
+                 f"Using the key in '{KEY_FILE}'.")
+    try:
+        with open(KEY_FILE, 'rb') as key_file:
+            _key = key_file.read()
+    except FileNotFoundError:
+        logger.debug(f"Generating new fingerprint key in '{KEY_FILE}'.")
+        _key = secrets.token_bytes(32)
+        descriptor = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT, 0o600)
+        with os.fdopen(descriptor, 'wb') as key_file:
+            key_file.write(_key)
+    return _key
+
+
+def _load():
+    global _fingerprints
+    if _fingerprints is not None:
+        return _fingerprints
+    state_file = _get_state_file()
+    try:
+        with open(state_file) as state:
+            _fingerprints = json.load(state)
+    except FileNotFoundError:
+        _fingerprints = {}
+    except ValueError:
+        logger.exception(
+            f"Fingerprint state file '{state_file}' is corrupt. Ignoring it.")
+        _fingerprints = {}
+    return _fingerprints
+
+
+def _save():
+    # Written to a temporary file first, so an interrupted run never leaves a
+    # truncated state file behind.
+    state_file = _get_state_file()
+    temporary_file = f'{state_file}.tmp'
+    with open(temporary_file, 'w') as state:
+        json.dump(_fingerprints, state, indent=2, sort_keys=True)
+    os.replace(temporary_file, state_file)
+
+
+def _fingerprint(target, value):
+    message = f'{target}\0{value}'.encode()
+    return hmac.new(_get_key(), message, sha256).hexdigest()
+
+
+def is_published(target, value):
+    """Check whether `value` is the value last published to `target`."""
+    if force_writes:
+        return False
+    with _lock:
+        if _get_key() is None:
+            return False
+        fingerprint = _load().get(target)
+        if fingerprint is None:
+            return False
+        return hmac.compare_digest(fingerprint, _fingerprint(target, value))
+
+
+def record(target, value):
+    with _lock:
+        if _get_key() is None:
+            return
+        _load()[target] = _fingerprint(target, value)
+        _save()
+    logger.debug(f"Recorded fingerprint of value published to '{target}'.")
+
+
+def forget(target):
+    # The value of a target is unknown after a failed write.
+    with _lock:
+        if _load().pop(target, None) is not None:
+            _save()
@@ -1,13 +1,60 @@
 import logging
+import threading
 from base64 import b64encode
-from json import dumps
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps, loads
 from os import environ as os_environ
 
-import requests
+from keyrotators.backends import (circuitbreaker, fingerprints, hedging,
+                                  retry, transports)
 from nacl import encoding, public
 
 logger = logging.getLogger(__name__)
 
+# Repository in which secrets are set. Repository secrets are published to
+# this repository only, unless other target repositories are configured with
+# `GITHUB_TARGET_REPOSITORIES` ('owner/name,owner/name') or selected by topic
+# with `GITHUB_TARGET_TOPIC` (optionally limited to `GITHUB_TARGET_OWNER`).
+REPO_OWNER = 'advaithhl'
+REPO_NAME = 'effective-fishstick'
+
+# Base URL of the API, which differs on Github Enterprise Server. Github
+# Actions sets the variable for workflows.
+GITHUB_API_URL = os_environ.get('GITHUB_API_URL', 'https://api.github.com')
+
+# Maximum number of repositories to which a secret is published at once.
+MAX_PUBLISH_WORKERS = 20
+
+# Number of target repositories, all owned by the same organization, from
+# which a repository secret is set once as an organization secret visible to
+# the selected repositories, instead of in every repository. It can be
+# overridden with `GITHUB_ORG_SECRET_MIN_REPOSITORIES`. A repository secret of
+# the same name takes precedence over the organization secret, so existing
+# repository secrets are deleted once the organization secret is set. If they
+# cannot be checked for or deleted, the secret is set per repository instead.
+ORG_SECRET_MIN_REPOSITORIES = 3
+
+# Session shared by all calls. Over HTTP/2, concurrent calls are multiplexed
+# over one connection. Over HTTP/1.1, connections are kept alive, with enough
+# of them in the pool for every publishing thread. Calls fail at once while
+# the circuit breaker of the API host is open, and transient failures and
+# rate limits are retried.
+_session = retry.RetryingSession(
+    circuitbreaker.GuardedSession(
+        transports.create_session(MAX_PUBLISH_WORKERS)),
+    'github')
+
+# Public keys of repositories, which only change when GitHub rotates them.
+_public_keys_lock = threading.Lock()
+_repo_public_keys = {}
+_org_public_keys = {}
+# IDs of repositories, by owner and name.
+_repo_ids = {}
+# Owners which are not organizations, or on which the PAT lacks the scope for
+# organization secrets.
+_orgs_without_secrets = set()
+# Repositories found by topic, by search query.
+_topic_repositories = {}
 
 # A dictionary which maps possible values of `ENVIRONMENT_NAME` repo variable
 # name to Github environment names.
@@ -17,6 +64,11 @@ environment_mapping = {
     'DEV': 'development',
 }
 
+
+def get_api_host():
+    return circuitbreaker.get_host(GITHUB_API_URL)
+
+
 def _get_github_api_headers(github_pat):
     logger.debug(
         'Getting Github API headers. This is usually for further API calls.')
@@ -31,8 +83,9 @@ def _get_repo_id(repo_owner, repo_name, github_pat):
     headers = _get_github_api_headers(github_pat)
     logger.debug('Making GET call to get repo ID: '
                  f"Repo owner: '{repo_owner}', Repo name: '{repo_name}'.")
-    url = f'https://api.github.com/repos/{repo_owner}/{repo_name}'
-    response = requests.get(
+    url = f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}'
+    response = hedging.hedged_get(
+        'github', _session.get,
         url=url,
         headers=headers
     )
@@ -51,8 +104,8 @@ def _get_repo_public_key(repo_owner, repo_name, github_pat):
 
     logger.debug('Making GET call to get repo public key: '
                  f"Repo owner: '{repo_owner}', Repo name: '{repo_name}'.")
-    url = f'https://api.github.com/repos/{repo_owner}/{repo_name}/actions/secrets/public-key'
-    response = requests.get(
+    url = f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/actions/secrets/public-key'
+    response = _session.get(
         url=url,
         headers=headers
     )
@@ -68,6 +121,25 @@ def _get_repo_public_key(repo_owner, repo_name, github_pat):
     raise exc
 
 
+def _get_cached_repo_public_key(repo_owner, repo_name, github_pat):
+    repository = (repo_owner, repo_name)
+    with _public_keys_lock:
+        repo_public_key = _repo_public_keys.get(repository)
+    if repo_public_key:
+        logger.debug(
+            f"Reusing cached public key of '{repo_owner}/{repo_name}'.")
+        return repo_public_key
+    repo_public_key = _get_repo_public_key(repo_owner, repo_name, github_pat)
+    with _public_keys_lock:
+        _repo_public_keys[repository] = repo_public_key
+    return repo_public_key
+
+
+def _forget_repo_public_key(repo_owner, repo_name):
+    with _public_keys_lock:
+        _repo_public_keys.pop((repo_owner, repo_name), None)
+
+
 def _get_env_public_key(repo_owner, repo_name, environment_name, github_pat):
     logger.debug('Fetching headers for getting environment public key.')
     headers = _get_github_api_headers(github_pat)
@@ -84,8 +156,9 @@ def _get_env_public_key(repo_owner, repo_name, environment_name, github_pat):
 
     logger.debug('Making GET call to get environment public key: '
                  f"Repo ID: '{repository_id}', Environment: '{environment_name}'.")
-    url = f'https://api.github.com/repositories/{repository_id}/environments/{environment_name}/secrets/public-key'
-    response = requests.get(
+    url = f'{GITHUB_API_URL}/repositories/{repository_id}/environments/{environment_name}/secrets/public-key'
+    response = hedging.hedged_get(
+        'github', _session.get,
         url=url,
         headers=headers
     )
@@ -124,7 +197,7 @@ def _set_repo_secret_helper(repo_owner, repo_name, secret_name, secret_value):
 
     logger.debug('Trying to get repository public key.')
     try:
-        gh_public_key_id, gh_public_key = _get_repo_public_key(
+        gh_public_key_id, gh_public_key = _get_cached_repo_public_key(
             repo_owner, repo_name, github_pat)
     except RuntimeError:
         logger.exception(
@@ -148,13 +221,16 @@ def _set_repo_secret_helper(repo_owner, repo_name, secret_name, secret_value):
         "encrypted_value": encrypted_secret,
         "key_id": gh_public_key_id,
     }
-    url = f'https://api.github.com/repos/{repo_owner}/{repo_name}/actions/secrets/{secret_name}'
-    response = requests.put(
+    url = f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/actions/secrets/{secret_name}'
+    response = _session.put(
         url=url,
         headers=headers,
         data=dumps(payload)
     )
     logger.debug(f"Reponse status: {response.status_code}.")
+    if not response.ok:
+        # The cached public key may have been rotated by GitHub.
+        _forget_repo_public_key(repo_owner, repo_name)
     return response.status_code
 
 
@@ -206,8 +282,8 @@ def _set_environment_secret_helper(repo_owner, repo_name, environment_name, secr
         "encrypted_value": encrypted_secret,
         "key_id": gh_public_key_id,
     }
-    url = f'https://api.github.com/repositories/{repository_id}/environments/{environment_name}/secrets/{secret_name}'
-    response = requests.put(
+    url = f'{GITHUB_API_URL}/repositories/{repository_id}/environments/{environment_name}/secrets/{secret_name}'
+    response = _session.put(
         url=url,
         headers=headers,
         data=dumps(payload)
@@ -216,12 +292,439 @@ def _set_environment_secret_helper(repo_owner, repo_name, environment_name, secr
     return response.status_code
 
 
-def set_repo_secret(secret_name, secret_value):
-    repo_owner = 'advaithhl'
-    repo_name = 'effective-fishstick'
+def _parse_repositories(repositories):
+    parsed = []
+    for repository in repositories.split(','):
+        repository = repository.strip()
+        if not repository:
+            continue
+        repo_owner, _, repo_name = repository.partition('/')
+        if not repo_owner or not repo_name:
+            logger.error(f"Ignoring target repository '{repository}', "
+                         "as it is not of the form 'owner/name'.")
+            continue
+        parsed.append((repo_owner, repo_name))
+    return parsed
+
+
+def _search_repositories_by_topic(topic, github_pat, repo_owner=None):
+    headers = _get_github_api_headers(github_pat)
+    query = f'topic:{topic}'
+    if repo_owner:
+        query += f' user:{repo_owner}'
+    if query in _topic_repositories:
+        return _topic_repositories[query]
+
+    logger.debug(f"Making GET calls to search repositories: Query: '{query}'.")
+    url = f'{GITHUB_API_URL}/search/repositories'
+    params = {'q': query, 'per_page': 100}
+    repositories = []
+    while url:
+        response = _session.get(
+            url=url,
+            headers=headers,
+            params=params
+        )
+        logger.debug(f"Reponse status: {response.status_code}.")
+        if not response.ok:
+            exc_json = response.json()
+            exc_json['status_code'] = response.status_code
+            exc = RuntimeError(dumps(exc_json))
+            raise exc
+        for repository in response.json()['items']:
+            if repository['archived']:
+                # Secrets of archived repositories cannot be changed.
+                logger.debug(
+                    f"Skipping archived repository '{repository['full_name']}'.")
+                continue
+            repositories.append(
+                (repository['owner']['login'], repository['name']))
+            _repo_ids[repositories[-1]] = repository['id']
+        # The URL of the next page already contains the query.
+        url = response.links.get('next', {}).get('url')
+        params = None
+    _topic_repositories[query] = repositories
+    return repositories
+
+
+def get_target_repositories():
+    configured_repositories = os_environ.get('GITHUB_TARGET_REPOSITORIES')
+    if configured_repositories:
+        repositories = _parse_repositories(configured_repositories)
+        logger.debug(f'{len(repositories)} target repositories configured.')
+        return repositories
+
+    topic = os_environ.get('GITHUB_TARGET_TOPIC')
+    if not topic:
+        return [(REPO_OWNER, REPO_NAME)]
+    try:
+        github_pat = os_environ['GITHUB_PERSONAL_ACCESS_TOKEN']
+    except KeyError:
+        logger.exception('Github PAT was not found in environment variables.')
+        return []
+    try:
+        repositories = _search_repositories_by_topic(
+            topic, github_pat, os_environ.get('GITHUB_TARGET_OWNER'))
+    except RuntimeError:
+        logger.exception(
+            f"An error occurred when searching repositories with topic '{topic}'.")
+        return []
+    logger.debug(
+        f"{len(repositories)} target repositories found with topic '{topic}'.")
+    return repositories
+
+
+def _run_for_repositories(function, repositories, *args):
+    # Every repository is handled in its own thread, so publishing to many
+    # repositories takes about as long as publishing to one.
+    results = {}
+    if not repositories:
+        return results
+    executor = ThreadPoolExecutor(
+        max_workers=min(MAX_PUBLISH_WORKERS, len(repositories)))
+    with executor:
+        futures = {
+            f'{repo_owner}/{repo_name}':
+                executor.submit(function, repo_owner, repo_name, *args)
+            for repo_owner, repo_name in repositories
+        }
+    for repository, future in futures.items():
+        try:
+            results[repository] = future.result()
+        except transports.TRANSPORT_ERRORS:
+            logger.exception(
+                f"A connection error occurred for repository '{repository}'.")
+            results[repository] = None
+    return results
+
+
+def _fetch_repo_public_key(repo_owner, repo_name, github_pat):
+    try:
+        return _get_cached_repo_public_key(repo_owner, repo_name, github_pat)
+    except RuntimeError as error:
+        return error
+
+
+def fetch_repo_public_keys(repositories, github_pat):
+    """Fetch and cache the public keys of the repositories concurrently.
+
+    Returns the errors of the repositories whose key could not be fetched.
+    """
+    results = _run_for_repositories(
+        _fetch_repo_public_key, repositories, github_pat)
+    return {
+        repository: result
+        for repository, result in results.items()
+        if not isinstance(result, list)
+    }
+
+
+def _get_status_code(error):
+    # Errors of the API calls carry the response body and status as JSON.
+    try:
+        return loads(str(error)).get('status_code')
+    except ValueError:
+        return None
+
+
+def _get_org_public_key(org_name, github_pat):
+    with _public_keys_lock:
+        org_public_key = _org_public_keys.get(org_name)
+    if org_public_key:
+        logger.debug(f"Reusing cached public key of organization '{org_name}'.")
+        return org_public_key
+
+    headers = _get_github_api_headers(github_pat)
+    logger.debug('Making GET call to get organization public key: '
+                 f"Organization: '{org_name}'.")
+    url = f'{GITHUB_API_URL}/orgs/{org_name}/actions/secrets/public-key'
+    response = _session.get(
+        url=url,
+        headers=headers
+    )
+    logger.debug(f"Reponse status: {response.status_code}.")
+    if response.ok:
+        org_public_key = [
+            response.json()['key_id'],
+            response.json()['key'],
+        ]
+        with _public_keys_lock:
+            _org_public_keys[org_name] = org_public_key
+        return org_public_key
+    exc_json = response.json()
+    exc_json['status_code'] = response.status_code
+    exc = RuntimeError(dumps(exc_json))
+    raise exc
+
+
+def _get_org_secret_repositories(org_name, secret_name, github_pat):
+    headers = _get_github_api_headers(github_pat)
+    logger.debug('Making GET calls to get repositories selected for '
+                 f"organization secret '{secret_name}' in '{org_name}'.")
+    url = f'{GITHUB_API_URL}/orgs/{org_name}/actions/secrets/{secret_name}/repositories'
+    params = {'per_page': 100}
+    repositories = {}
+    while url:
+        response = _session.get(
+            url=url,
+            headers=headers,
+            params=params
+        )
+        logger.debug(f"Reponse status: {response.status_code}.")
+        if response.status_code == 404:
+            # The secret does not exist yet.
+            return None
+        if not response.ok:
+            exc_json = response.json()
+            exc_json['status_code'] = response.status_code
+            exc = RuntimeError(dumps(exc_json))
+            raise exc
+        for repository in response.json()['repositories']:
+            repositories[(repository['owner']['login'], repository['name'])] = \
+                repository['id']
+        url = response.links.get('next', {}).get('url')
+        params = None
+    return repositories
+
+
+def _get_cached_repo_id(repo_owner, repo_name, github_pat):
+    repository = (repo_owner, repo_name)
+    if repository not in _repo_ids:
+        try:
+            _repo_ids[repository] = _get_repo_id(
+                repo_owner, repo_name, github_pat)
+        except RuntimeError:
+            logger.exception(
+                'An error occurred when fetching repository ID of '
+                f"'{repo_owner}/{repo_name}'.")
+            return None
+    return _repo_ids[repository]
+
+
+def _uses_org_secret(repositories):
+    try:
+        min_repositories = int(os_environ.get(
+            'GITHUB_ORG_SECRET_MIN_REPOSITORIES', ORG_SECRET_MIN_REPOSITORIES))
+    except ValueError:
+        logger.exception(
+            "'GITHUB_ORG_SECRET_MIN_REPOSITORIES' is not a number.")
+        min_repositories = ORG_SECRET_MIN_REPOSITORIES
+    owners = {repo_owner for repo_owner, _ in repositories}
+    return len(repositories) >= min_repositories and len(owners) == 1 and \
+        not owners & _orgs_without_secrets
+
+
+def org_secrets_available(org_name, github_pat):
+    """Check whether organization secrets of `org_name` can be set.
+
+    Owners which are users, or on which the PAT lacks the scope, are
+    remembered, so that their secrets are set per repository from then on.
+    """
+    try:
+        _get_org_public_key(org_name, github_pat)
+    except RuntimeError as error:
+        if _get_status_code(error) not in (403, 404):
+            raise
+        logger.warning(
+            f"Organization secrets of '{org_name}' cannot be set: {error}. "
+            'Falling back to repository secrets.')
+        _orgs_without_secrets.add(org_name)
+        return False
+    return True
+
+
+def _has_repo_secret(repo_owner, repo_name, secret_name, github_pat):
+    # None when it cannot be told.
+    try:
+        metadata = get_repo_secret_metadata(
+            repo_owner, repo_name, secret_name, github_pat)
+    except RuntimeError:
+        logger.exception(
+            f"An error occurred when checking for repository secret "
+            f"'{secret_name}' in '{repo_owner}/{repo_name}'.")
+        return None
+    return metadata is not None
+
+
+def _delete_repo_secret(repo_owner, repo_name, secret_name, github_pat):
+    headers = _get_github_api_headers(github_pat)
+    logger.debug('Making DELETE call to delete repo secret: '
+                 f"Repo owner: '{repo_owner}', Repo name: '{repo_name}', "
+                 f"Secret name: '{secret_name}'")
+    url = f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/actions/secrets/{secret_name}'
+    response = _session.delete(
+        url=url,
+        headers=headers
+    )
+    logger.debug(f"Reponse status: {response.status_code}.")
+    # A secret which is gone already was deleted by an earlier attempt.
+    if response.status_code not in (204, 404):
+        logger.error(f"Repository secret '{secret_name}' could not be deleted "
+                     f"in '{repo_owner}/{repo_name}'.")
+        return False
+    fingerprints.forget(
+        f'github:repo:{repo_owner}/{repo_name}:{secret_name}')
+    logger.info(f"Repository secret '{secret_name}' has been deleted in "
+                f"'{repo_owner}/{repo_name}', in favour of the organization "
+                'secret.')
+    return True
+
+
+def _set_org_secret_helper(org_name, repositories, secret_name, secret_value):
+    try:
+        github_pat = os_environ['GITHUB_PERSONAL_ACCESS_TOKEN']
+    except KeyError:
+        logger.exception('Github PAT was not found in environment variables.')
+        return None
+    else:
+        logger.debug(
+            'Github PAT successfully fetched from environment variable.')
+
+    logger.debug('Trying to get organization public key.')
+    try:
+        if not org_secrets_available(org_name, github_pat):
+            return None
+        gh_public_key_id, gh_public_key = _get_org_public_key(
+            org_name, github_pat)
+    except RuntimeError:
+        logger.exception(
+            'An error occurred when fetching organization public key.')
+        return False
+
+    logger.debug(
+        f"Encrypting secret value with Github organization public key '{gh_public_key_id}'.")
+    payload = {
+        "encrypted_value": _encrypt(gh_public_key, secret_value),
+        "key_id": gh_public_key_id,
+        "visibility": "selected",
+    }
+
+    # The selection is only sent when it has to change. The IDs of the
+    # repositories which are already selected need not be looked up.
+    try:
+        selected = _get_org_secret_repositories(
+            org_name, secret_name, github_pat)
+    except RuntimeError:
+        logger.exception(
+            'An error occurred when fetching selected repositories.')
+        return False
+    if selected is None or set(selected) != set(repositories):
+        if selected:
+            _repo_ids.update(selected)
+        missing = [
+            repository for repository in repositories
+            if repository not in _repo_ids
+        ]
+        logger.debug(f'Looking up IDs of {len(missing)} repositories.')
+        results = _run_for_repositories(
+            _get_cached_repo_id, missing, github_pat)
+        if None in results.values():
+            logger.error('IDs of some target repositories could not be found.')
+            return False
+        payload['selected_repository_ids'] = [
+            _repo_ids[repository] for repository in repositories
+        ]
+        logger.debug('Selected repositories of the secret will be updated.')
+
+    # Repository secrets of the same name would hide the organization secret
+    # from their repositories, which would keep using the previous value.
+    found = _run_for_repositories(
+        _has_repo_secret, repositories, secret_name, github_pat)
+    if None in found.values():
+        logger.warning(
+            f"Repository secrets named '{secret_name}' could not be checked "
+            'for in every target repository. Not using an organization '
+            'secret.')
+        return None
+    shadowing = [
+        tuple(repository.split('/', 1))
+        for repository, has_secret in found.items() if has_secret
+    ]
+
+    logger.debug('Fetching headers for setting organization secret.')
+    headers = _get_github_api_headers(github_pat)
+
+    logger.debug('Making PUT call to create/update organization secret: '
+                 f"Organization: '{org_name}', Secret name: '{secret_name}'.")
+    url = f'{GITHUB_API_URL}/orgs/{org_name}/actions/secrets/{secret_name}'
+    response = _session.put(
+        url=url,
+        headers=headers,
+        data=dumps(payload)
+    )
+    logger.debug(f"Reponse status: {response.status_code}.")
+    if response.status_code in (403, 404):
+        _orgs_without_secrets.add(org_name)
+        return None
+    if not response.ok:
+        with _public_keys_lock:
+            _org_public_keys.pop(org_name, None)
+        return response.status_code
+
+    if shadowing:
+        logger.debug(f'Deleting repository secrets in {len(shadowing)} '
+                     'repositories, which would hide the organization secret.')
+        deleted = _run_for_repositories(
+            _delete_repo_secret, shadowing, secret_name, github_pat)
+        if not all(deleted.values()):
+            logger.warning(
+                f"Repository secrets named '{secret_name}' could not be "
+                'deleted in every target repository. Setting the secret in '
+                'every repository instead.')
+            return None
+    return response.status_code
+
+
+def _set_org_secret(org_name, repositories, secret_name, secret_value):
+    # Returns None when organization secrets cannot be used at all.
+    logger.debug(f"Organization name: '{org_name}'.")
+    logger.debug(f"Organization secret name: '{secret_name}'.")
+    # The secret has to be written again when the selection changes.
+    target = f'github:org:{org_name}:{secret_name}'
+    published_value = '\0'.join(
+        [secret_value] + sorted(f'{owner}/{name}' for owner, name in repositories))
+    if fingerprints.is_published(target, published_value):
+        logger.info(
+            f"Organization secret named '{secret_name}' is already up to date in "
+            f"'{org_name}' for {len(repositories)} repositories.")
+        return True
+    response_code = _set_org_secret_helper(
+        org_name,
+        repositories,
+        secret_name,
+        secret_value
+    )
+
+    if response_code is None:
+        return None
+    if response_code == 201:
+        actioned = 'created'
+    elif response_code == 204:
+        actioned = 'updated'
+    else:
+        fingerprints.forget(target)
+        logger.error(
+            f"An error occured when creating/updating organization secret '{secret_name}' "
+            f"in '{org_name}'.")
+        return False
+    fingerprints.record(target, published_value)
+
+    logger.info(
+        f"Organization secret named '{secret_name}' has been {actioned} in '{org_name}' "
+        f"for {len(repositories)} repositories.")
+    return True
+
+
+def _set_repo_secret(repo_owner, repo_name, secret_name, secret_value):
     logger.debug(f"Repository owner name: '{repo_owner}'.")
     logger.debug(f"Repository name: '{repo_name}'.")
     logger.debug(f"Repository secret name: '{secret_name}'.")
+    target = f'github:repo:{repo_owner}/{repo_name}:{secret_name}'
+    if fingerprints.is_published(target, secret_value):
+        logger.info(
+            f"Repository secret named '{secret_name}' is already up to date in "
+            f"'{repo_name}' owned by '{repo_owner}'.")
+        return True
     response_code = _set_repo_secret_helper(
         repo_owner,
         repo_name,
@@ -234,9 +737,12 @@ def set_repo_secret(secret_name, secret_value):
     elif response_code == 204:
         actioned = 'updated'
     else:
+        fingerprints.forget(target)
         logger.error(
-            f"An error occured when creating/updating repository secret '{secret_name}'.")
+            f"An error occured when creating/updating repository secret '{secret_name}' "
+            f"in '{repo_name}' owned by '{repo_owner}'.")
         return False
+    fingerprints.record(target, secret_value)
 
     logger.info(
         f"Repository secret named '{secret_name}' has been {actioned} in '{repo_name}' "
@@ -244,14 +750,105 @@ def set_repo_secret(secret_name, secret_value):
     return True
 
 
+def publish_repo_secret(secret_name, secret_value, repositories=None):
+    """Set a repository secret in all target repositories.
+
+    Many repositories of a single organization share one organization secret,
+    if the PAT allows it. Otherwise, the secret is set in every repository
+    concurrently. Returns whether the secret was set, by 'owner/name' of the
+    repository.
+    """
+    if repositories is None:
+        repositories = get_target_repositories()
+    if not repositories:
+        logger.error(
+            f"No target repositories to set repository secret '{secret_name}' in.")
+        return {}
+    if _uses_org_secret(repositories):
+        org_name = repositories[0][0]
+        try:
+            result = _set_org_secret(
+                org_name, repositories, secret_name, secret_value)
+        except transports.TRANSPORT_ERRORS:
+            logger.exception(
+                f"A connection error occurred for organization '{org_name}'.")
+            result = False
+        if result is not None:
+            return {
+                f'{repo_owner}/{repo_name}': result
+                for repo_owner, repo_name in repositories
+            }
+        logger.warning(
+            f"Setting repository secret '{secret_name}' in every repository, "
+            'as the organization secret could not be used.')
+
+    logger.debug(f"Setting repository secret '{secret_name}' in "
+                 f"{len(repositories)} repositories.")
+    results = _run_for_repositories(
+        _set_repo_secret, repositories, secret_name, secret_value)
+    return {repository: bool(result) for repository, result in results.items()}
+
+
+def set_repo_secret(secret_name, secret_value):
+    results = publish_repo_secret(secret_name, secret_value)
+    return bool(results) and all(results.values())
+
+
+def _get_secret_metadata(url, github_pat):
+    headers = _get_github_api_headers(github_pat)
+    logger.debug(f"Making GET call to get secret metadata: URL: '{url}'.")
+    response = hedging.hedged_get(
+        'github', _session.get,
+        url=url,
+        headers=headers
+    )
+    logger.debug(f"Reponse status: {response.status_code}.")
+    if response.status_code == 404:
+        return None
+    if response.ok:
+        return response.json()
+    exc_json = response.json()
+    exc_json['status_code'] = response.status_code
+    exc = RuntimeError(dumps(exc_json))
+    raise exc
+
+
+def get_repo_secret_metadata(repo_owner, repo_name, secret_name, github_pat):
+    """Get the name, creation and update times of a repository secret, or
+    None if there is no such secret."""
+    return _get_secret_metadata(
+        f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/actions/secrets/{secret_name}',
+        github_pat)
+
+
+def get_org_secret_metadata(org_name, secret_name, github_pat):
+    return _get_secret_metadata(
+        f'{GITHUB_API_URL}/orgs/{org_name}/actions/secrets/{secret_name}',
+        github_pat)
+
+
+def get_environment_secret_metadata(repo_owner, repo_name, environment_name,
+                                    secret_name, github_pat):
+    return _get_secret_metadata(
+        f'{GITHUB_API_URL}/repos/{repo_owner}/{repo_name}/environments/{environment_name}/secrets/{secret_name}',
+        github_pat)
+
+
 def set_environment_secret(environment_name, secret_name, secret_value):
-    repo_owner = 'advaithhl'
-    repo_name = 'effective-fishstick'
+    repo_owner = REPO_OWNER
+    repo_name = REPO_NAME
     logger.debug(f"Repository owner name: '{repo_owner}'.")
     logger.debug(f"Repository name: '{repo_name}'.")
     logger.debug(f"Environment name: '{environment_name}'.")
     logger.debug(f"Environment secret name: '{secret_name}'.")
 
+    target = \
+        f'github:environment:{repo_owner}/{repo_name}:{environment_name}:{secret_name}'
+    if fingerprints.is_published(target, secret_value):
+        logger.info(
+            f"Environment secret named '{secret_name}' is already up to date in '{repo_name}' "
+            f"owned by '{repo_owner}' under the environment '{environment_name}'.")
+        return True
     response_code = _set_environment_secret_helper(
         repo_owner,
         repo_name,
@@ -265,9 +862,11 @@ def set_environment_secret(environment_name, secret_name, secret_value):
     elif response_code == 204:
         actioned = 'updated'
     else:
+        fingerprints.forget(target)
         logger.error(
             f"An error occured when creating/updating environment secret '{secret_name}'.")
         return False
+    fingerprints.record(target, secret_value)
 
     logger.info(
         f"Environment secret named '{secret_name}' has been {actioned} in '{repo_name}' "
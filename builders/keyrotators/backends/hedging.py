@@ -0,0 +1,149 @@
+import logging
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from os import environ as os_environ
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Hedging of idempotent metadata reads. When a read has not been answered by
+# the given percentile of the latencies observed for its service, the same
+# read is sent again and whichever answer arrives first is used. It is off
+# unless a percentile is set, with `--hedge` or `KEYROTATION_HEDGE_PERCENTILE`.
+percentile = None
+
+# Delay before hedging, in seconds, until enough latencies have been observed.
+INITIAL_DELAY = 1.0
+MIN_SAMPLES = 5
+# Number of latencies per service from which the percentile is computed.
+MAX_SAMPLES = 200
+# Threads making reads and hedges. Reads come from every publishing thread at
+# once, and each may be hedged, so the pool is large enough for a read and a
+# hedge from each of them. A read waiting for a thread is not hedged for it.
+MAX_WORKERS = 64
+# Hedges which are always allowed, and the fraction of reads which may be
+# hedged on top of that. This keeps hedging from eating into rate limits.
+MIN_HEDGE_BUDGET = 2
+MAX_HEDGE_FRACTION = 0.1
+
+_lock = threading.Lock()
+_executor = None
+_latencies = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+_stats = {'reads': 0, 'hedges': 0, 'hedge_wins': 0, 'saved': 0.0}
+
+
+def _get_percentile():
+    if percentile is not None:
+        return percentile
+    try:
+        hedge_percentile = float(os_environ['KEYROTATION_HEDGE_PERCENTILE'])
+    except KeyError:
+        return None
+    except ValueError:
+        logger.exception("'KEYROTATION_HEDGE_PERCENTILE' is not a number.")
+        return None
+    if not 0 <= hedge_percentile <= 100:
+        logger.error("'KEYROTATION_HEDGE_PERCENTILE' is not between 0 and "
+                     '100. Not hedging.')
+        return None
+    return hedge_percentile
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='hedging')
+    return _executor
+
+
+def _get_delay(service, hedge_percentile):
+    with _lock:
+        latencies = sorted(_latencies[service])
+    if len(latencies) < MIN_SAMPLES:
+        return INITIAL_DELAY
+    index = min(len(latencies) - 1,
+                int(len(latencies) * hedge_percentile / 100))
+    return latencies[index]
+
+
+def _take_hedge():
+    with _lock:
+        budget = MIN_HEDGE_BUDGET + MAX_HEDGE_FRACTION * _stats['reads']
+        if _stats['hedges'] >= budget:
+            return False
+        _stats['hedges'] += 1
+        return True
+
+
+def _timed(service, started_event, function, args, kwargs):
+    started = perf_counter()
+    started_event.set()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        with _lock:
+            _latencies[service].append(perf_counter() - started)
+
+
+def hedged_get(service, function, *args, **kwargs):
+    """Call `function`, which must be an idempotent read, with hedging.
+
+    Without hedging enabled, this is the same as calling `function`.
+    """
+    hedge_percentile = _get_percentile()
+    if hedge_percentile is None:
+        return function(*args, **kwargs)
+
+    with _lock:
+        _stats['reads'] += 1
+    executor = _get_executor()
+    delay = _get_delay(service, hedge_percentile)
+    primary_started = threading.Event()
+    primary = executor.submit(
+        _timed, service, primary_started, function, args, kwargs)
+    # The delay counts from when the read is sent, not from when it was
+    # queued.
+    primary_started.wait()
+    done, _ = wait([primary], timeout=delay)
+    if done or not _take_hedge():
+        return primary.result()
+
+    logger.debug(f"No answer from {service} after {delay * 1000:.0f}ms. "
+                 'Sending a hedged request.')
+    hedge = executor.submit(
+        _timed, service, threading.Event(), function, args, kwargs)
+    pending = {primary, hedge}
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        winner = done.pop()
+        # A failed answer only wins if the other one fails as well.
+        if winner.exception() is None or not pending:
+            break
+    if winner is hedge and winner.exception() is None:
+        hedge_finished = perf_counter()
+        with _lock:
+            _stats['hedge_wins'] += 1
+
+        def _record_saved(future):
+            with _lock:
+                _stats['saved'] += perf_counter() - hedge_finished
+        primary.add_done_callback(_record_saved)
+    return winner.result()
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats)
+
+
+def log_stats():
+    stats = get_stats()
+    if not stats['reads']:
+        return
+    logger.info(
+        f"Hedged {stats['hedges']} of {stats['reads']} metadata reads "
+        f"({stats['hedges'] / stats['reads']:.0%}). Hedges answered first "
+        f"{stats['hedge_wins']} time(s), saving {stats['saved'] * 1000:.0f}ms.")
@@ -0,0 +1,73 @@
+import logging
+from json import dumps
+from os import environ as os_environ
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+def _get_history_api_headers(history_token):
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f'Bearer {history_token}',
+    }
+
+
+def _get_run_payload(provider, environment_name, started_at, finished_at,
+                     successes):
+    # Success flags of the phases are booleans, or None for a phase which was
+    # not applicable. Everything else in `successes` is run metadata.
+    phases = {
+        name: {
+            'success': success,
+            'duration': successes['durations'].get(name),
+        }
+        for name, success in successes.items()
+        if success is None or isinstance(success, bool)
+    }
+    return {
+        'provider': provider,
+        'environment': environment_name,
+        'started_at': started_at.isoformat(),
+        'finished_at': finished_at.isoformat(),
+        'previous_key_id': successes['key_ids'].get('previous'),
+        'new_key_id': successes['key_ids'].get('new'),
+        'deleted_keys': successes.get('deletion', 0),
+        'phases': phases,
+    }
+
+
+def post_rotation_result(report_url, provider, environment_name,
+                         started_at, finished_at, successes):
+    try:
+        history_token = os_environ['ROTATION_HISTORY_TOKEN']
+    except KeyError:
+        logger.exception(
+            'Rotation history token was not found in environment variables.')
+        return False
+
+    payload = {
+        'runs': [
+            _get_run_payload(provider, environment_name,
+                             started_at, finished_at, successes),
+        ]
+    }
+    logger.debug(f"Making POST call to report rotation result to '{report_url}'.")
+    try:
+        response = requests.post(
+            url=report_url,
+            headers=_get_history_api_headers(history_token),
+            data=dumps(payload),
+            timeout=10,
+        )
+    except requests.RequestException:
+        logger.exception('An error occurred when reporting rotation result.')
+        return False
+    logger.debug(f"Reponse status: {response.status_code}.")
+    if response.status_code != 201:
+        logger.error(
+            f"Rotation result could not be reported: '{response.text}'.")
+        return False
+    logger.info('Rotation result has been reported to rotation history.')
+    return True
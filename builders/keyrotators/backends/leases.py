@@ -0,0 +1,251 @@
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import environ as os_environ
+from socket import gethostname
+from time import time
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# Leases on credentials, so that a credential is only rotated by one run at a
+# time, while other credentials are rotated by other runs. A lease expires
+# unless it is renewed, so that a run which dies does not keep it, and every
+# lease on a credential gets a higher fencing token than the one before. A
+# run checks its token before changing targets, and stops if another run took
+# the credential over in the meantime. Where a target can hold it, the token
+# is also recorded there with `get_fence`, so that runs which do not share a
+# store still see each other.
+
+# Local state file of the default store. Runs sharing it cannot rotate the
+# same credential at once. Another store, shared by every machine running
+# rotations, can be plugged in with `set_store`.
+LEASE_FILE = '.keyrotation-leases.db'
+# Seconds a lease lasts without being renewed. Held leases are renewed every
+# third of it.
+LEASE_SECONDS = 300
+
+# Owner of the leases taken by this run.
+OWNER = f'{gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+
+LeaseRecord = namedtuple('LeaseRecord', ['owner', 'token', 'expires_at'])
+
+
+class LeaseHeldError(Exception):
+    def __init__(self, name, record):
+        expires_at = datetime.fromtimestamp(record.expires_at, timezone.utc) \
+            if record else None
+        super().__init__(
+            f"'{name}' is leased by '{record.owner if record else None}' "
+            f'until {expires_at}')
+        self.name = name
+        self.record = record
+
+
+class LeaseLostError(Exception):
+    def __init__(self, name):
+        super().__init__(f"lease on '{name}' was lost to another run")
+        self.name = name
+
+
+class LeaseStore(ABC):
+    """Interface of lease stores. Every method must be atomic across all the
+    runs sharing the store."""
+
+    @abstractmethod
+    def acquire(self, name, owner, ttl):
+        """Lease `name` to `owner` for `ttl` seconds, unless another owner
+        holds an unexpired lease on it.
+
+        Returns the fencing token of the lease, higher than that of any
+        earlier lease on `name`, or None if `name` is leased already.
+        """
+
+    @abstractmethod
+    def renew(self, name, owner, token, ttl):
+        """Extend the lease to `ttl` seconds from now. Returns whether the
+        lease was still held, and so could be renewed."""
+
+    @abstractmethod
+    def release(self, name, owner, token):
+        """End the lease, keeping its fencing token."""
+
+    @abstractmethod
+    def get(self, name):
+        """Get the `LeaseRecord` of the latest lease on `name`, or None."""
+
+
+class SQLiteLeaseStore(LeaseStore):
+    def __init__(self, path):
+        self.path = path
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, '
+                'owner TEXT NOT NULL, token INTEGER NOT NULL, '
+                'expires_at REAL NOT NULL)')
+
+    @contextmanager
+    def _transaction(self):
+        # Transactions take the write lock at once, so that reading and
+        # updating a lease cannot interleave with another run.
+        connection = sqlite3.connect(self.path, timeout=30,
+                                     isolation_level=None)
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    def acquire(self, name, owner, ttl):
+        now = time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT owner, token, expires_at FROM leases WHERE name = ?',
+                (name,)).fetchone()
+            if row and row[0] != owner and row[2] > now:
+                return None
+            # Tokens are kept after a lease is released, so that they never
+            # go down.
+            token = row[1] + 1 if row else 1
+            connection.execute(
+                'INSERT OR REPLACE INTO leases (name, owner, token, expires_at)'
+                ' VALUES (?, ?, ?, ?)', (name, owner, token, now + ttl))
+        return token
+
+    def renew(self, name, owner, token, ttl):
+        now = time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'UPDATE leases SET expires_at = ? WHERE name = ? AND owner = ? '
+                'AND token = ? AND expires_at > ?',
+                (now + ttl, name, owner, token, now))
+            return cursor.rowcount == 1
+
+    def release(self, name, owner, token):
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE leases SET expires_at = 0 WHERE name = ? AND owner = ? '
+                'AND token = ?', (name, owner, token))
+
+    def get(self, name):
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT owner, token, expires_at FROM leases WHERE name = ?',
+                (name,)).fetchone()
+        return LeaseRecord(*row) if row else None
+
+
+_store = None
+_store_lock = threading.Lock()
+_current = threading.local()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteLeaseStore(
+                os_environ.get('KEYROTATION_LEASE_FILE', LEASE_FILE))
+        return _store
+
+
+def set_store(store):
+    global _store
+    with _store_lock:
+        _store = store
+
+
+class Lease:
+    """Lease held by this run, renewed in the background until released."""
+
+    def __init__(self, store, name, token, ttl):
+        self.store = store
+        self.name = name
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._released = threading.Event()
+        self._renewer = threading.Thread(
+            target=self._renew_until_released, daemon=True)
+        self._renewer.start()
+
+    def _renew_until_released(self):
+        while not self._released.wait(self.ttl / 3):
+            try:
+                renewed = self.store.renew(
+                    self.name, OWNER, self.token, self.ttl)
+            except Exception:
+                # Tried again at the next renewal, while the lease lasts.
+                logger.exception(f"Lease on '{self.name}' could not be "
+                                 'renewed.')
+                continue
+            if not renewed:
+                logger.error(f"Lease on '{self.name}' expired before it was "
+                             'renewed.')
+                self.lost = True
+                return
+
+    def is_held(self):
+        if self.lost:
+            return False
+        record = self.store.get(self.name)
+        return record is not None and record.owner == OWNER and \
+            record.token == self.token and record.expires_at > time()
+
+    def release(self):
+        self._released.set()
+        self._renewer.join()
+        self.store.release(self.name, OWNER, self.token)
+        logger.debug(f"Released lease on '{self.name}'.")
+
+
+@contextmanager
+def hold(name, ttl=LEASE_SECONDS):
+    """Hold the lease on `name` in the calling thread.
+
+    Raises `LeaseHeldError` if another run holds it.
+    """
+    store = get_store()
+    token = store.acquire(name, OWNER, ttl)
+    if token is None:
+        raise LeaseHeldError(name, store.get(name))
+    logger.debug(f"Leased '{name}' with fencing token {token}.")
+    lease = Lease(store, name, token, ttl)
+    previous_lease = getattr(_current, 'lease', None)
+    _current.lease = lease
+    try:
+        yield lease
+    finally:
+        _current.lease = previous_lease
+        lease.release()
+
+
+def is_held():
+    """Whether the lease held in the calling thread is still current. True
+    when no lease is held, as for runs which do not take leases."""
+    lease = getattr(_current, 'lease', None)
+    return lease is None or lease.is_held()
+
+
+def get_fence():
+    """Owner and fencing token of the lease held in the calling thread, to be
+    recorded at a target, or None when no lease is held."""
+    lease = getattr(_current, 'lease', None)
+    return lease and f'{OWNER}/{lease.token}'
+
+
+def check():
+    """Raise `LeaseLostError` if the lease held in the calling thread is not
+    current anymore."""
+    if not is_held():
+        raise LeaseLostError(_current.lease.name)
@@ -0,0 +1,320 @@
+import logging
+import random
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from time import monotonic, sleep, time
+
+import requests
+from botocore.exceptions import ClientError
+from botocore.exceptions import ConnectionError as AWSConnectionError
+from botocore.exceptions import (ConnectTimeoutError, EndpointConnectionError,
+                                 HTTPClientError)
+from keyrotators.backends import circuitbreaker, transports
+from terrasnek.exceptions import (TFCHTTPAPIRequestRateLimit,
+                                  TFCHTTPInternalServerError,
+                                  TFCHTTPUnclassified)
+
+logger = logging.getLogger(__name__)
+
+# Retries of calls to every backend, under one policy. Calls which failed
+# transiently are retried after a delay with decorrelated jitter, or after
+# the delay asked for by the server in `Retry-After` or the rate limit
+# headers of GitHub. Calls which are not idempotent are only retried if they
+# were certainly not processed: they were throttled, or never sent.
+
+# Attempts per call, including the first one.
+MAX_ATTEMPTS = 4
+# Bounds of the delays between attempts, in seconds.
+BASE_DELAY = 0.5
+MAX_DELAY = 20
+# Longest delay asked for by a server which is waited for. The call fails
+# instead if the server asks for more.
+MAX_SERVER_DELAY = 60
+# GitHub asks to wait at least a minute after hitting a secondary rate limit
+# without saying how long.
+SECONDARY_RATE_LIMIT_DELAY = 60
+# Seconds for which calls made right after a change, like the first ones with
+# a new key, are retried until the change is visible.
+CONSISTENCY_MAX_TIME = 30
+# Retries which are always allowed per backend, and the fraction of calls
+# which may be retried on top of that. This keeps retries from piling onto a
+# backend which is failing.
+MIN_RETRY_BUDGET = 10
+MAX_RETRY_FRACTION = 0.2
+
+# Statuses of answers to calls which were not processed, and of answers to
+# calls which may have been.
+THROTTLING_STATUS_CODES = {429}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+# AWS operations which do something new every time they are called.
+NON_IDEMPOTENT_AWS_OPERATIONS = {'CreateAccessKey'}
+# Error codes of throttled AWS calls, and of other transient AWS errors.
+AWS_THROTTLING_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'RequestThrottledException', 'TooManyRequestsException',
+    'RequestLimitExceeded', 'RequestThrottled', 'SlowDown',
+}
+AWS_TRANSIENT_ERROR_CODES = {
+    'RequestTimeout', 'RequestTimeoutException', 'PriorRequestNotComplete',
+    'InternalError', 'InternalFailure', 'ServiceUnavailable',
+}
+
+_lock = threading.Lock()
+_stats = defaultdict(
+    lambda: {'calls': 0, 'retries': 0, 'slept': 0.0, 'gave_up': 0})
+
+
+def _parse_retry_after(value):
+    # Either a number of seconds or an HTTP date.
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        logger.debug(f"Ignoring unparsable Retry-After '{value}'.")
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def get_server_delay(headers, text=''):
+    """Seconds to wait before trying again, as asked for by the server in
+    `headers`, or None if it does not say."""
+    if headers is None:
+        return None
+    if headers.get('Retry-After') is not None:
+        return _parse_retry_after(headers['Retry-After'])
+    if headers.get('X-RateLimit-Remaining') == '0' and \
+            headers.get('X-RateLimit-Reset') is not None:
+        try:
+            return max(0.0, float(headers['X-RateLimit-Reset']) - time())
+        except ValueError:
+            return None
+    if 'secondary rate limit' in text:
+        return SECONDARY_RATE_LIMIT_DELAY
+    return None
+
+
+def _classify_response(response):
+    """Whether `response` is a failure to retry, whether the call was
+    certainly not processed, and the delay asked for by the server."""
+    status_code = getattr(response, 'status_code', None)
+    if status_code is None:
+        return False, False, None
+    headers = getattr(response, 'headers', None)
+    if status_code in THROTTLING_STATUS_CODES:
+        return True, True, get_server_delay(headers)
+    if status_code == 403:
+        # GitHub answers with 403 when a rate limit is hit.
+        server_delay = get_server_delay(headers, response.text)
+        return server_delay is not None, True, server_delay
+    if status_code in TRANSIENT_STATUS_CODES:
+        return True, False, get_server_delay(headers)
+    return False, False, None
+
+
+def _classify_error(error):
+    """Whether `error` is a failure to retry, and whether the call was
+    certainly not processed."""
+    if isinstance(error, circuitbreaker.CircuitOpenError):
+        # The breaker decides when the host is tried again.
+        return False, False
+    if isinstance(error, (requests.ConnectTimeout, TFCHTTPAPIRequestRateLimit)):
+        return True, True
+    if isinstance(error, transports.TRANSPORT_ERRORS +
+                  (TFCHTTPInternalServerError, TFCHTTPUnclassified)):
+        return True, False
+    return False, False
+
+
+def _next_delay(previous_delay):
+    # Decorrelated jitter: retries of concurrent calls spread out, instead of
+    # hitting the backend again at the same moments.
+    return min(MAX_DELAY, random.uniform(BASE_DELAY, previous_delay * 3))
+
+
+def _get_delay(backend, operation, attempt, previous_delay, server_delay,
+               reason):
+    """Delay before the next attempt at a call, or None if it is not to be
+    retried. Counts the retry if it is."""
+    if attempt >= MAX_ATTEMPTS:
+        logger.warning(f'{backend} {operation} failed {attempt} times, as '
+                       f'{reason}. Giving up.')
+    elif server_delay is not None and server_delay > MAX_SERVER_DELAY:
+        logger.warning(f'{backend} {operation} failed, as {reason}, and the '
+                       f'server asks to wait {server_delay:.0f}s. Giving up.')
+    else:
+        delay = _next_delay(previous_delay) if server_delay is None \
+            else server_delay
+        with _lock:
+            stats = _stats[backend]
+            if stats['retries'] < \
+                    MIN_RETRY_BUDGET + MAX_RETRY_FRACTION * stats['calls']:
+                stats['retries'] += 1
+                stats['slept'] += delay
+                logger.info(f'{backend} {operation} failed, as {reason}. '
+                            f'Retrying in {delay:.2f}s (attempt '
+                            f'{attempt + 1} of {MAX_ATTEMPTS}).')
+                return delay
+        logger.warning(f'{backend} {operation} failed, as {reason}, and the '
+                       'retry budget is spent. Giving up.')
+    with _lock:
+        _stats[backend]['gave_up'] += 1
+    return None
+
+
+def _count_call(backend):
+    with _lock:
+        _stats[backend]['calls'] += 1
+
+
+def call(backend, operation, function, *args, idempotent=True, **kwargs):
+    """Call `function`, retrying transient failures under the policy.
+
+    Answers with a failed status which is not retried anymore are returned,
+    like any other answer, and errors are raised.
+    """
+    _count_call(backend)
+    delay = BASE_DELAY
+    attempt = 1
+    while True:
+        response = error = server_delay = None
+        try:
+            response = function(*args, **kwargs)
+        except Exception as raised:
+            error = raised
+            retryable, unprocessed = _classify_error(error)
+            reason = type(error).__name__
+        else:
+            retryable, unprocessed, server_delay = _classify_response(response)
+            reason = f'status {getattr(response, "status_code", None)}'
+        if retryable and (idempotent or unprocessed):
+            next_delay = _get_delay(
+                backend, operation, attempt, delay, server_delay, reason)
+        else:
+            next_delay = None
+        if next_delay is None:
+            if error is not None:
+                raise error
+            return response
+        sleep(next_delay)
+        delay = max(next_delay, BASE_DELAY)
+        attempt += 1
+
+
+class RetryingSession:
+    """Session of `transports` whose calls are retried under the policy.
+    Secrets are set with PUT and removed with DELETE, so that doing either
+    again is harmless."""
+
+    def __init__(self, session, backend):
+        self._session = session
+        self._backend = backend
+
+    def get(self, url, **kwargs):
+        return call(self._backend, f'GET {url}', self._session.get, url,
+                    **kwargs)
+
+    def put(self, url, **kwargs):
+        return call(self._backend, f'PUT {url}', self._session.put, url,
+                    **kwargs)
+
+    def delete(self, url, **kwargs):
+        return call(self._backend, f'DELETE {url}', self._session.delete, url,
+                    **kwargs)
+
+    def close(self):
+        self._session.close()
+
+
+def until_consistent(backend, errors, max_time=CONSISTENCY_MAX_TIME):
+    """Decorator retrying a call for up to `max_time` seconds while it raises
+    any of `errors`, which mean that a change, like a new key, has not
+    reached every server yet."""
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            started = monotonic()
+            delay = BASE_DELAY
+            while True:
+                try:
+                    return function(*args, **kwargs)
+                except errors as error:
+                    if _is_short_circuit(error) or \
+                            monotonic() - started + delay > max_time:
+                        raise
+                    delay = _next_delay(delay)
+                    with _lock:
+                        _stats[backend]['retries'] += 1
+                        _stats[backend]['slept'] += delay
+                    logger.debug(
+                        f'{backend} {function.__name__} failed, as '
+                        f'{type(error).__name__}. Retrying in {delay:.2f}s, '
+                        'until the change is visible.')
+                    sleep(delay)
+        return wrapper
+    return decorator
+
+
+def _is_short_circuit(error):
+    return isinstance(error, ClientError) and \
+        error.response['Error']['Code'] == \
+        circuitbreaker.SHORT_CIRCUIT_ERROR_CODE
+
+
+def aws_needs_retry(response=None, operation=None, attempts=None,
+                    caught_exception=None, request_dict=None, **kwargs):
+    """Hook of `botocore` clients, answering whether an attempt is to be
+    retried with the delay before the next one, or None."""
+    if attempts == 1:
+        _count_call('aws')
+    unprocessed = False
+    server_delay = None
+    if caught_exception is not None:
+        if not isinstance(caught_exception,
+                          (HTTPClientError, AWSConnectionError)):
+            return None
+        unprocessed = isinstance(
+            caught_exception, (ConnectTimeoutError, EndpointConnectionError))
+        reason = type(caught_exception).__name__
+    else:
+        http_response, parsed = response
+        error_code = parsed.get('Error', {}).get('Code')
+        if error_code in AWS_THROTTLING_ERROR_CODES or \
+                http_response.status_code in THROTTLING_STATUS_CODES:
+            unprocessed = True
+        elif error_code not in AWS_TRANSIENT_ERROR_CODES and \
+                http_response.status_code not in TRANSIENT_STATUS_CODES:
+            return None
+        reason = error_code or f'status {http_response.status_code}'
+        server_delay = get_server_delay(http_response.headers)
+    if operation.name in NON_IDEMPOTENT_AWS_OPERATIONS and not unprocessed:
+        return None
+    context = request_dict['context']
+    delay = _get_delay('aws', operation.name, attempts,
+                       context.get('retry_delay', BASE_DELAY), server_delay,
+                       reason)
+    if delay is not None:
+        context['retry_delay'] = max(delay, BASE_DELAY)
+    return delay
+
+
+def get_stats():
+    with _lock:
+        return {backend: dict(stats) for backend, stats in _stats.items()}
+
+
+def log_stats():
+    for backend, stats in sorted(get_stats().items()):
+        if not stats['retries'] and not stats['gave_up']:
+            continue
+        logger.info(
+            f"Retried {stats['retries']} of {stats['calls']} {backend} calls, "
+            f"sleeping {stats['slept']:.1f}s in total. Gave up "
+            f"{stats['gave_up']} time(s).")
@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import threading
+from base64 import b64decode, b64encode
+from datetime import datetime, timezone
+from os import environ as os_environ
+
+from nacl import encoding, exceptions, secret
+
+logger = logging.getLogger(__name__)
+
+# Local state file with standby credentials: keys and tokens which were
+# created and tested ahead of time, so that an urgent rotation only has to
+# promote them. Their secrets are encrypted with a secret box, whose key is
+# given, hex encoded, in the `KEYROTATION_STANDBY_KEY` environment variable.
+# The key is never kept next to the standby file, as anybody who can read the
+# file could then decrypt it.
+STANDBY_FILE = '.keyrotation-standby.json'
+
+_lock = threading.Lock()
+_box = None
+
+
+def _get_standby_file():
+    return os_environ.get('KEYROTATION_STANDBY_FILE', STANDBY_FILE)
+
+
+def _get_box():
+    global _box
+    if _box is not None:
+        return _box
+    try:
+        key = encoding.HexEncoder.decode(os_environ['KEYROTATION_STANDBY_KEY'])
+        _box = secret.SecretBox(key)
+    except KeyError:
+        logger.error("No environment variable named 'KEYROTATION_STANDBY_KEY'. "
+                     'Standby credentials cannot be encrypted or decrypted '
+                     'without it.')
+        return None
+    except (ValueError, exceptions.CryptoError):
+        logger.exception("'KEYROTATION_STANDBY_KEY' is not a hex encoded "
+                         f'key of {secret.SecretBox.KEY_SIZE} bytes.')
+        return None
+    return _box
+
+
+def is_available():
+    """Whether standby credentials can be kept, as there is a key to encrypt
+    them with."""
+    return _get_box() is not None
+
+
+def _load():
+    standby_file = _get_standby_file()
+    try:
+        with open(standby_file) as standby:
+            return json.load(standby)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.exception(
+            f"Standby file '{standby_file}' is corrupt. Ignoring it.")
+        return {}
+
+
+def _save(credentials):
+    # Written to a temporary file first, like the fingerprint state, and only
+    # readable by its owner.
+    standby_file = _get_standby_file()
+    temporary_file = f'{standby_file}.tmp'
+    descriptor = os.open(
+        temporary_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as standby:
+        json.dump(credentials, standby, indent=2, sort_keys=True)
+    os.replace(temporary_file, standby_file)
+
+
+def save(name, credential_id, credential_secret, **metadata):
+    """Keep the standby credential of `name`, like 'aws:<user name>',
+    replacing any earlier one."""
+    box = _get_box()
+    if box is None:
+        raise RuntimeError('standby credentials cannot be encrypted')
+    encrypted_secret = box.encrypt(credential_secret.encode())
+    with _lock:
+        credentials = _load()
+        credentials[name] = {
+            **metadata,
+            'id': credential_id,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'secret': b64encode(bytes(encrypted_secret)).decode(),
+        }
+        _save(credentials)
+    logger.debug(f"Saved standby credential '{credential_id}' of '{name}'.")
+
+
+def load(name):
+    """Get the standby credential of `name`, with its secret decrypted, or
+    None if there is none."""
+    with _lock:
+        credential = _load().get(name)
+    if credential is None:
+        return None
+    box = _get_box()
+    if box is None:
+        return None
+    try:
+        credential_secret = box.decrypt(
+            b64decode(credential['secret'])).decode()
+    except exceptions.CryptoError:
+        logger.exception(f"Standby credential of '{name}' cannot be "
+                         'decrypted with the standby key. Ignoring it.')
+        return None
+    return {**credential, 'secret': credential_secret}
+
+
+def get_id(name):
+    """Get the ID of the standby credential of `name`, or None, without
+    decrypting its secret."""
+    with _lock:
+        credential = _load().get(name)
+    return credential['id'] if credential else None
+
+
+def discard(name):
+    with _lock:
+        credentials = _load()
+        if credentials.pop(name, None) is not None:
+            _save(credentials)
+            logger.debug(f"Discarded standby credential of '{name}'.")
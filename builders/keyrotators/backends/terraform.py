@@ -1,10 +1,14 @@
 import logging
 from os import environ as os_environ
 
+from keyrotators.backends import circuitbreaker, fingerprints, hedging, retry
 from terrasnek.api import TFC
 
 logger = logging.getLogger(__name__)
 
+# Host of the Terraform Cloud API, whose circuit breaker guards every call.
+TFC_HOST = 'app.terraform.io'
+
 
 def _get_api():
     logger.debug('Trying to get Terraform Cloud API client.')
@@ -27,12 +31,22 @@ def _get_api():
     return api
 
 
+def call_api(function, *args, idempotent=True, **kwargs):
+    """Call `function` of the API through its circuit breaker, retrying
+    transient failures. Calls which are not `idempotent` are only retried if
+    they were certainly not processed."""
+    return retry.call(
+        'terraform', function.__qualname__, circuitbreaker.guard, TFC_HOST,
+        function, *args, idempotent=idempotent, **kwargs)
+
+
 def _get_workspace_id(api, workspace_name):
     logger.debug(f'Trying to get workspace ID for workspace {workspace_name}')
     search_param = {
         'search': workspace_name
     }
-    workspaces = api.workspaces.list(search=search_param)
+    workspaces = hedging.hedged_get(
+        'terraform', call_api, api.workspaces.list, search=search_param)
     logger.debug(
         f'Fetched workspace ID {workspaces["data"][0]["id"]} for {workspace_name}')
     return workspaces['data'][0]['id']
@@ -40,7 +54,8 @@ def _get_workspace_id(api, workspace_name):
 
 def _get_varset_vars_id(api, workspace_id):
     logger.debug(f'Fetching variable set for workspace {workspace_id}')
-    var_sets = api.var_sets.list_for_workspace(workspace_id)
+    var_sets = hedging.hedged_get(
+        'terraform', call_api, api.var_sets.list_for_workspace, workspace_id)
     logger.debug('Fetched variable set')
     # Only one variable set is assocated to one workspace.
     var_set = var_sets['data'][0]
@@ -55,6 +70,8 @@ def _get_varset_vars_id(api, workspace_id):
 
 def _get_update_var_in_varset_payload(
         key, value, description, sensitivity):
+    # Environment variables, read by the AWS provider, as `build_tfw.py` and
+    # the desired state of `reconcile.py` create them.
     return {
         "data": {
             "type": "vars",
@@ -63,7 +80,7 @@ def _get_update_var_in_varset_payload(
                 "value": value,
                 "description": description,
                 "sensitive": sensitivity,
-                "category": "terraform",
+                "category": "env",
                 "hcl": False
             }
         }
@@ -83,12 +100,30 @@ def _update_variable(
     )
 
     logger.debug(f'Calling API to update variable {payload_key}')
-    api.var_sets.update_var_in_varset(var_set_id, var_id, payload)
+    call_api(api.var_sets.update_var_in_varset, var_set_id, var_id, payload)
     logger.info(f'Updated variable {payload_key}')
 
 
+def _get_variable_target(workspace_name, key):
+    organization_name = os_environ.get('TF_CLOUD_ORGANIZATION', '')
+    return f'terraform:{organization_name}/{workspace_name}:{key}'
+
+
 def _update_aws_keys(workspace_name, aws_access_key_id, aws_secret_access_key):
     logger.info(f'Trying to update AWS keys for {workspace_name}')
+    variables = [
+        ('AWS_ACCESS_KEY_ID', aws_access_key_id),
+        ('AWS_SECRET_ACCESS_KEY', aws_secret_access_key),
+    ]
+    outdated = [
+        not fingerprints.is_published(
+            _get_variable_target(workspace_name, key), value)
+        for key, value in variables
+    ]
+    if not any(outdated):
+        # Not even the workspace needs to be looked up.
+        logger.info(f'AWS keys are already up to date in {workspace_name}')
+        return
     api = _get_api()
     workspace_id = _get_workspace_id(api, workspace_name)
     var_set_id, var_ids = _get_varset_vars_id(api, workspace_id)
@@ -96,18 +131,22 @@ def _update_aws_keys(workspace_name, aws_access_key_id, aws_secret_access_key):
         'Autorotated AWS access key for effective-fishstick',
         'Autorotated AWS secret key for effective-fishstick'
     ]
-    logger.debug('Trying to update access key.')
-    _update_variable(
-        api, var_set_id, var_ids[0],
-        'AWS_ACCESS_KEY_ID', aws_access_key_id,
-        descriptions[0], True
-    )
-    logger.debug('Trying to update secret key.')
-    _update_variable(
-        api, var_set_id, var_ids[1],
-        'AWS_SECRET_ACCESS_KEY', aws_secret_access_key,
-        descriptions[1], True
-    )
+    for index, (key, value) in enumerate(variables):
+        target = _get_variable_target(workspace_name, key)
+        if not outdated[index]:
+            logger.debug(f'Variable {key} is already up to date.')
+            continue
+        logger.debug(f'Trying to update {key}.')
+        try:
+            _update_variable(
+                api, var_set_id, var_ids[index],
+                key, value,
+                descriptions[index], True
+            )
+        except Exception:
+            fingerprints.forget(target)
+            raise
+        fingerprints.record(target, value)
 
 
 def update_aws_keys(workspace_name, aws_access_key_id, aws_secret_access_key):
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import threading
+from os import environ as os_environ
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Seconds to connect, and to wait for an answer, in either transport, so that
+# a hung call fails and counts against the breaker of its host.
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+# Errors raised by either transport when a request cannot be made at all.
+if httpx is None:
+    TRANSPORT_ERRORS = (requests.RequestException,)
+else:
+    TRANSPORT_ERRORS = (requests.RequestException, httpx.HTTPError)
+
+
+class _Response:
+    # Gives responses of `httpx` the parts of the `requests` interface which
+    # the backends use.
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.ok = response.status_code < 400
+        self.links = response.links
+        self.headers = response.headers
+        self.text = response.text
+        self.http_version = response.http_version
+
+    def json(self):
+        return self._response.json()
+
+
+class HTTP2Session:
+    """HTTP/2 session which multiplexes concurrent requests from all threads
+    over a single connection per host.
+
+    Servers which do not support HTTP/2 are spoken to in HTTP/1.1. The
+    connection state of HTTP/2 (like its header compression) must not be
+    changed by several threads at once, so the client runs in an event loop
+    of its own thread, and other threads hand their requests over to it.
+    """
+
+    def __init__(self, max_connections, prior_knowledge=False):
+        # `h2` is needed for HTTP/2, so this raises `ImportError` without it.
+        self._client = httpx.AsyncClient(
+            http1=not prior_knowledge,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+        )
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(
+            target=self._loop.run_forever, name='http2-transport',
+            daemon=True).start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def get(self, url, headers=None, params=None):
+        return _Response(self._run(
+            self._client.get(url, headers=headers, params=params)))
+
+    def put(self, url, headers=None, data=None):
+        return _Response(self._run(
+            self._client.put(url, headers=headers, content=data)))
+
+    def delete(self, url, headers=None):
+        return _Response(self._run(
+            self._client.delete(url, headers=headers)))
+
+    def close(self):
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class _TimeoutAdapter(HTTPAdapter):
+    # `requests` waits forever unless every call is given a timeout.
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def _create_http1_session(max_connections):
+    session = requests.Session()
+    adapter = _TimeoutAdapter(pool_maxsize=max_connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def create_session(max_connections, transport=None, prior_knowledge=False):
+    """Create a session with the transport in `transport` or, without it,
+    in `KEYROTATION_HTTP_TRANSPORT`: 'http1' (the default) or 'http2'.
+
+    HTTP/2 is opt-in until it has been proven against the real APIs. It falls
+    back to HTTP/1.1 over `requests` if `httpx` or `h2` is not installed.
+    """
+    transport = transport or os_environ.get(
+        'KEYROTATION_HTTP_TRANSPORT', 'http1')
+    if transport == 'http2':
+        if httpx is not None:
+            try:
+                session = HTTP2Session(max_connections, prior_knowledge)
+            except ImportError:
+                logger.warning(
+                    "Package 'h2' is not installed. Falling back to HTTP/1.1.")
+            else:
+                logger.debug('Using HTTP/2 transport.')
+                return session
+        else:
+            logger.warning(
+                "Package 'httpx' is not installed. Falling back to HTTP/1.1.")
+    elif transport != 'http1':
+        logger.error(
+            f"Unknown HTTP transport '{transport}'. Falling back to HTTP/1.1.")
+    logger.debug('Using HTTP/1.1 transport.')
+    return _create_http1_session(max_connections)
@@ -1,13 +1,123 @@
 import logging
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from os import environ as os_environ
+from time import sleep
 
-from keyrotators.providers import aws, terraform
+from keyrotators import preflight, scheduler
+from keyrotators.backends import (circuitbreaker, fingerprints, hedging,
+                                  leases, retry)
+from keyrotators.backends.history import post_rotation_result
+from keyrotators.providers import aws, aws_clients, aws_org, terraform
 
 logger = logging.getLogger(__name__)
 
 
-def terraform_rotator():
+def _rotation_due(credential_name, get_age, if_older_than):
+    if if_older_than is None:
+        return True
+    try:
+        age = get_age()
+    except Exception:
+        logger.exception(
+            f'Age of the current {credential_name} could not be checked.')
+        return True
+    if age is None:
+        logger.info(f'Age of the current {credential_name} is unknown. '
+                    'Rotating it.')
+        return True
+    # Microseconds only clutter the log.
+    age -= timedelta(microseconds=age.microseconds)
+    if age < if_older_than:
+        logger.info(f'Current {credential_name} is {age} old. Rotation is '
+                    f'only due once it is older than {if_older_than}.')
+        return False
+    logger.info(f'Current {credential_name} is {age} old. Rotation is due.')
+    return True
+
+
+def _rotate_when_available(rotatekeys):
+    # Rotations check the circuit breakers of the backends they need before
+    # changing anything, so one which is stopped is safe to run again.
+    for deferral in range(scheduler.MAX_DEFERRALS + 1):
+        try:
+            return rotatekeys()
+        except circuitbreaker.CircuitOpenError as error:
+            if deferral == scheduler.MAX_DEFERRALS:
+                logger.critical(
+                    f'Rotation was deferred {deferral} times, as {error}. '
+                    'Giving up!')
+                return None
+            logger.warning(f'Rotation stopped before any change, as {error}. '
+                           f'Retrying in {error.retry_after:.0f}s.')
+            sleep(error.retry_after)
+
+
+def _prepare_standby(credential_name, prepare_standby):
+    try:
+        prepared = prepare_standby()
+    except circuitbreaker.CircuitOpenError as error:
+        logger.error(
+            f'Standby {credential_name} could not be prepared, as {error}.')
+        return
+    if not prepared:
+        logger.error(f'Standby {credential_name} could not be prepared. '
+                     'See accompanying logs for more information.')
+
+
+def _run_with_lease(credential_name, lease_name, rotator, *args):
+    # Everything done to a credential, from ending overlaps to preparing its
+    # standby, is done under its lease.
+    try:
+        with leases.hold(lease_name):
+            rotator(*args)
+    except leases.LeaseHeldError as error:
+        logger.warning(f'{credential_name} is not rotated, as {error}.')
+    except leases.LeaseLostError as error:
+        logger.critical(f'{credential_name} rotation stopped before any '
+                        f'change, as {error}.')
+
+
+def _log_emergency_rotation(credential_name):
+    logger.warning(
+        f'Emergency rotation of the {credential_name}. Its standby is promoted '
+        'right away, or a new one is created if there is no standby.')
+
+
+def terraform_rotator(report_url=None, skip_preflight=False,
+                      force_writes=False, if_older_than=None,
+                      prepare_standby=False, promote_standby=False):
+    fingerprints.force_writes = force_writes
+    _run_with_lease(
+        'Terraform token',
+        f"terraform:{os_environ.get('TF_CLOUD_ORGANIZATION', '')}",
+        _terraform_rotator, report_url, skip_preflight, if_older_than,
+        prepare_standby, promote_standby)
+
+
+def _terraform_rotator(report_url, skip_preflight, if_older_than,
+                       prepare_standby, promote_standby):
+    if promote_standby:
+        _log_emergency_rotation('Terraform token')
+        if_older_than = None
+    if _rotation_due('Terraform token', terraform.get_current_token_age,
+                     if_older_than):
+        _rotate_terraform(report_url, skip_preflight)
+    if prepare_standby:
+        _prepare_standby('Terraform token', terraform.prepare_standby)
+
+
+def _rotate_terraform(report_url, skip_preflight):
+    if not skip_preflight and not preflight.check_terraform():
+        logger.critical('Pre-flight checks for Terraform key rotation failed. '
+                        'Aborting before any change is made!')
+        return
     logger.info('Initiating Terraform key rotation.')
-    successes = terraform.rotatekeys()
+    started_at = datetime.now(timezone.utc)
+    successes = _rotate_when_available(terraform.rotatekeys)
+    finished_at = datetime.now(timezone.utc)
+    if successes is None:
+        return
 
     logger.debug(
         'Terraform keyrotation result - New token creation:'
@@ -21,11 +131,61 @@ def terraform_rotator():
     logger.debug(
         'Terraform keyrotation result - Setting Github secret:'
         f' {success_string_printer(successes["github"])}')
+    hedging.log_stats()
+    retry.log_stats()
+
+    if report_url:
+        post_rotation_result(
+            report_url, 'terraform', '', started_at, finished_at, successes)
+
+
+def aws_rotator(report_url=None, skip_preflight=False, force_writes=False,
+                if_older_than=None, overlap=None, prepare_standby=False,
+                promote_standby=False):
+    fingerprints.force_writes = force_writes
+    # Leased under the same name as in organization rotations of the user.
+    lease_name = aws.get_current_lease_name()
+    if lease_name is None:
+        logger.critical('User of the AWS access key could not be identified, '
+                        'so it cannot be leased. Aborting before any change '
+                        'is made!')
+        return
+    _run_with_lease(
+        'AWS access key', lease_name, _aws_rotator, report_url,
+        skip_preflight, if_older_than, overlap, prepare_standby,
+        promote_standby)
+
 
+def _aws_rotator(report_url, skip_preflight, if_older_than, overlap,
+                 prepare_standby, promote_standby):
+    # Overlaps of earlier rotations end between rotations, so this runs
+    # whether or not a rotation is due.
+    finalized = aws.finalize_overlap()
+    if finalized:
+        logger.info(f'{finalized} previous key(s) deactivated after overlap.')
+    if promote_standby:
+        # The previous key may be leaked, so it is deactivated right away.
+        _log_emergency_rotation('AWS access key')
+        if_older_than = None
+        overlap = None
+    if _rotation_due('AWS access key', aws.get_current_key_age,
+                     if_older_than):
+        _rotate_aws(report_url, skip_preflight, overlap)
+    if prepare_standby:
+        _prepare_standby('AWS access key', aws.prepare_standby)
 
-def aws_rotator():
+
+def _rotate_aws(report_url, skip_preflight, overlap):
+    if not skip_preflight and not preflight.check_aws():
+        logger.critical('Pre-flight checks for AWS key rotation failed. '
+                        'Aborting before any change is made!')
+        return
     logger.info('Initiating AWS key rotation.')
-    successes = aws.rotatekeys()
+    started_at = datetime.now(timezone.utc)
+    successes = _rotate_when_available(partial(aws.rotatekeys, overlap))
+    finished_at = datetime.now(timezone.utc)
+    if successes is None:
+        return
 
     logger.debug(
         'AWS keyrotation result - Number of deactivated tokens deleted:'
@@ -45,6 +205,53 @@ def aws_rotator():
     logger.debug(
         'AWS keyrotation result - Setting Terraform secret:'
         f' {success_string_printer(successes["terraform"])}')
+    if successes['rollback'] is not None:
+        logger.debug(
+            'AWS keyrotation result - Rollback to previous key:'
+            f' {success_string_printer(successes["rollback"])}')
+    aws_clients.log_request_timings()
+    hedging.log_stats()
+    retry.log_stats()
+
+    if report_url:
+        post_rotation_result(
+            report_url, 'aws', os_environ.get('ENVIRONMENT_NAME', ''),
+            started_at, finished_at, successes)
+
+
+def aws_org_rotator(report_url=None, skip_preflight=False, force_writes=False,
+                    if_older_than=None, schedule_window=None):
+    fingerprints.force_writes = force_writes
+    if not skip_preflight and not preflight.check_aws_org():
+        logger.critical('Pre-flight checks for AWS organization key rotation '
+                        'failed. Aborting before any change is made!')
+        return
+    logger.info('Initiating AWS organization key rotation.')
+    started_at = datetime.now(timezone.utc)
+    results = aws_org.rotatekeys(if_older_than, schedule_window)
+    finished_at = datetime.now(timezone.utc)
+
+    for account_id, successes in results.items():
+        if successes is None:
+            logger.debug(f'AWS organization keyrotation result - {account_id}: failed')
+            continue
+        if successes.pop('skipped'):
+            logger.debug(
+                f'AWS organization keyrotation result - {account_id}: not due')
+            continue
+        logger.debug(
+            f'AWS organization keyrotation result - {account_id}: '
+            f'creation {success_string_printer(successes["creation"])}, '
+            f'testing {success_string_printer(successes["testing"])}, '
+            f'Github {success_string_printer(successes["github"])}, '
+            f'Terraform {success_string_printer(successes["terraform"])}')
+        if report_url:
+            post_rotation_result(
+                report_url, 'aws', successes.pop('environment'),
+                started_at, finished_at, successes)
+    aws_clients.log_request_timings()
+    hedging.log_stats()
+    retry.log_stats()
 
 
 def no_rotation():
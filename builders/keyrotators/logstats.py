@@ -0,0 +1,300 @@
+"""Statistics of key rotations, reconstructed from `keyrotation.log` files.
+
+Usage: python -m keyrotators.logstats [--group-by quarter] PATH [PATH ...]
+
+Every file is memory-mapped and scanned with a single compiled pattern, which
+only matches the lines marking the progress of a rotation, and error lines.
+Nothing but fixed-size aggregates is kept in memory, so memory use stays
+constant however many gigabytes of logs are scanned.
+"""
+import argparse
+import heapq
+import json
+import mmap
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+# Messages which mark the progress of a rotation, logged by the providers and
+# `keyrotator` in `keyrotation.log`. A run marker maps to the provider and the
+# first phase of the run. A phase marker maps to the phase it completes, the
+# phase which is in progress afterwards, and whether the next phase starts
+# timing from this message. A phase completed more than once (like a secret
+# set for both keys) keeps timing from its start.
+RUN_MARKERS = {
+    'Initiating AWS key rotation.': ('aws', 'creation'),
+    'Initiating Terraform key rotation.': ('terraform', 'creation'),
+}
+PHASE_MARKERS = {
+    # AWS
+    'New access key generated.': ('creation', 'testing', True),
+    'Newly generated access keys passed the test.':
+        ('testing', 'deactivation', True),
+    'Deactivation of current key is successful.':
+        ('deactivation', 'github', True),
+    'Updating keys on Github.': (None, 'github', True),
+    'Environment secret named ': ('github', 'github', False),
+    'Updating keys on Terraform.': (None, 'terraform', True),
+    'Successfully updated AWS keys ': ('terraform', None, True),
+    # Terraform
+    'Newly generated token has version ': ('creation', 'testing', True),
+    'Newly generated token passed the test.':
+        ('testing', 'destruction', True),
+    'Destruction of current token is successful.':
+        ('destruction', 'github', True),
+    'Newly generated token was successfully stored as Github secret.':
+        ('github', None, True),
+}
+
+# Matches a timestamped line with either an error level, or one of the marker
+# messages. Requiring the preceding newline makes the regex engine jump from
+# line to line instead of trying to match at every position; the first line of
+# a file is matched separately.
+_LINE_BODY = (
+    rb'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}):[^:\n]*:'
+    rb'(?:(ERROR|CRITICAL):|[A-Z]+:(' +
+    b'|'.join(
+        re.escape(marker.encode())
+        for marker in sorted({**RUN_MARKERS, **PHASE_MARKERS}, key=len,
+                             reverse=True)) +
+    rb'))')
+FIRST_LINE_PATTERN = re.compile(_LINE_BODY)
+LINE_PATTERN = re.compile(rb'\n' + _LINE_BODY)
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+HISTOGRAM_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300, 600, float('inf')]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, value):
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+    def percentile(self, fraction):
+        threshold = fraction * self.total
+        cumulative = 0
+        for bound, count in zip(HISTOGRAM_BUCKETS, self.counts):
+            cumulative += count
+            if count and cumulative >= threshold:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            'count': self.total,
+            'mean': self.sum / self.total if self.total else None,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'buckets': {
+                str(bound): count
+                for bound, count in zip(HISTOGRAM_BUCKETS, self.counts)
+            },
+        }
+
+
+class Stats:
+    def __init__(self, slowest, group_by):
+        self.slowest_count = slowest
+        self.group_by = group_by
+        self.phases = defaultdict(Histogram)
+        self.totals = defaultdict(Histogram)
+        self.periods = defaultdict(Histogram)
+        self.failures = Counter()
+        self.slowest = []
+        self.runs = 0
+
+    def _period(self, started_at):
+        if self.group_by == 'quarter':
+            return f'{started_at.year}-Q{(started_at.month - 1) // 3 + 1}'
+        return f'{started_at.year}-{started_at.month:02d}'
+
+    def finish_run(self, run):
+        if run is None:
+            return
+        provider, started_at, source = \
+            run['provider'], run['started_at'], run['source']
+        duration = (run['last_at'] - started_at).total_seconds()
+        self.runs += 1
+        for phase, phase_duration in run['phases'].items():
+            self.phases[(provider, phase)].add(phase_duration)
+        self.totals[provider].add(duration)
+        self.periods[(provider, self._period(started_at))].add(duration)
+        entry = (duration, provider, started_at.isoformat(), source)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest_count:
+            heapq.heappushpop(self.slowest, entry)
+
+
+def _iter_matches(log_map):
+    first_line = FIRST_LINE_PATTERN.match(log_map)
+    if first_line:
+        yield first_line.groups()
+    for match in LINE_PATTERN.finditer(log_map):
+        yield match.groups()
+
+
+def scan_file(path, stats):
+    run = None
+    with open(path, 'rb') as log_file:
+        try:
+            log_map = mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            return
+        with log_map:
+            for timestamp, error, marker in _iter_matches(log_map):
+                if error:
+                    provider = run['provider'] if run else 'unknown'
+                    phase = run['phase'] if run else None
+                    stats.failures[(provider, phase or 'unknown')] += 1
+                    continue
+
+                logged_at = datetime.fromisoformat(timestamp.decode())
+                marker = marker.decode()
+                if marker in RUN_MARKERS:
+                    stats.finish_run(run)
+                    provider, next_phase = RUN_MARKERS[marker]
+                    run = {
+                        'provider': provider,
+                        'started_at': logged_at,
+                        'source': str(path),
+                        'phase': next_phase,
+                        'phase_started_at': logged_at,
+                        'last_at': logged_at,
+                        'phases': {},
+                    }
+                    continue
+                if run is None:
+                    continue
+
+                completed, next_phase, resets = PHASE_MARKERS[marker]
+                if completed:
+                    run['phases'][completed] = \
+                        (logged_at - run['phase_started_at']).total_seconds()
+                if resets:
+                    run['phase_started_at'] = logged_at
+                run['phase'] = next_phase
+                run['last_at'] = logged_at
+    stats.finish_run(run)
+
+
+def iter_log_files(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            # Error logs only duplicate the error lines of the main log.
+            yield from sorted(
+                log_path for log_path in path.rglob('keyrotation*.log')
+                if not log_path.name.endswith('-error.log'))
+        else:
+            yield path
+
+
+def report(stats):
+    return {
+        'runs': stats.runs,
+        'total_duration': {
+            provider: histogram.as_dict()
+            for provider, histogram in sorted(stats.totals.items())
+        },
+        'phase_duration': {
+            f'{provider}.{phase}': histogram.as_dict()
+            for (provider, phase), histogram in sorted(stats.phases.items())
+        },
+        'periods': {
+            f'{provider} {period}': histogram.as_dict()
+            for (provider, period), histogram in sorted(stats.periods.items())
+        },
+        'failures': {
+            f'{provider}.{phase}': count
+            for (provider, phase), count in sorted(
+                stats.failures.items(), key=str)
+        },
+        'slowest_runs': [
+            {'duration': duration, 'provider': provider,
+             'started_at': started_at, 'file': source}
+            for duration, provider, started_at, source in sorted(
+                stats.slowest, reverse=True)
+        ],
+    }
+
+
+def _format_histogram(name, histogram):
+    lines = [
+        f"  {name}: {histogram['count']} run(s), "
+        f"mean {histogram['mean']:.1f}s, "
+        f"p50 <= {histogram['p50']}s, p95 <= {histogram['p95']}s"
+    ]
+    peak = max(histogram['buckets'].values()) or 1
+    for bound, count in histogram['buckets'].items():
+        if count:
+            bar = '#' * max(1, round(40 * count / peak))
+            lines.append(f'    <= {bound:>5}s {count:>8} {bar}')
+    return lines
+
+
+def print_report(result):
+    lines = [f"Runs: {result['runs']}", '', 'Total duration:']
+    for name, histogram in result['total_duration'].items():
+        lines += _format_histogram(name, histogram)
+    lines += ['', 'Phase duration:']
+    for name, histogram in result['phase_duration'].items():
+        lines += _format_histogram(name, histogram)
+    lines += ['', 'Total duration by period:']
+    for name, histogram in result['periods'].items():
+        lines.append(
+            f"  {name}: {histogram['count']} run(s), "
+            f"mean {histogram['mean']:.1f}s, p50 <= {histogram['p50']}s, "
+            f"p95 <= {histogram['p95']}s")
+    lines += ['', 'Failures by phase:']
+    for name, count in result['failures'].items():
+        lines.append(f'  {name}: {count}')
+    lines += ['', 'Slowest runs:']
+    for run in result['slowest_runs']:
+        lines.append(
+            f"  {run['duration']:.1f}s {run['provider']} "
+            f"started at {run['started_at']} ({run['file']})")
+    print('\n'.join(lines))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m keyrotators.logstats',
+        description='Reconstruct key rotation statistics from log files.',
+    )
+    parser.add_argument(
+        'paths', nargs='+', metavar='PATH',
+        help='Log files, or directories containing keyrotation*.log files.')
+    parser.add_argument(
+        '--group-by', choices=['month', 'quarter'], default='month',
+        help='Period by which run durations are grouped.')
+    parser.add_argument(
+        '--slowest', type=int, default=10,
+        help='Number of slowest runs to list.')
+    parser.add_argument(
+        '--json', action='store_true', help='Print the report as JSON.')
+    args = parser.parse_args(argv)
+
+    stats = Stats(args.slowest, args.group_by)
+    for path in iter_log_files(args.paths):
+        scan_file(path, stats)
+
+    result = report(stats)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == '__main__':
+    main()
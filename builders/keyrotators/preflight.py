@@ -0,0 +1,303 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from os import environ as os_environ
+
+from botocore.exceptions import ClientError
+from keyrotators.backends import github as github_backend
+from keyrotators.backends import terraform as terraform_backend
+from keyrotators.providers import aws as aws_provider
+from keyrotators.providers import aws_clients, aws_org
+from keyrotators.providers import terraform as terraform_provider
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which checks which have not finished are considered failed.
+# Long enough for slow but healthy APIs, and for a retry of a throttled call.
+# It can be overridden with `KEYROTATION_PREFLIGHT_TIMEOUT`.
+PREFLIGHT_TIMEOUT = 15
+
+# IAM actions which the AWS key rotation performs on its own user.
+AWS_REQUIRED_ACTIONS = [
+    'iam:GetUser',
+    'iam:ListAccessKeys',
+    'iam:CreateAccessKey',
+    'iam:UpdateAccessKey',
+    'iam:DeleteAccessKey',
+    'iam:TagUser',
+    'iam:ListUserTags',
+    'iam:UntagUser',
+    'iam:GetAccessKeyLastUsed',
+]
+
+AWS_REQUIRED_ENVIRONMENT_VARIABLES = [
+    'ENVIRONMENT_NAME',
+    'AWS_ACCESS_KEY_ID',
+    'AWS_SECRET_ACCESS_KEY',
+    'GITHUB_PERSONAL_ACCESS_TOKEN',
+    'TF_API_TOKEN',
+    'TF_CLOUD_ORGANIZATION',
+]
+
+AWS_ORG_REQUIRED_ENVIRONMENT_VARIABLES = [
+    'AWS_ACCESS_KEY_ID',
+    'AWS_SECRET_ACCESS_KEY',
+    'AWS_ORG_USER_NAME',
+    'AWS_ORG_ENVIRONMENTS',
+    'GITHUB_PERSONAL_ACCESS_TOKEN',
+    'TF_API_TOKEN',
+    'TF_CLOUD_ORGANIZATION',
+]
+
+TERRAFORM_REQUIRED_ENVIRONMENT_VARIABLES = [
+    'GITHUB_PERSONAL_ACCESS_TOKEN',
+    'TF_API_TOKEN',
+    'TF_CLOUD_ORGANIZATION',
+]
+
+
+class PreflightError(Exception):
+    pass
+
+
+def _check_environment_variables(names):
+    missing = [name for name in names if not os_environ.get(name)]
+    if missing:
+        raise PreflightError(
+            f'Missing environment variable(s): {", ".join(missing)}.')
+    environment_name = os_environ.get('ENVIRONMENT_NAME')
+    if 'ENVIRONMENT_NAME' in names and \
+            environment_name not in github_backend.environment_mapping:
+        raise PreflightError(
+            'Environment must be one of '
+            f'{list(github_backend.environment_mapping.keys())}. '
+            f"Currently, it is '{environment_name}'.")
+
+
+def _check_github_repository():
+    github_pat = os_environ['GITHUB_PERSONAL_ACCESS_TOKEN']
+    repositories = github_backend.get_target_repositories()
+    if not repositories:
+        raise PreflightError('No target repositories were found.')
+    repo_owner = repositories[0][0]
+    try:
+        if github_backend._uses_org_secret(repositories) and \
+                github_backend.org_secrets_available(repo_owner, github_pat):
+            return
+    except RuntimeError as error:
+        raise PreflightError(
+            f"Github PAT cannot read secrets of '{repo_owner}': {error}")
+    # This also caches the public keys needed to set the secrets later on.
+    errors = github_backend.fetch_repo_public_keys(repositories, github_pat)
+    if errors:
+        raise PreflightError(
+            'Github PAT cannot read repository secrets of '
+            + ', '.join(f"'{repository}': {error}"
+                        for repository, error in errors.items()))
+
+
+def _check_github_environment(environment_name=None):
+    github_pat = os_environ['GITHUB_PERSONAL_ACCESS_TOKEN']
+    github_environment_name = github_backend.environment_mapping[
+        environment_name or os_environ['ENVIRONMENT_NAME']]
+    try:
+        public_key = github_backend._get_env_public_key(
+            github_backend.REPO_OWNER, github_backend.REPO_NAME,
+            github_environment_name, github_pat)
+    except RuntimeError as error:
+        public_key = None
+        logger.debug(f'Environment public key could not be fetched: {error}')
+    if not public_key:
+        raise PreflightError(
+            'Github PAT cannot read secrets of environment '
+            f"'{github_environment_name}'.")
+
+
+def _check_terraform_token():
+    api = terraform_provider._get_api()
+    if not api or not terraform_provider._get_user_id(api):
+        raise PreflightError('Terraform Cloud token is invalid.')
+
+
+def _check_terraform_workspace(environment_name=None):
+    api = terraform_backend._get_api()
+    environment_name = environment_name or os_environ['ENVIRONMENT_NAME']
+    workspace_name = f'workspace_{environment_name.lower()}'
+    try:
+        workspace_id = terraform_backend._get_workspace_id(api, workspace_name)
+        _, var_ids = terraform_backend._get_varset_vars_id(api, workspace_id)
+    except (IndexError, KeyError):
+        raise PreflightError(
+            f"Workspace '{workspace_name}' or its variable set was not found.")
+    if len(var_ids) < 2:
+        raise PreflightError(
+            f"Variable set of workspace '{workspace_name}' does not have "
+            'the AWS key variables.')
+
+
+def _check_aws_permissions():
+    session = aws_provider._get_session()
+    if not session:
+        raise PreflightError('AWS session could not be created.')
+    iam_client = aws_clients.get_client(session, 'iam')
+    try:
+        user_arn = iam_client.get_user()['User']['Arn']
+    except ClientError as error:
+        raise PreflightError(f'AWS credentials are invalid: {error}')
+
+    try:
+        results = iam_client.simulate_principal_policy(
+            PolicySourceArn=user_arn,
+            ActionNames=AWS_REQUIRED_ACTIONS,
+            ResourceArns=[user_arn],
+        )['EvaluationResults']
+    except ClientError:
+        # Simulating needs a permission of its own. Without it, at least make
+        # sure the keys of the user can be listed.
+        logger.debug('Policy simulation is not permitted. '
+                     'Falling back to listing access keys.')
+        try:
+            iam_client.list_access_keys()
+        except ClientError as error:
+            raise PreflightError(f'Access keys cannot be listed: {error}')
+        return
+    denied = [
+        result['EvalActionName'] for result in results
+        if result['EvalDecision'] != 'allowed'
+    ]
+    if denied:
+        raise PreflightError(
+            f'IAM user is not allowed to perform: {", ".join(denied)}.')
+
+
+def _get_org_environments():
+    environments = aws_org._parse_account_environments(
+        os_environ['AWS_ORG_ENVIRONMENTS'])
+    if not environments:
+        raise PreflightError('No account is mapped to an environment.')
+    return environments
+
+
+def _check_org_accounts():
+    session = aws_provider._get_session()
+    if not session:
+        raise PreflightError('AWS session could not be created.')
+    environments = _get_org_environments()
+    try:
+        account_ids = aws_org._list_account_ids(session)
+    except ClientError as error:
+        raise PreflightError(
+            f'Accounts of the organization cannot be listed: {error}')
+    missing = [
+        account_id for account_id in environments
+        if account_id not in account_ids
+    ]
+    if missing:
+        raise PreflightError(
+            f'Mapped account(s) not in the organization: {", ".join(missing)}.')
+    role_name = os_environ.get('AWS_ORG_ROLE_NAME', aws_org.DEFAULT_ROLE_NAME)
+    # The assumed role credentials are cached, so the rotation reuses them.
+    with ThreadPoolExecutor(max_workers=min(
+            aws_org.MAX_ACCOUNT_WORKERS, len(environments))) as executor:
+        futures = {
+            account_id: executor.submit(
+                aws_org._get_account_session, session, account_id, role_name)
+            for account_id in environments
+        }
+    errors = {}
+    for account_id, future in futures.items():
+        try:
+            future.result()
+        except ClientError as error:
+            errors[account_id] = error
+    if errors:
+        raise PreflightError(
+            f"Role '{role_name}' cannot be assumed in "
+            + ', '.join(f"'{account_id}': {error}"
+                        for account_id, error in errors.items()))
+
+
+def _check_org_github_environments():
+    for environment_name in set(_get_org_environments().values()):
+        _check_github_environment(environment_name)
+
+
+def _check_org_terraform_workspaces():
+    for environment_name in set(_get_org_environments().values()):
+        _check_terraform_workspace(environment_name)
+
+
+def _get_timeout():
+    try:
+        return float(os_environ.get(
+            'KEYROTATION_PREFLIGHT_TIMEOUT', PREFLIGHT_TIMEOUT))
+    except ValueError:
+        logger.exception("'KEYROTATION_PREFLIGHT_TIMEOUT' is not a number.")
+        return PREFLIGHT_TIMEOUT
+
+
+def _run_checks(checks):
+    # The executor is not used as a context manager, as that would wait for
+    # checks which are stuck on an unresponsive API.
+    executor = ThreadPoolExecutor(max_workers=len(checks))
+    futures = {executor.submit(check): name for name, check in checks.items()}
+    timeout = _get_timeout()
+    done, not_done = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    failures = {}
+    for future in done:
+        try:
+            future.result()
+        except PreflightError as error:
+            failures[futures[future]] = str(error)
+        except Exception as error:
+            failures[futures[future]] = f'{type(error).__name__}: {error}'
+    for future in not_done:
+        failures[futures[future]] = \
+            f'Did not finish within {timeout:g} seconds.'
+
+    for name in checks:
+        if name in failures:
+            logger.error(f"Pre-flight check '{name}' failed: {failures[name]}")
+        else:
+            logger.debug(f"Pre-flight check '{name}' passed.")
+    return not failures
+
+
+def _run(environment_variables, checks):
+    # Every other check needs the environment variables, so they are checked
+    # first. This is instant, and needs no API call.
+    try:
+        _check_environment_variables(environment_variables)
+    except PreflightError as error:
+        logger.error(f"Pre-flight check 'environment' failed: {error}")
+        return False
+    return _run_checks(checks)
+
+
+def check_aws():
+    logger.info('Running pre-flight checks for AWS key rotation.')
+    return _run(AWS_REQUIRED_ENVIRONMENT_VARIABLES, {
+        'github-environment': _check_github_environment,
+        'terraform-token': _check_terraform_token,
+        'terraform-workspace': _check_terraform_workspace,
+        'aws-permissions': _check_aws_permissions,
+    })
+
+
+def check_aws_org():
+    logger.info('Running pre-flight checks for AWS organization key rotation.')
+    return _run(AWS_ORG_REQUIRED_ENVIRONMENT_VARIABLES, {
+        'aws-org-accounts': _check_org_accounts,
+        'github-environments': _check_org_github_environments,
+        'terraform-token': _check_terraform_token,
+        'terraform-workspaces': _check_org_terraform_workspaces,
+    })
+
+
+def check_terraform():
+    logger.info('Running pre-flight checks for Terraform key rotation.')
+    return _run(TERRAFORM_REQUIRED_ENVIRONMENT_VARIABLES, {
+        'github-repository': _check_github_repository,
+        'terraform-token': _check_terraform_token,
+    })
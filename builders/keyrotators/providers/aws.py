@@ -1,18 +1,46 @@
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from os import environ as os_environ
+from time import monotonic
 
-import backoff
-import boto3
-import boto3.session
 from botocore.exceptions import ClientError
+from keyrotators.providers import aws_clients
+from keyrotators.backends import circuitbreaker, leases, retry
+from keyrotators.backends import standby as standby_store
 from keyrotators.backends.github import environment_mapping
+from keyrotators.backends.github import get_api_host as github_get_api_host
 from keyrotators.backends.github import \
     set_environment_secret as github_set_environment_secret
+from keyrotators.backends.terraform import TFC_HOST
+from keyrotators.backends.transports import TRANSPORT_ERRORS
 from keyrotators.backends.terraform import \
     update_aws_keys as terraform_update_aws_keys
 
 logger = logging.getLogger(__name__)
 AWS_ACCESS_KEY_DESCRIPTION = 'Autorotated key for effective-fishstick'
+# User tags which belong to an access key are keyed by the access key ID,
+# optionally followed by a colon and a suffix.
+ACCESS_KEY_TAG_PATTERN = re.compile(r'^(AKIA[0-9A-Z]{16})(?::.*)?$')
+# In overlap mode, the previous key stays active after a rotation, and a tag
+# with this suffix holds the time of the switch to the new key and the time
+# after which the previous key is deactivated, as an ISO 8601 interval.
+OVERLAP_TAG_SUFFIX = 'deactivate-after'
+TAG_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# A standby key is kept deactivated, and tagged with this suffix so that it is
+# not deleted with other deactivated keys. Its secret is kept encrypted in the
+# standby store.
+STANDBY_TAG_SUFFIX = 'standby'
+# The user is tagged with the lease of the run rotating its key, as recorded
+# by `leases.get_fence`. Runs which do not share a lease store, like runs on
+# different machines, see each other there, and only the run which tagged the
+# user last changes any target.
+LEASE_TAG_KEY = 'keyrotation:lease'
+# AWS reports the last use of a key with a delay of up to a few hours, so the
+# previous key only counts as unused once this long has passed since the
+# switch.
+LAST_USED_DELAY = timedelta(hours=4)
 
 
 def _get_session(aws_access_key_id=None, aws_secret_access_key=None, aws_region='ap-south-1'):
@@ -35,31 +63,57 @@ def _get_session(aws_access_key_id=None, aws_secret_access_key=None, aws_region=
                              "This is required as no token was given in method arguments.")
             return None
 
-    session = boto3.session.Session(
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-        region_name=aws_region
+    session = aws_clients.get_session(
+        aws_access_key_id,
+        aws_secret_access_key,
+        aws_region
     )
 
     return session
 
 
-def _delete_deactivated_keys(iam_client):
-    all_access_keys = iam_client.list_access_keys()
+def _delete_stale_key_tags(iam_client, username, remaining_access_key_ids,
+                           tags):
+    # IAM users can have at most 50 tags, and every rotation adds one. Tags of
+    # keys which do not exist anymore are removed in a single call.
+    stale_tag_keys = []
+    for tag in tags:
+        match = ACCESS_KEY_TAG_PATTERN.match(tag['Key'])
+        if match and match.group(1) not in remaining_access_key_ids:
+            stale_tag_keys.append(tag['Key'])
+    if stale_tag_keys:
+        logger.debug(f"Removing tags of deleted keys: {stale_tag_keys}.")
+        iam_client.untag_user(UserName=username, TagKeys=stale_tag_keys)
+    return len(stale_tag_keys)
+
+
+def _get_standby_tag_key(access_key_id):
+    return f'{access_key_id}:{STANDBY_TAG_SUFFIX}'
+
+
+def _delete_deactivated_keys(iam_client, username):
+    all_access_keys = iam_client.list_access_keys(UserName=username)
+    tags = iam_client.list_user_tags(UserName=username)['Tags']
+    tag_keys = {tag['Key'] for tag in tags}
     count = 0
+    remaining_access_key_ids = set()
 
     for access_key in all_access_keys['AccessKeyMetadata']:
-        if access_key['Status'] == 'Inactive':
-            access_key_id = access_key['AccessKeyId']
+        access_key_id = access_key['AccessKeyId']
+        if access_key['Status'] == 'Inactive' and \
+                _get_standby_tag_key(access_key_id) not in tag_keys:
             logger.debug(f"Deleting inactive key: '{access_key_id}'.")
             iam_client.delete_access_key(
-                AccessKeyId=access_key_id)
+                UserName=username, AccessKeyId=access_key_id)
             count += 1
+        else:
+            remaining_access_key_ids.add(access_key_id)
 
+    _delete_stale_key_tags(iam_client, username, remaining_access_key_ids, tags)
     return count
 
 
-@backoff.on_exception(backoff.expo, ClientError, max_time=30)
+@retry.until_consistent('aws', ClientError)
 def _get_username(iam_client):
     logger.debug(
         'Gathering username from client object. '
@@ -73,16 +127,20 @@ def _get_current_key_id(session):
     return session.get_credentials().get_frozen_credentials().access_key
 
 
-def _generate_new_key(iam_client, description):
+def _get_current_key_secret(session):
+    return session.get_credentials().get_frozen_credentials().secret_key
+
+
+def _generate_new_key(iam_client, description, username):
     logger.debug('Generating new access keys.')
-    response = iam_client.create_access_key()
+    response = iam_client.create_access_key(UserName=username)
     logger.debug('Access keys generated.')
     access_key_id = response['AccessKey']['AccessKeyId']
     access_key_secret = response['AccessKey']['SecretAccessKey']
 
-    logger.debug('Getting username to add access key description as tag.')
+    logger.debug('Adding access key description as tag.')
     iam_client.tag_user(
-        UserName=_get_username(iam_client),
+        UserName=username,
         Tags=[{
             'Key': access_key_id,
             'Value': description,
@@ -91,12 +149,10 @@ def _generate_new_key(iam_client, description):
     return access_key_id, access_key_secret
 
 
-def _test_new_key(iam_client, new_iam_client):
+def _test_new_key(username, new_iam_client):
     # AWS seems to have delays in updating last_used times, so skipping.
     # time_before_key_usage = datetime.utcnow()
 
-    logger.debug('Gathering username using current keys.')
-    username = _get_username(iam_client)
     logger.debug(f"Username obtained using current keys: '{username}'.")
     try:
         logger.debug('Gathering username using new keys.')
@@ -118,15 +174,200 @@ def _test_new_key(iam_client, new_iam_client):
         #     pass
 
 
-def _deactivate_key(iam_client, access_key_id):
+def _deactivate_key(iam_client, access_key_id, username):
     logger.debug('An access key is being disabled.')
     response = iam_client.update_access_key(
+        UserName=username,
         AccessKeyId=access_key_id,
         Status='Inactive'
     )
     return response['ResponseMetadata']['HTTPStatusCode'] == 200
 
 
+def _reactivate_key(iam_client, access_key_id, username):
+    logger.debug('An access key is being reactivated.')
+    response = iam_client.update_access_key(
+        UserName=username,
+        AccessKeyId=access_key_id,
+        Status='Active'
+    )
+    return response['ResponseMetadata']['HTTPStatusCode'] == 200
+
+
+def _get_overlap_tag_key(access_key_id):
+    return f'{access_key_id}:{OVERLAP_TAG_SUFFIX}'
+
+
+@retry.until_consistent('aws', ClientError)
+def _start_overlap(new_iam_client, username, previous_access_key_id, overlap):
+    # Tagged with the new key, so that the last use of the previous key is
+    # from before the switch. A promoted standby key may take a few seconds
+    # to work, so this is retried for some time.
+    switched_at = datetime.now(timezone.utc)
+    deactivate_after = switched_at + overlap
+    new_iam_client.tag_user(
+        UserName=username,
+        Tags=[{
+            'Key': _get_overlap_tag_key(previous_access_key_id),
+            'Value': f'{switched_at:{TAG_TIME_FORMAT}}/'
+                     f'{deactivate_after:{TAG_TIME_FORMAT}}',
+        }]
+    )
+    return deactivate_after
+
+
+def _is_switch_confirmed(iam_client, access_key_id, switched_at, now):
+    if now < switched_at + LAST_USED_DELAY:
+        return False
+    last_used = iam_client.get_access_key_last_used(
+        AccessKeyId=access_key_id)['AccessKeyLastUsed'].get('LastUsedDate')
+    return last_used is None or last_used < switched_at
+
+
+def _finalize_overlaps(iam_client, username, current_access_key_id,
+                       force=False):
+    """Deactivate previous keys whose overlap is over: their grace period has
+    passed, or they have not been used since the switch. With `force`, every
+    previous key is deactivated, to make room for a new key.
+
+    The key in use by the rotator itself is never deactivated. Returns the
+    number of keys deactivated.
+    """
+    active_access_key_ids = {
+        access_key['AccessKeyId']
+        for access_key in iam_client.list_access_keys(
+            UserName=username)['AccessKeyMetadata']
+        if access_key['Status'] == 'Active'
+    }
+    now = datetime.now(timezone.utc)
+    count = 0
+    for tag in iam_client.list_user_tags(UserName=username)['Tags']:
+        match = ACCESS_KEY_TAG_PATTERN.match(tag['Key'])
+        if not match or tag['Key'] != _get_overlap_tag_key(match.group(1)):
+            continue
+        access_key_id = match.group(1)
+        if access_key_id not in active_access_key_ids:
+            continue
+        if access_key_id == current_access_key_id:
+            logger.warning(
+                f"Previous key '{access_key_id}' is still used to run key "
+                'rotation. It is kept active.')
+            continue
+        switched_at, deactivate_after = (
+            datetime.strptime(value, TAG_TIME_FORMAT).replace(
+                tzinfo=timezone.utc)
+            for value in tag['Value'].split('/'))
+        if now >= deactivate_after:
+            reason = 'its grace period is over'
+        elif _is_switch_confirmed(iam_client, access_key_id, switched_at, now):
+            reason = 'it has not been used since the switch'
+        elif force:
+            reason = 'a new key is about to be created'
+        else:
+            logger.info(f"Previous key '{access_key_id}' stays active until "
+                        f'{deactivate_after}, or until it is not used anymore.')
+            continue
+        logger.info(f"Deactivating previous key '{access_key_id}', as {reason}.")
+        if _deactivate_key(iam_client, access_key_id, username):
+            count += 1
+    return count
+
+
+def finalize_overlap():
+    """Deactivate the previous keys of the current user whose overlap is
+    over. Returns the number of keys deactivated, or None on failure."""
+    session = _get_session()
+    if not session:
+        return None
+    iam_client = aws_clients.get_client(session, 'iam')
+    try:
+        return _finalize_overlaps(
+            iam_client, _get_username(iam_client), _get_current_key_id(session))
+    except ClientError:
+        logger.exception('Overlap of previous keys could not be finalized.')
+        return None
+
+
+def _get_standby_name(username):
+    return f'aws:{username}'
+
+
+def _get_standby(iam_client, username):
+    """Get the standby key of the user, or None if there is none."""
+    standby = standby_store.load(_get_standby_name(username))
+    if standby is None:
+        return None
+    access_key_ids = {
+        access_key['AccessKeyId']
+        for access_key in iam_client.list_access_keys(
+            UserName=username)['AccessKeyMetadata']
+    }
+    tag_keys = {
+        tag['Key'] for tag in iam_client.list_user_tags(UserName=username)['Tags']
+    }
+    if standby['id'] not in access_key_ids or \
+            _get_standby_tag_key(standby['id']) not in tag_keys:
+        logger.warning(f"Standby key '{standby['id']}' does not exist anymore. "
+                       'Discarding it.')
+        standby_store.discard(_get_standby_name(username))
+        return None
+    return standby
+
+
+def _promote_standby(iam_client, username, standby):
+    logger.debug(f"Reactivating standby key '{standby['id']}'.")
+    _reactivate_key(iam_client, standby['id'], username)
+    iam_client.untag_user(
+        UserName=username, TagKeys=[_get_standby_tag_key(standby['id'])])
+    standby_store.discard(_get_standby_name(username))
+    return standby['id'], standby['secret']
+
+
+def prepare_standby():
+    """Create and test a standby key for the current user, then deactivate it
+    and keep its secret in the standby store.
+
+    Returns whether a standby key is ready.
+    """
+    if not standby_store.is_available():
+        return False
+    session = _get_session()
+    if not session:
+        return False
+    iam_client = aws_clients.get_client(session, 'iam')
+    username = _get_username(iam_client)
+    if _get_standby(iam_client, username):
+        logger.info('A standby access key is already prepared.')
+        return True
+    circuitbreaker.check(circuitbreaker.get_host(iam_client.meta.endpoint_url))
+    _delete_deactivated_keys(iam_client, username)
+    if len(iam_client.list_access_keys(
+            UserName=username)['AccessKeyMetadata']) > 1:
+        logger.error('User already has two keys, as during an overlap. No '
+                     'standby key can be prepared.')
+        return False
+    access_key_id, access_key_secret = _generate_new_key(
+        iam_client, AWS_ACCESS_KEY_DESCRIPTION, username)
+    new_session = _get_session(access_key_id, access_key_secret)
+    if not _test_new_key(username, aws_clients.get_client(new_session, 'iam')):
+        logger.error('Standby access key failed the test. Deleting it.')
+        iam_client.delete_access_key(
+            UserName=username, AccessKeyId=access_key_id)
+        return False
+    iam_client.tag_user(
+        UserName=username,
+        Tags=[{
+            'Key': _get_standby_tag_key(access_key_id),
+            'Value': datetime.now(timezone.utc).strftime(TAG_TIME_FORMAT),
+        }]
+    )
+    _deactivate_key(iam_client, access_key_id, username)
+    standby_store.save(
+        _get_standby_name(username), access_key_id, access_key_secret)
+    logger.info(f"Standby access key '{access_key_id}' is prepared.")
+    return True
+
+
 def _rotate_key_on_github(environment_name, access_key_id, access_key_secret):
     github_environment_name = environment_mapping[environment_name]
     r1 = github_set_environment_secret(
@@ -143,7 +384,143 @@ def _rotate_key_on_terraform(environment_name, access_key_id, access_key_secret)
     return r
 
 
-def rotatekeys():
+def get_current_key_age():
+    # A single call, to decide whether rotation is due at all.
+    session = _get_session()
+    if not session:
+        return None
+    iam_client = aws_clients.get_client(session, 'iam')
+    current_access_key_id = _get_current_key_id(session)
+    for access_key in iam_client.list_access_keys()['AccessKeyMetadata']:
+        if access_key['AccessKeyId'] == current_access_key_id:
+            return datetime.now(timezone.utc) - access_key['CreateDate']
+    return None
+
+
+def get_lease_name(account_id, username):
+    # Keyed by account and user, so that rotations of the same IAM user, be
+    # they of the current key or of organization accounts, exclude each
+    # other.
+    return f'aws:{account_id}:{username}'
+
+
+def get_current_lease_name():
+    """Name of the lease on the key of the current user, or None if the user
+    cannot be identified."""
+    session = _get_session()
+    if not session:
+        return None
+    try:
+        identity = aws_clients.get_client(
+            session, 'sts').get_caller_identity()
+    except ClientError:
+        logger.exception('Identity of the current user could not be fetched.')
+        return None
+    return get_lease_name(
+        identity['Account'], identity['Arn'].rsplit('/', 1)[-1])
+
+
+def _run_rollback_step(name, function, *args):
+    try:
+        result = function(*args)
+    except Exception:
+        logger.exception(f'Rollback step {name} failed.')
+        return False
+    if not result:
+        logger.error(f'Rollback step {name} failed.')
+    return bool(result)
+
+
+def _rollback(new_iam_client, username, environment_name,
+              previous_access_key_id, previous_access_key_secret,
+              new_access_key_id):
+    """Reactivate the previous key, then restore it to every target at once,
+    then deactivate the new key.
+
+    The previous key may be deactivated already, so IAM is called with the
+    new key. Targets keep the new key if the previous one could not be
+    reactivated, or if the secret of the previous key is not known, as for
+    keys of organization accounts. Targets which never got the new key are skipped, as the
+    fingerprint of the previous key is still recorded for them. The new key
+    is kept active if any target could not be restored, as that target still
+    uses it.
+    """
+    logger.warning('Rolling back to the previous access key.')
+    if not _run_rollback_step('reactivation', _reactivate_key, new_iam_client,
+                              previous_access_key_id, username):
+        logger.critical('Previous access key could not be reactivated, so '
+                        'targets keep the new key. Manual intervention is '
+                        'required!')
+        return False
+    if previous_access_key_secret is None:
+        logger.critical('Previous access key is reactivated, but its secret is '
+                        'not known, so targets which got the new key keep it. '
+                        'Both keys are left active. Manual intervention is '
+                        'required!')
+        return False
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        steps = {
+            'github': executor.submit(
+                _run_rollback_step, 'github', _rotate_key_on_github,
+                environment_name, previous_access_key_id,
+                previous_access_key_secret),
+            'terraform': executor.submit(
+                _run_rollback_step, 'terraform', _rotate_key_on_terraform,
+                environment_name, previous_access_key_id,
+                previous_access_key_secret),
+        }
+    results = {name: step.result() for name, step in steps.items()}
+    if not all(results.values()):
+        logger.critical(
+            'Rollback to the previous access key is incomplete: '
+            + ', '.join(f"{name} {'restored' if result else 'failed'}"
+                        for name, result in results.items())
+            + '. Both keys are left active. Manual intervention is required!')
+        return False
+    if not _run_rollback_step('deactivation', _deactivate_key,
+                              new_iam_client, new_access_key_id, username):
+        logger.warning('Previous access key is restored everywhere, but the '
+                       'new key could not be deactivated.')
+        return False
+    logger.info('Rolled back to the previous access key.')
+    return True
+
+
+def _check_backends(iam_client, username):
+    # Stop before any key is deleted or created if IAM, or a target the new
+    # key is propagated to, is unavailable.
+    circuitbreaker.check(
+        circuitbreaker.get_host(iam_client.meta.endpoint_url),
+        github_get_api_host(), TFC_HOST)
+    # Stop as well if another run took over the credential. Otherwise, it is
+    # claimed at IAM as well.
+    leases.check()
+    fence = leases.get_fence()
+    if fence:
+        iam_client.tag_user(
+            UserName=username, Tags=[{'Key': LEASE_TAG_KEY, 'Value': fence}])
+
+
+def holds_lease(iam_client, username):
+    """Whether the lease on the key of `username` is still held, both in the
+    lease store and at IAM."""
+    if not leases.is_held():
+        return False
+    fence = leases.get_fence()
+    if not fence:
+        return True
+    tags = iam_client.list_user_tags(UserName=username)['Tags']
+    return {tag['Key']: tag['Value'] for tag in tags}.get(LEASE_TAG_KEY) == \
+        fence
+
+
+def rotatekeys(overlap=None):
+    """Rotate the access key of the current user.
+
+    With `overlap`, a `timedelta`, the previous key stays active until the
+    new key is propagated, and then for up to `overlap` longer (see
+    `finalize_overlap`).
+    """
     logger.info('AWS access keys are being rotated.')
     successes = {
         'deletion': 0,
@@ -152,7 +529,11 @@ def rotatekeys():
         'deactivation': False,
         'github': False,
         'terraform': False,
+        'rollback': None,
+        'durations': {},
+        'key_ids': {},
     }
+    durations = successes['durations']
     try:
         environment_name = os_environ['ENVIRONMENT_NAME']
     except KeyError:
@@ -179,48 +560,151 @@ def rotatekeys():
             'See accompanying logs for more information.')
         return successes
     logger.debug('Creating IAM client with session.')
-    iam_client = session.client('iam')
+    iam_client = aws_clients.get_client(session, 'iam')
     logger.debug('Obtaining current access key from session.')
     current_access_key_id = _get_current_key_id(session)
+    successes['key_ids']['previous'] = current_access_key_id
+    logger.debug('Gathering username using current keys.')
+    username = _get_username(iam_client)
+    _check_backends(iam_client, username)
+    # A user can only have two keys. A key kept active by an earlier overlap
+    # has to go before a new one can be created.
+    _finalize_overlaps(iam_client, username, current_access_key_id, force=True)
     logger.debug('Deleting deactivated keys, if any.')
-    _deactivated_keys_count = _delete_deactivated_keys(iam_client)
+    phase_started = monotonic()
+    _deactivated_keys_count = _delete_deactivated_keys(iam_client, username)
+    durations['deletion'] = monotonic() - phase_started
     if _deactivated_keys_count:
         logger.info(f"{_deactivated_keys_count} key(s) found and deleted.")
         successes['deletion'] = _deactivated_keys_count
-    logger.debug('Generating new keys.')
-    new_access_key_id, new_access_key_secret = _generate_new_key(
-        iam_client, AWS_ACCESS_KEY_DESCRIPTION)
-    logger.info('New access key generated.')
-    successes['creation'] = True
+    standby = _get_standby(iam_client, username)
+    access_keys = iam_client.list_access_keys(
+        UserName=username)['AccessKeyMetadata']
+    if not standby:
+        # A standby key prepared elsewhere cannot be promoted without its
+        # secret, and takes the room of the new key.
+        for access_key in access_keys:
+            if access_key['Status'] == 'Inactive':
+                logger.warning(f"Deleting standby key '{access_key['AccessKeyId']}'"
+                               ', as its secret is not in the standby store.')
+                iam_client.delete_access_key(
+                    UserName=username, AccessKeyId=access_key['AccessKeyId'])
+    active_access_keys = [
+        access_key for access_key in access_keys
+        if access_key['Status'] == 'Active'
+    ]
+    if len(active_access_keys) > 1:
+        logger.critical('User already has two active keys, so no new key can '
+                        'be created. Aborting before any change is made!')
+        return successes
+    if standby:
+        # The standby key was tested when it was prepared, so it only needs
+        # to be reactivated.
+        logger.debug('Promoting standby key.')
+        phase_started = monotonic()
+        new_access_key_id, new_access_key_secret = _promote_standby(
+            iam_client, username, standby)
+        durations['creation'] = monotonic() - phase_started
+        logger.info('Standby access key promoted.')
+        successes['creation'] = True
+        successes['key_ids']['new'] = new_access_key_id
+    else:
+        logger.debug('Generating new keys.')
+        phase_started = monotonic()
+        new_access_key_id, new_access_key_secret = _generate_new_key(
+            iam_client, AWS_ACCESS_KEY_DESCRIPTION, username)
+        durations['creation'] = monotonic() - phase_started
+        logger.info('New access key generated.')
+        successes['creation'] = True
+        successes['key_ids']['new'] = new_access_key_id
     logger.debug('Creating a new session with new key.')
     new_session = _get_session(new_access_key_id, new_access_key_secret)
     logger.debug('Creating IAM client with new session.')
-    new_iam_client = new_session.client('iam')
-    logger.debug('Testing new access keys.')
-    new_key_working = _test_new_key(
-        iam_client, new_iam_client)
+    new_iam_client = aws_clients.get_client(new_session, 'iam')
+    if standby:
+        new_key_working = True
+    else:
+        logger.debug('Testing new access keys.')
+        phase_started = monotonic()
+        new_key_working = _test_new_key(
+            username, new_iam_client)
+        durations['testing'] = monotonic() - phase_started
     if new_key_working:
         logger.info('Newly generated access keys passed the test.')
         successes['testing'] = True
-        logger.debug('Deactivating current key.')
-        _deactivation_result = _deactivate_key(
-            iam_client, current_access_key_id)
-        if _deactivation_result:
-            logger.info('Deactivation of current key is successful.')
-            successes['deactivation'] = True
+        if not holds_lease(iam_client, username):
+            # Another run took over the credential while the key was tested,
+            # so it is withdrawn before reaching any target.
+            logger.critical('Lease on the access key was lost. Deactivating '
+                            'new key and aborting before any target is '
+                            'changed!')
+            _deactivate_key(iam_client, new_access_key_id, username)
+            return successes
+        if overlap is None:
+            logger.debug('Deactivating current key.')
+            phase_started = monotonic()
+            # From here on, targets may hold a key which does not match the
+            # active one, until propagation or rollback is done.
+            diverged_at = phase_started
+            _deactivation_result = _deactivate_key(
+                iam_client, current_access_key_id, username)
+            durations['deactivation'] = monotonic() - phase_started
+            if _deactivation_result:
+                logger.info('Deactivation of current key is successful.')
+                successes['deactivation'] = True
+            else:
+                logger.warning('Deactivation of current key has failed.')
         else:
-            logger.warning('Deactivation of current key has failed.')
+            # Both keys work while the new one is propagated.
+            diverged_at = monotonic()
+            successes['deactivation'] = None
         logger.info('Updating keys on Github.')
-        github_keyrotation_result = _rotate_key_on_github(
-            environment_name, new_access_key_id, new_access_key_secret)
+        phase_started = monotonic()
+        try:
+            github_keyrotation_result = _rotate_key_on_github(
+                environment_name, new_access_key_id, new_access_key_secret)
+        except TRANSPORT_ERRORS:
+            # Rolled back below, like any other failed update.
+            logger.exception('Keys could not be updated on Github.')
+            github_keyrotation_result = False
+        durations['github'] = monotonic() - phase_started
         successes['github'] = github_keyrotation_result
         logger.info('Updating keys on Terraform.')
+        phase_started = monotonic()
         terraform_keyrotation_result = _rotate_key_on_terraform(
             environment_name, new_access_key_id, new_access_key_secret)
+        durations['terraform'] = monotonic() - phase_started
         successes['terraform'] = terraform_keyrotation_result
+        if not (github_keyrotation_result and terraform_keyrotation_result):
+            logger.error('New keys could not be propagated to every target.')
+            successes['rollback'] = _rollback(
+                new_iam_client, username, environment_name,
+                current_access_key_id, _get_current_key_secret(session),
+                new_access_key_id)
+            # The duration of the rollback is the time to recover, counted
+            # from the deactivation of the previous key.
+            durations['rollback'] = monotonic() - diverged_at
+            if successes['rollback']:
+                logger.info(
+                    f"Time to recover: {durations['rollback']:.2f}s.")
+        elif overlap is not None:
+            try:
+                deactivate_after = _start_overlap(
+                    new_iam_client, username, current_access_key_id, overlap)
+            except ClientError:
+                logger.exception('Overlap could not be recorded. Deactivating '
+                                 'current key right away.')
+                successes['deactivation'] = _deactivate_key(
+                    iam_client, current_access_key_id, username)
+            else:
+                successes['deactivate_after'] = deactivate_after.isoformat()
+                logger.info(
+                    f'Current key stays active until {deactivate_after}, or '
+                    'until it is not used anymore.')
     else:
         logger.error('Newly generated keys failed the test.')
-        _deactivation_result = _deactivate_key(iam_client, new_access_key_id)
+        _deactivation_result = _deactivate_key(
+            iam_client, new_access_key_id, username)
         if _deactivation_result:
             logger.info('Deactivation of new key is successful.')
         else:
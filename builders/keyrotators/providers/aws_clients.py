@@ -0,0 +1,130 @@
+import logging
+import threading
+from collections import defaultdict
+from functools import partial
+from time import perf_counter
+
+import boto3.session
+import botocore.session
+from botocore.config import Config
+from keyrotators.backends import circuitbreaker, retry
+
+logger = logging.getLogger(__name__)
+
+# Configuration shared by every client. Adaptive mode rate limits the client
+# itself on throttling. Retries are left to the policy shared by all backends,
+# hooked in by `get_client`.
+CLIENT_CONFIG = Config(
+    retries={
+        'mode': 'adaptive',
+        'total_max_attempts': 1,
+    },
+    max_pool_connections=20,
+    connect_timeout=5,
+    read_timeout=15,
+    tcp_keepalive=True,
+)
+
+_lock = threading.Lock()
+# Sessions by (access key ID, region), and clients by session and service.
+_sessions = {}
+_clients = {}
+# Loader of endpoint and service model data, shared by all sessions so that
+# the data is only read and parsed once per process.
+_data_loader = None
+# Number of calls, total and maximum time in seconds, per operation, updated
+# by the threads of every client under `_timings_lock`.
+_timings_lock = threading.Lock()
+_request_timings = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0})
+
+
+def _get_botocore_session():
+    global _data_loader
+    botocore_session = botocore.session.get_session()
+    if _data_loader is None:
+        _data_loader = botocore_session.get_component('data_loader')
+    else:
+        botocore_session.register_component('data_loader', _data_loader)
+    botocore_session.set_config_variable('sts_regional_endpoints', 'regional')
+    return botocore_session
+
+
+def get_session(aws_access_key_id, aws_secret_access_key, aws_region,
+                aws_session_token=None):
+    # Temporary credentials have access key IDs of their own, so sessions of
+    # refreshed credentials are never mixed up with earlier ones.
+    key = (aws_access_key_id, aws_region)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            logger.debug(f"Creating AWS session for key '{aws_access_key_id}'.")
+            session = _sessions[key] = boto3.session.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                aws_session_token=aws_session_token,
+                region_name=aws_region,
+                botocore_session=_get_botocore_session(),
+            )
+        else:
+            logger.debug(f"Reusing AWS session for key '{aws_access_key_id}'.")
+    return session
+
+
+def _start_timer(context, **kwargs):
+    context['request_started'] = perf_counter()
+
+
+def _stop_timer(context, model=None, event_name='', **kwargs):
+    started = context.get('request_started')
+    if started is None:
+        return
+    elapsed = perf_counter() - started
+    # Failed calls, like those which could not connect, are only given the
+    # exception, so their operation is taken from the event name.
+    operation = model.name if model else event_name.rsplit('.', 1)[-1]
+    with _timings_lock:
+        timing = _request_timings[operation]
+        timing['count'] += 1
+        timing['total'] += elapsed
+        timing['max'] = max(timing['max'], elapsed)
+
+
+def get_client(session, service_name):
+    key = (id(session), service_name)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.debug(f"Creating '{service_name}' client.")
+            client = _clients[key] = session.client(
+                service_name, config=CLIENT_CONFIG)
+            client.meta.events.register('before-call.*.*', _start_timer)
+            client.meta.events.register('after-call.*.*', _stop_timer)
+            client.meta.events.register('after-call-error.*.*', _stop_timer)
+            # Calls to a host whose circuit breaker is open fail at once.
+            host = circuitbreaker.get_host(client.meta.endpoint_url)
+            client.meta.events.register(
+                'before-call.*.*', partial(circuitbreaker.before_aws_call, host))
+            client.meta.events.register(
+                'after-call.*.*', partial(circuitbreaker.after_aws_call, host))
+            client.meta.events.register(
+                'after-call-error.*.*',
+                partial(circuitbreaker.after_aws_call, host))
+            client.meta.events.register(
+                'needs-retry.*.*', retry.aws_needs_retry)
+    return client
+
+
+def get_request_timings():
+    with _timings_lock:
+        return {
+            operation: dict(timing)
+            for operation, timing in _request_timings.items()
+        }
+
+
+def log_request_timings():
+    for operation, timing in sorted(get_request_timings().items()):
+        logger.debug(
+            f"AWS {operation}: {timing['count']} call(s), "
+            f"{timing['total'] * 1000:.0f}ms total, "
+            f"{timing['max'] * 1000:.0f}ms max.")
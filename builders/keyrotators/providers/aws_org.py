@@ -0,0 +1,403 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from os import environ as os_environ
+from time import monotonic
+
+from botocore.exceptions import ClientError
+from keyrotators import scheduler
+from keyrotators.backends import leases, retry
+from keyrotators.backends.github import environment_mapping
+from keyrotators.backends.transports import TRANSPORT_ERRORS
+from keyrotators.providers import aws, aws_clients
+
+logger = logging.getLogger(__name__)
+
+# Rotation of the keys of an IAM user in every member account of an AWS
+# organization, starting from the keys of a management account user in
+# `AWS_ACCESS_KEY_ID` and `AWS_SECRET_ACCESS_KEY`. In every account, the role
+# in `AWS_ORG_ROLE_NAME` is assumed to rotate the keys of the IAM user in
+# `AWS_ORG_USER_NAME`. Member accounts are listed from AWS Organizations, or
+# taken from `AWS_ORG_ACCOUNT_IDS` ('111111111111,222222222222'). Keys of an
+# account are only rotated if it is mapped to an environment, to which the
+# new keys are propagated, in `AWS_ORG_ENVIRONMENTS`
+# ('111111111111=DEV,222222222222=PROD').
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+ROLE_SESSION_NAME = 'keyrotation'
+AWS_REGION = 'ap-south-1'
+
+# Assumed role credentials are reused until this long before they expire.
+CREDENTIALS_REFRESH_MARGIN = timedelta(minutes=5)
+# Maximum number of accounts rotated at once.
+MAX_ACCOUNT_WORKERS = 10
+# Estimated requests of the rotation of an account, by API, for scheduling.
+ACCOUNT_ROTATION_REQUESTS = {
+    'sts': 2,
+    'iam': 7,
+    'github': 3,
+    'terraform': 5,
+}
+
+_credentials_lock = threading.Lock()
+# Assumed role credentials, by account ID and role name.
+_credentials = {}
+
+
+def _parse_account_ids(account_ids):
+    return [
+        account_id.strip() for account_id in account_ids.split(',')
+        if account_id.strip()
+    ]
+
+
+def _parse_account_environments(account_environments):
+    environments = {}
+    for mapping in account_environments.split(','):
+        if not mapping.strip():
+            continue
+        account_id, _, environment_name = mapping.strip().partition('=')
+        if environment_name not in environment_mapping:
+            logger.error(
+                f"Ignoring account '{account_id}', as environment "
+                f"'{environment_name}' is not one of "
+                f'{list(environment_mapping.keys())}.')
+            continue
+        if environment_name in environments.values():
+            # The keys of both accounts would overwrite each other.
+            logger.error(
+                f"Ignoring account '{account_id}', as environment "
+                f"'{environment_name}' is already mapped to another account.")
+            continue
+        environments[account_id] = environment_name
+    return environments
+
+
+def _list_account_ids(management_session):
+    account_ids = os_environ.get('AWS_ORG_ACCOUNT_IDS')
+    if account_ids:
+        return _parse_account_ids(account_ids)
+    logger.debug('Listing active accounts of the organization.')
+    organizations_client = aws_clients.get_client(
+        management_session, 'organizations')
+    paginator = organizations_client.get_paginator('list_accounts')
+    return [
+        account['Id']
+        for page in paginator.paginate()
+        for account in page['Accounts']
+        if account['Status'] == 'ACTIVE'
+    ]
+
+
+def _get_account_session(management_session, account_id, role_name):
+    key = (account_id, role_name)
+    with _credentials_lock:
+        credentials = _credentials.get(key)
+    if credentials is None or credentials['Expiration'] - \
+            datetime.now(timezone.utc) < CREDENTIALS_REFRESH_MARGIN:
+        logger.debug(f"Assuming role '{role_name}' in account '{account_id}'.")
+        sts_client = aws_clients.get_client(management_session, 'sts')
+        credentials = sts_client.assume_role(
+            RoleArn=f'arn:aws:iam::{account_id}:role/{role_name}',
+            RoleSessionName=ROLE_SESSION_NAME,
+        )['Credentials']
+        with _credentials_lock:
+            _credentials[key] = credentials
+    else:
+        logger.debug(
+            f"Reusing credentials of role '{role_name}' in account '{account_id}'.")
+    return aws_clients.get_session(
+        credentials['AccessKeyId'],
+        credentials['SecretAccessKey'],
+        AWS_REGION,
+        credentials['SessionToken'],
+    )
+
+
+@retry.until_consistent('aws', ClientError)
+def _get_caller_arn(sts_client):
+    # New keys take a few seconds to be usable. Unlike `GetUser`, this needs no
+    # permission in the member account.
+    return sts_client.get_caller_identity()['Arn']
+
+
+def _test_new_key(account_id, username, new_access_key_id,
+                  new_access_key_secret):
+    new_session = aws._get_session(new_access_key_id, new_access_key_secret)
+    sts_client = aws_clients.get_client(new_session, 'sts')
+    try:
+        caller_arn = _get_caller_arn(sts_client)
+    except ClientError:
+        logger.exception(f"New key of account '{account_id}' does not work.")
+        return False
+    return caller_arn == f'arn:aws:iam::{account_id}:user/{username}'
+
+
+def _list_active_keys(iam_client, username):
+    return sorted(
+        (access_key for access_key in iam_client.list_access_keys(
+            UserName=username)['AccessKeyMetadata']
+         if access_key['Status'] == 'Active'),
+        key=lambda access_key: access_key['CreateDate'])
+
+
+def _is_due(management_session, account_id, role_name, username,
+            if_older_than):
+    session = _get_account_session(management_session, account_id, role_name)
+    access_keys = _list_active_keys(
+        aws_clients.get_client(session, 'iam'), username)
+    if not access_keys:
+        return True
+    age = datetime.now(timezone.utc) - access_keys[-1]['CreateDate']
+    if age < if_older_than:
+        logger.info(f"Key of account '{account_id}' is not due for "
+                    f'rotation, as it is only {age} old.')
+        return False
+    return True
+
+
+def _get_due_account_ids(management_session, account_ids, role_name, username,
+                         if_older_than):
+    # The credentials of the assumed roles are cached, so checking first costs
+    # a single extra request per account.
+    with ThreadPoolExecutor(
+            max_workers=min(MAX_ACCOUNT_WORKERS, len(account_ids))) as executor:
+        futures = {
+            account_id: executor.submit(
+                _is_due, management_session, account_id, role_name,
+                username, if_older_than)
+            for account_id in account_ids
+        }
+    due_account_ids = []
+    for account_id, future in futures.items():
+        try:
+            if future.result():
+                due_account_ids.append(account_id)
+        except Exception:
+            # Whatever went wrong, like an unreachable endpoint or an open
+            # circuit breaker, the rotation reports it for this account only.
+            logger.exception(
+                f"Age of the key of account '{account_id}' could not be checked.")
+            due_account_ids.append(account_id)
+    return due_account_ids
+
+
+def _rotate_account(management_session, account_id, role_name, username,
+                    environment_name, if_older_than):
+    successes = {
+        'deletion': 0,
+        'creation': False,
+        'testing': False,
+        'deactivation': False,
+        'github': False,
+        'terraform': False,
+        'skipped': False,
+        'environment': environment_name,
+        'durations': {},
+        'key_ids': {},
+    }
+    durations = successes['durations']
+    started = monotonic()
+
+    phase_started = monotonic()
+    session = _get_account_session(management_session, account_id, role_name)
+    iam_client = aws_clients.get_client(session, 'iam')
+    access_keys = _list_active_keys(iam_client, username)
+    durations['assume_role'] = monotonic() - phase_started
+    if len(access_keys) > 1:
+        logger.error(f"User '{username}' in account '{account_id}' already has "
+                     'two active keys. Skipping the account!')
+        return successes
+    current_access_key = access_keys[-1] if access_keys else None
+    if current_access_key:
+        successes['key_ids']['previous'] = current_access_key['AccessKeyId']
+        age = datetime.now(timezone.utc) - current_access_key['CreateDate']
+        if if_older_than is not None and age < if_older_than:
+            logger.info(f"Key of account '{account_id}' is not due for "
+                        f'rotation, as it is only {age} old.')
+            successes['skipped'] = True
+            return successes
+
+    aws._check_backends(iam_client, username)
+    phase_started = monotonic()
+    successes['deletion'] = aws._delete_deactivated_keys(iam_client, username)
+    durations['deletion'] = monotonic() - phase_started
+
+    phase_started = monotonic()
+    new_access_key_id, new_access_key_secret = aws._generate_new_key(
+        iam_client, aws.AWS_ACCESS_KEY_DESCRIPTION, username)
+    durations['creation'] = monotonic() - phase_started
+    successes['creation'] = True
+    successes['key_ids']['new'] = new_access_key_id
+    logger.info(f"New access key generated in account '{account_id}'.")
+
+    phase_started = monotonic()
+    new_key_working = _test_new_key(
+        account_id, username, new_access_key_id, new_access_key_secret)
+    durations['testing'] = monotonic() - phase_started
+    if not new_key_working:
+        logger.error(
+            f"Newly generated keys of account '{account_id}' failed the test.")
+        aws._deactivate_key(iam_client, new_access_key_id, username)
+        return successes
+    successes['testing'] = True
+    if not aws.holds_lease(iam_client, username):
+        # Another run took over the account while the key was tested, so it
+        # is withdrawn before reaching any target.
+        logger.critical(f"Lease on account '{account_id}' was lost. "
+                        'Deactivating new key and aborting before any target '
+                        'is changed!')
+        aws._deactivate_key(iam_client, new_access_key_id, username)
+        return successes
+
+    if current_access_key:
+        phase_started = monotonic()
+        successes['deactivation'] = aws._deactivate_key(
+            iam_client, current_access_key['AccessKeyId'], username)
+        durations['deactivation'] = monotonic() - phase_started
+    else:
+        successes['deactivation'] = None
+
+    # From here on, targets may hold a key which does not match the active
+    # one, until propagation or rollback is done. Errors of the targets,
+    # including their breakers opening, fail the phase instead of leaving the
+    # account half rotated.
+    diverged_at = monotonic()
+    for target, rotate_key in (('github', aws._rotate_key_on_github),
+                               ('terraform', aws._rotate_key_on_terraform)):
+        phase_started = monotonic()
+        try:
+            successes[target] = rotate_key(
+                environment_name, new_access_key_id, new_access_key_secret)
+        except TRANSPORT_ERRORS:
+            logger.exception(f"Keys of account '{account_id}' could not be "
+                             f'updated on {target}.')
+            successes[target] = False
+        durations[target] = monotonic() - phase_started
+    if not (successes['github'] and successes['terraform']):
+        logger.error(f"New key of account '{account_id}' could not be "
+                     'propagated to every target.')
+        if current_access_key:
+            # The secret of the previous key is not known here, so the
+            # rollback stops after reactivating it.
+            successes['rollback'] = aws._rollback(
+                iam_client, username, environment_name,
+                current_access_key['AccessKeyId'], None, new_access_key_id)
+            durations['rollback'] = monotonic() - diverged_at
+    durations['total'] = monotonic() - started
+    return successes
+
+
+def _rotate_account_safely(*args):
+    account_id, username = args[1], args[3]
+    try:
+        # Held by the worker thread, so that accounts rotated at once by
+        # different runs, or by a rotation of the key of the same user, are
+        # rotated by only one of them.
+        with leases.hold(aws.get_lease_name(account_id, username)):
+            return _rotate_account(*args)
+    except leases.LeaseHeldError as error:
+        logger.warning(f"Key of account '{account_id}' is not rotated, as "
+                       f'{error}.')
+        return None
+    except leases.LeaseLostError as error:
+        logger.error(f"Key rotation in account '{account_id}' stopped before "
+                     f'any change, as {error}.')
+        return None
+    except ClientError:
+        logger.exception(f"Key rotation in account '{account_id}' failed.")
+        return None
+
+
+def rotatekeys(if_older_than=None, window=None):
+    """Rotate the keys in all mapped accounts concurrently.
+
+    With `window`, a `timedelta`, only accounts whose keys are due are
+    rotated, each at its slot in the window (see `scheduler`).
+
+    Returns the results of every account, by account ID. The result of an
+    account whose rotation failed unexpectedly is None.
+    """
+    logger.info('AWS access keys are being rotated in organization accounts.')
+    try:
+        username = os_environ['AWS_ORG_USER_NAME']
+    except KeyError:
+        logger.exception("No environment variable named 'AWS_ORG_USER_NAME'. "
+                         'It is the IAM user whose keys are rotated.')
+        return {}
+    role_name = os_environ.get('AWS_ORG_ROLE_NAME', DEFAULT_ROLE_NAME)
+    environments = _parse_account_environments(
+        os_environ.get('AWS_ORG_ENVIRONMENTS', ''))
+
+    management_session = aws._get_session()
+    if not management_session:
+        logger.critical('AWS session of the management account could not be '
+                        'created. See accompanying logs for more information.')
+        return {}
+    try:
+        account_ids = _list_account_ids(management_session)
+    except ClientError:
+        logger.exception('Accounts of the organization could not be listed.')
+        return {}
+    unmapped_account_ids = [
+        account_id for account_id in account_ids
+        if account_id not in environments
+    ]
+    if unmapped_account_ids:
+        logger.info(f'Skipping accounts without environment: '
+                    f'{", ".join(unmapped_account_ids)}.')
+    account_ids = [
+        account_id for account_id in account_ids
+        if account_id in environments
+    ]
+    if not account_ids:
+        logger.error('No account to rotate keys in.')
+        return {}
+
+    started = monotonic()
+    if window and if_older_than is not None:
+        account_ids = _get_due_account_ids(
+            management_session, account_ids, role_name, username,
+            if_older_than)
+        # Only due accounts are left.
+        if_older_than = None
+    jobs = [
+        scheduler.Job(
+            account_id,
+            partial(_rotate_account_safely, management_session, account_id,
+                    role_name, username, environments[account_id],
+                    if_older_than),
+            ACCOUNT_ROTATION_REQUESTS)
+        for account_id in account_ids
+    ]
+    # Without a window, all accounts are due at once and only the number of
+    # workers limits the rate. Either way, accounts stopped by an open circuit
+    # breaker are queued again.
+    if window:
+        results = scheduler.run(jobs, window, MAX_ACCOUNT_WORKERS)
+    else:
+        results = scheduler.run(
+            jobs, timedelta(0), MAX_ACCOUNT_WORKERS, ceilings={})
+    elapsed = monotonic() - started
+
+    rotated = 0
+    for account_id, successes in results.items():
+        if successes is None:
+            continue
+        if successes['skipped']:
+            continue
+        durations = successes['durations']
+        logger.info(
+            f"Account '{account_id}' ({environments[account_id]}): "
+            + ', '.join(f'{phase} {duration:.2f}s'
+                        for phase, duration in durations.items()))
+        if successes['github'] and successes['terraform']:
+            rotated += 1
+    if not account_ids:
+        logger.info('No account is due for rotation.')
+        return results
+    logger.info(
+        f'Keys rotated in {rotated} of {len(account_ids)} accounts in '
+        f'{elapsed:.1f}s ({len(account_ids) / elapsed:.2f} accounts/s).')
+    return results
@@ -1,15 +1,23 @@
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from os import environ as os_environ
+from time import monotonic
 
+from keyrotators.backends import circuitbreaker, leases
+from keyrotators.backends import standby as standby_store
+from keyrotators.backends.github import get_api_host as github_get_api_host
 from keyrotators.backends.github import \
-    set_repo_secret as github_set_repo_secret
+    publish_repo_secret as github_publish_repo_secret
+from keyrotators.backends.terraform import TFC_HOST, call_api
 from terrasnek.api import TFC
 from terrasnek.exceptions import (TFCException, TFCHTTPNotFound,
                                   TFCHTTPUnauthorized)
 
 logger = logging.getLogger(__name__)
 TF_TOKEN_NAME_TEMPLATE = 'Autorotated token for effective-fishstick'
+# Tokens expire 21 days after creation. A standby token is only promoted if it
+# is valid for this much longer, and replaced otherwise.
+STANDBY_MIN_LIFETIME = timedelta(days=7)
 
 
 def _get_api(tf_token=None, tf_organization_name=None):
@@ -39,7 +47,7 @@ def _get_api(tf_token=None, tf_organization_name=None):
 
 def _get_user_id(api):
     try:
-        return api.account.show()['data']['id']
+        return call_api(api.account.show)['data']['id']
     except TFCHTTPUnauthorized:
         logger.exception(
             'API object is unauthorised. Please check the token used to '
@@ -51,18 +59,31 @@ def _generate_new_token_name(version):
     return f'{TF_TOKEN_NAME_TEMPLATE} - #{version}'
 
 
+def _get_standby_name(user_id):
+    return f'terraform:{user_id}'
+
+
+def _get_standby_token_id(user_id):
+    # Known even without the key of the standby store, so that the standby
+    # token is never taken for the current one.
+    return standby_store.get_id(_get_standby_name(user_id))
+
+
 def _get_current_token_details(api):
     user_id = _get_user_id(api)
     if not user_id:
         return None
     logger.debug(f"User ID parsed to be '{user_id}'.")
-    user_tokens = api.user_tokens.list(user_id)
+    user_tokens = call_api(api.user_tokens.list, user_id)
+    standby_token_id = _get_standby_token_id(user_id)
 
     version = 0
     token_id = None
 
     for token_data in user_tokens['data']:
         token_description = token_data['attributes']['description']
+        if token_data['id'] == standby_token_id:
+            continue
         if token_description.startswith(TF_TOKEN_NAME_TEMPLATE):
             version = int(token_description.split('#')[1])
             token_id = token_data['id']
@@ -98,7 +119,8 @@ def _generate_new_token(api, version):
     }
 
     try:
-        response = api.user_tokens.create(user_id, payload)
+        response = call_api(
+            api.user_tokens.create, user_id, payload, idempotent=False)
     except TFCException:
         logger.exception(
             'An error occured while trying to generate a new token.')
@@ -122,7 +144,8 @@ def _test_new_token(current_api, token_id, token):
     # Check if both APIs give same results.
     if test_user_id == user_id:
         # Use current API to fetch last used time of new API.
-        new_api_last_used_str = current_api.user_tokens.show(
+        new_api_last_used_str = call_api(
+            current_api.user_tokens.show,
             token_id)['data']['attributes']['last-used-at']
         new_api_last_used_tzaware = datetime.fromisoformat(
             new_api_last_used_str)
@@ -136,7 +159,7 @@ def _test_new_token(current_api, token_id, token):
 
 def _destroy_token(api, token_id):
     try:
-        api.user_tokens.destroy(token_id)
+        call_api(api.user_tokens.destroy, token_id)
     except TFCHTTPNotFound:
         logger.exception(
             f"Token with ID '{token_id}' does not exist "
@@ -147,8 +170,95 @@ def _destroy_token(api, token_id):
         return True
 
 
+def _get_standby(api, user_id):
+    """Get the standby token of the user, or None if there is none, or it
+    expires too soon to be promoted."""
+    standby = standby_store.load(_get_standby_name(user_id))
+    if standby is None:
+        return None
+    token_ids = {
+        token_data['id'] for token_data in call_api(
+            api.user_tokens.list, user_id)['data']
+    }
+    if standby['id'] not in token_ids:
+        logger.warning(f"Standby token '{standby['id']}' does not exist "
+                       'anymore. Discarding it.')
+        standby_store.discard(_get_standby_name(user_id))
+        return None
+    expires_at = datetime.fromisoformat(standby['expires_at'])
+    if expires_at - datetime.now(timezone.utc) < STANDBY_MIN_LIFETIME:
+        logger.warning(f"Standby token '{standby['id']}' expires at "
+                       f'{expires_at}. Destroying it.')
+        _destroy_token(api, standby['id'])
+        standby_store.discard(_get_standby_name(user_id))
+        return None
+    return standby
+
+
+def prepare_standby():
+    """Create and test a standby token, and keep it in the standby store.
+
+    Returns whether a standby token is ready.
+    """
+    if not standby_store.is_available():
+        return False
+    api = _get_api()
+    if not api:
+        return False
+    current_token_details = _get_current_token_details(api)
+    if not current_token_details:
+        return False
+    user_id = _get_user_id(api)
+    if _get_standby(api, user_id):
+        logger.info('A standby token is already prepared.')
+        return True
+    circuitbreaker.check(TFC_HOST)
+    version = current_token_details[0] + 1
+    expires_at = _get_expiry_time().replace(tzinfo=timezone.utc)
+    new_token_details = _generate_new_token(api, version)
+    if not new_token_details:
+        return False
+    _, token_id, token = new_token_details
+    if not _test_new_token(api, token_id, token):
+        logger.error('Standby token failed the test. Destroying it.')
+        _destroy_token(api, token_id)
+        return False
+    standby_store.save(_get_standby_name(user_id), token_id, token,
+                       version=version, expires_at=expires_at.isoformat())
+    logger.info(f"Standby token '{token_id}' is prepared.")
+    return True
+
+
 def _rotate_key_on_github(token):
-    return github_set_repo_secret('TF_API_TOKEN', token)
+    results = github_publish_repo_secret('TF_API_TOKEN', token)
+    for repository, result in results.items():
+        if result:
+            logger.debug(f"Newly generated token was stored in '{repository}'.")
+        else:
+            logger.error(
+                f"Newly generated token could not be stored in '{repository}'.")
+    return results
+
+
+def get_current_token_age():
+    api = _get_api()
+    if not api:
+        return None
+    user_id = _get_user_id(api)
+    if not user_id:
+        return None
+    created_at = None
+    standby_token_id = _get_standby_token_id(user_id)
+    for token_data in call_api(api.user_tokens.list, user_id)['data']:
+        if token_data['id'] == standby_token_id:
+            continue
+        token_description = token_data['attributes']['description'] or ''
+        if token_description.startswith(TF_TOKEN_NAME_TEMPLATE):
+            created_at = token_data['attributes']['created-at']
+    if not created_at:
+        return None
+    return datetime.now(timezone.utc) - \
+        datetime.fromisoformat(created_at.replace('Z', '+00:00'))
 
 
 def rotatekeys():
@@ -158,7 +268,11 @@ def rotatekeys():
         'testing': False,
         'destruction': None,
         'github': False,
+        'repositories': {},
+        'durations': {},
+        'key_ids': {},
     }
+    durations = successes['durations']
     api = _get_api()
     if not api:
         logger.critical(
@@ -169,24 +283,55 @@ def rotatekeys():
         logger.critical('TFC API initialized with invalid credentials.')
         return successes
     current_version, current_token_id = _current_token_details
-    _new_token_details = _generate_new_token(api, current_version + 1)
-    if not _new_token_details:
-        logger.critical('New TFC token generation was unsuccessful.'
-                        'See accompanying logs for more info.')
-        return successes
-    successes['creation'] = True
-    _, new_token_id, new_token = _new_token_details
-    logger.info(f'Newly generated token has version #{current_version + 1}.')
-    logger.debug(f"Newly generated token has ID '{new_token_id}'.")
-    new_token_working = _test_new_token(api, new_token_id, new_token)
+    successes['key_ids']['previous'] = current_token_id
+    # Stop before creating a token if it could not be stored or tested.
+    circuitbreaker.check(
+        TFC_HOST, github_get_api_host())
+    leases.check()
+    user_id = _get_user_id(api)
+    standby = _get_standby(api, user_id)
+    if standby:
+        # The standby token was tested when it was prepared.
+        standby_store.discard(_get_standby_name(user_id))
+        new_token_id, new_token = standby['id'], standby['secret']
+        successes['creation'] = True
+        successes['key_ids']['new'] = new_token_id
+        logger.info(f"Standby token with version #{standby['version']} "
+                    'promoted.')
+        new_token_working = True
+    else:
+        phase_started = monotonic()
+        _new_token_details = _generate_new_token(api, current_version + 1)
+        durations['creation'] = monotonic() - phase_started
+        if not _new_token_details:
+            logger.critical('New TFC token generation was unsuccessful.'
+                            'See accompanying logs for more info.')
+            return successes
+        successes['creation'] = True
+        _, new_token_id, new_token = _new_token_details
+        successes['key_ids']['new'] = new_token_id
+        logger.info(
+            f'Newly generated token has version #{current_version + 1}.')
+        logger.debug(f"Newly generated token has ID '{new_token_id}'.")
+        phase_started = monotonic()
+        new_token_working = _test_new_token(api, new_token_id, new_token)
+        durations['testing'] = monotonic() - phase_started
     if new_token_working:
         successes['testing'] = True
         logger.info('Newly generated token passed the test.')
+        if not leases.is_held():
+            # Another run took over the token while this one was tested.
+            logger.critical('Lease on the token was lost. Destroying new token '
+                            'and aborting before any target is changed!')
+            _destroy_token(api, new_token_id)
+            return successes
         if current_token_id:
             logger.debug(
                 f"Destructing token with ID '{current_token_id}' as it had "
                 "been previously autogenerated as part of key rotation.")
+            phase_started = monotonic()
             token_destruction_result = _destroy_token(api, current_token_id)
+            durations['destruction'] = monotonic() - phase_started
             if token_destruction_result:
                 successes['destruction'] = True
                 logger.info('Destruction of current token is successful.')
@@ -198,7 +343,12 @@ def rotatekeys():
         else:
             logger.debug(
                 'No token found which was previously autogenerated as part of key rotation.')
-        github_keyrotation_result = _rotate_key_on_github(new_token)
+        phase_started = monotonic()
+        github_keyrotation_results = _rotate_key_on_github(new_token)
+        durations['github'] = monotonic() - phase_started
+        successes['repositories'] = github_keyrotation_results
+        github_keyrotation_result = bool(github_keyrotation_results) and \
+            all(github_keyrotation_results.values())
         if github_keyrotation_result:
             logger.info(
                 'Newly generated token was successfully stored as Github secret.')
@@ -0,0 +1,229 @@
+import heapq
+import logging
+import queue
+import threading
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from itertools import count
+from os import environ as os_environ
+from time import monotonic, sleep
+
+from keyrotators.backends import circuitbreaker
+
+logger = logging.getLogger(__name__)
+
+# Staggered rotation of many credentials. Every credential gets a slot in a
+# time window, derived from a hash of its name, so that it is rotated at the
+# same point of the window in every run. Rotations are started at their slot,
+# with at most a given number running at once, and are delayed further if
+# starting them would exceed the request rate ceiling of an API. Rotations
+# stopped by an open circuit breaker are queued again.
+
+# A credential to rotate. `function` is called without arguments to rotate
+# it, and `requests` estimates the requests it makes, by API. `function` may
+# only raise `CircuitOpenError` before it changes anything, as the job is then
+# run again from the start. A breaker opening afterwards must fail the job.
+Job = namedtuple('Job', ['name', 'function', 'requests'])
+
+# Requests per second allowed per API, well below the limits of AWS IAM, STS,
+# GitHub and Terraform Cloud. They can be overridden with
+# `KEYROTATION_RATE_CEILINGS` ('iam=5,github=10').
+DEFAULT_RATE_CEILINGS = {
+    'iam': 5,
+    'sts': 10,
+    'github': 5,
+    'terraform': 10,
+}
+# Number of times a rotation stopped by an open circuit breaker is queued
+# again.
+MAX_DEFERRALS = 3
+# Rough duration of a rotation, over which its requests are spread when
+# projecting request rates.
+ESTIMATED_JOB_SECONDS = 10
+
+
+def _parse_rate_ceilings(rate_ceilings):
+    ceilings = dict(DEFAULT_RATE_CEILINGS)
+    for ceiling in rate_ceilings.split(','):
+        if not ceiling.strip():
+            continue
+        api, _, rate = ceiling.strip().partition('=')
+        try:
+            ceilings[api] = float(rate)
+        except ValueError:
+            logger.error(f"Ignoring rate ceiling '{ceiling}', as '{rate}' "
+                         'is not a number.')
+    return ceilings
+
+
+def get_rate_ceilings():
+    return _parse_rate_ceilings(
+        os_environ.get('KEYROTATION_RATE_CEILINGS', ''))
+
+
+def get_slot(name, window):
+    """Seconds into `window` at which the credential `name` is rotated."""
+    digest = int.from_bytes(sha256(name.encode()).digest()[:8], 'big')
+    return digest / 2 ** 64 * window.total_seconds()
+
+
+def get_projected_peak_rates(jobs, window):
+    """Highest number of requests per second to each API, if every job
+    starts at its slot and spreads its requests over its estimated duration.
+    """
+    rates = defaultdict(lambda: defaultdict(float))
+    for job in jobs:
+        start = int(get_slot(job.name, window))
+        for api, requests in job.requests.items():
+            for second in range(start, start + ESTIMATED_JOB_SECONDS):
+                rates[api][second] += requests / ESTIMATED_JOB_SECONDS
+    return {api: max(seconds.values()) for api, seconds in rates.items()}
+
+
+def log_projection(jobs, window, ceilings):
+    peak_rates = get_projected_peak_rates(jobs, window)
+    logger.info(
+        f'Scheduling {len(jobs)} rotations over {window}. Projected peak '
+        'request rates: ' + ', '.join(
+            f'{api} {rate:.1f}/s (ceiling {ceilings[api]:g}/s)'
+            if api in ceilings else f'{api} {rate:.1f}/s'
+            for api, rate in sorted(peak_rates.items())) + '.')
+    for api, rate in sorted(peak_rates.items()):
+        if api in ceilings and rate > ceilings[api]:
+            logger.warning(
+                f'Projected peak of {rate:.1f} {api} requests/s is over the '
+                f'ceiling of {ceilings[api]:g}/s. Rotations will be delayed to '
+                'stay under it. A longer window avoids the delays.')
+
+
+class RateLimiter:
+    """Token buckets of the request rate ceilings of every API.
+
+    A bucket holds a second of requests, or the requests of the largest job
+    if that is more, so that every job can start eventually.
+    """
+
+    def __init__(self, ceilings, max_requests=0):
+        self._lock = threading.Lock()
+        self._rates = dict(ceilings)
+        self._capacities = {
+            api: max(rate, max_requests) for api, rate in ceilings.items()}
+        self._tokens = dict(self._capacities)
+        self._updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        for api, rate in self._rates.items():
+            self._tokens[api] = min(
+                self._capacities[api],
+                self._tokens[api] + (now - self._updated) * rate)
+        self._updated = now
+
+    def acquire(self, requests):
+        """Wait until `requests` can be made without exceeding any ceiling.
+
+        Returns the number of seconds waited.
+        """
+        started = monotonic()
+        while True:
+            with self._lock:
+                self._refill()
+                delay = max(
+                    ((requests[api] - self._tokens[api]) / self._rates[api]
+                     for api in requests if api in self._rates),
+                    default=0)
+                if delay <= 0:
+                    for api in requests:
+                        if api in self._tokens:
+                            self._tokens[api] -= requests[api]
+                    return monotonic() - started
+            sleep(delay)
+
+
+def _run_job(job, finished):
+    try:
+        finished.put((job, job.function(), None))
+    except circuitbreaker.CircuitOpenError as error:
+        # Stopped before any change, see `Job`.
+        finished.put((job, None, error))
+    except Exception:
+        logger.exception(f"Scheduled rotation of '{job.name}' failed.")
+        finished.put((job, None, None))
+
+
+def run(jobs, window, max_workers, ceilings=None):
+    """Rotate every job at its slot in `window`, a `timedelta`.
+
+    A job which stops because the circuit breaker of a backend is open is
+    queued again for when the breaker lets a probe through, up to
+    `MAX_DEFERRALS` times. Without `ceilings`, those of `get_rate_ceilings`
+    are kept.
+
+    Returns the result of every job, by name. The result of a job which
+    raised, or was deferred too often, is None.
+    """
+    if not jobs:
+        return {}
+    if ceilings is None:
+        ceilings = get_rate_ceilings()
+    if window:
+        log_projection(jobs, window, ceilings)
+    limiter = RateLimiter(ceilings, max(
+        (requests for job in jobs for requests in job.requests.values()),
+        default=0))
+
+    started = monotonic()
+    # Jobs by the time they are due, in the order of their slots. Jobs are
+    # only handed to the pool when a worker is free, so that the rate
+    # ceilings are applied when they actually start.
+    pending = [
+        (started + get_slot(job.name, window), index, job)
+        for index, job in enumerate(jobs)
+    ]
+    heapq.heapify(pending)
+    sequence = count(len(jobs))
+    deferrals = defaultdict(int)
+    finished = queue.Queue()
+    running = 0
+    results = {}
+    max_delay = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            timeout = None
+            if pending and running < max_workers:
+                due, _, job = pending[0]
+                wait = due - monotonic()
+                if wait <= 0:
+                    heapq.heappop(pending)
+                    limiter.acquire(job.requests)
+                    max_delay = max(max_delay, monotonic() - due)
+                    logger.debug(f"Starting rotation of '{job.name}'.")
+                    executor.submit(_run_job, job, finished)
+                    running += 1
+                    continue
+                timeout = wait
+            try:
+                job, result, error = finished.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            running -= 1
+            if error is None:
+                results[job.name] = result
+                continue
+            deferrals[job.name] += 1
+            if deferrals[job.name] > MAX_DEFERRALS:
+                logger.error(f"Rotation of '{job.name}' was deferred "
+                             f'{MAX_DEFERRALS} times, as {error}. Giving up.')
+                results[job.name] = None
+                continue
+            logger.warning(f"Rotation of '{job.name}' stopped before any "
+                           f'change, as {error}. Retrying in '
+                           f'{error.retry_after:.0f}s.')
+            heapq.heappush(pending, (
+                monotonic() + error.retry_after, next(sequence), job))
+    if window:
+        logger.info(
+            f'Scheduled {len(jobs)} rotations in {monotonic() - started:.1f}s. '
+            f'Rotations started at most {max_delay:.1f}s after they were due.')
+    return {job.name: results[job.name] for job in jobs}
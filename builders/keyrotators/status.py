@@ -0,0 +1,232 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from functools import partial
+from os import environ as os_environ
+
+from keyrotators.backends import github as github_backend
+from keyrotators.backends import terraform as terraform_backend
+from keyrotators.providers import aws as aws_provider
+from keyrotators.providers import aws_clients
+from keyrotators.providers import terraform as terraform_provider
+
+logger = logging.getLogger(__name__)
+
+# Seconds after which queries which have not finished are reported as failed.
+STATUS_TIMEOUT = 15
+# File in which the last status is kept for `--cache-ttl`.
+STATUS_CACHE_FILE = '.keyrotation-status.json'
+
+AWS_SECRET_NAMES = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']
+TERRAFORM_SECRET_NAME = 'TF_API_TOKEN'
+
+COLUMNS = [
+    ('target', 'TARGET'),
+    ('credential', 'CREDENTIAL'),
+    ('id', 'ID'),
+    ('state', 'STATE'),
+    ('changed_at', 'CHANGED'),
+    ('age', 'AGE'),
+    ('expires_at', 'EXPIRES'),
+]
+
+
+def _row(target, credential, id=None, state=None, changed_at=None,
+         expires_at=None):
+    return {
+        'target': target,
+        'credential': credential,
+        'id': id,
+        'state': state,
+        'changed_at': changed_at,
+        'expires_at': expires_at,
+    }
+
+
+def _parse_time(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _get_aws_rows():
+    environment_name = os_environ.get('ENVIRONMENT_NAME', 'default')
+    target = f'aws:{environment_name.lower()}'
+    session = aws_provider._get_session()
+    if not session:
+        return [_row(target, 'IAM access key', state='unavailable')]
+    iam_client = aws_clients.get_client(session, 'iam')
+    current_access_key_id = os_environ.get('AWS_ACCESS_KEY_ID')
+    rows = []
+    for access_key in iam_client.list_access_keys()['AccessKeyMetadata']:
+        state = access_key['Status'].lower()
+        if access_key['AccessKeyId'] == current_access_key_id:
+            state += ', current'
+        rows.append(_row(
+            target, 'IAM access key', access_key['AccessKeyId'], state,
+            access_key['CreateDate']))
+    return rows
+
+
+def _get_terraform_rows():
+    target = f"terraform:{os_environ.get('TF_CLOUD_ORGANIZATION', '')}"
+    api = terraform_provider._get_api()
+    user_id = terraform_provider._get_user_id(api) if api else None
+    if not user_id:
+        return [_row(target, 'user token', state='unavailable')]
+    rows = []
+    # Through the circuit breaker and retries, like every other call of the
+    # Terraform Cloud API.
+    user_tokens = terraform_backend.call_api(api.user_tokens.list, user_id)
+    for token_data in user_tokens['data']:
+        attributes = token_data['attributes']
+        description = attributes['description'] or ''
+        if not description.startswith(terraform_provider.TF_TOKEN_NAME_TEMPLATE):
+            continue
+        expires_at = _parse_time(attributes.get('expired-at'))
+        expired = expires_at and expires_at < datetime.now(timezone.utc)
+        rows.append(_row(
+            target, f"user token #{description.split('#')[1]}",
+            token_data['id'], 'expired' if expired else 'active',
+            attributes['created-at'], expires_at))
+    return rows
+
+
+def _get_github_secret_row(target, secret_name, metadata):
+    if metadata is None:
+        return _row(target, secret_name, state='missing')
+    return _row(target, secret_name, state='set',
+                changed_at=metadata['updated_at'])
+
+
+def _get_github_environment_rows(github_pat, environment_name, secret_name):
+    target = (f'github:{github_backend.REPO_OWNER}/{github_backend.REPO_NAME}'
+              f':{environment_name}')
+    metadata = github_backend.get_environment_secret_metadata(
+        github_backend.REPO_OWNER, github_backend.REPO_NAME,
+        environment_name, secret_name, github_pat)
+    return [_get_github_secret_row(target, secret_name, metadata)]
+
+
+def _get_github_repository_rows(github_pat):
+    repositories = github_backend.get_target_repositories()
+    if github_backend._uses_org_secret(repositories):
+        org_name = repositories[0][0]
+        metadata = github_backend.get_org_secret_metadata(
+            org_name, TERRAFORM_SECRET_NAME, github_pat)
+        if metadata is not None:
+            return [_get_github_secret_row(
+                f'github:{org_name}', TERRAFORM_SECRET_NAME, metadata)]
+    metadata = github_backend._run_for_repositories(
+        github_backend.get_repo_secret_metadata, repositories,
+        TERRAFORM_SECRET_NAME, github_pat)
+    return [
+        _get_github_secret_row(
+            f'github:{repository}', TERRAFORM_SECRET_NAME, repository_metadata)
+        for repository, repository_metadata in metadata.items()
+    ]
+
+
+def _get_queries():
+    queries = {}
+    if os_environ.get('AWS_ACCESS_KEY_ID'):
+        queries['aws'] = _get_aws_rows
+    if os_environ.get('TF_API_TOKEN'):
+        queries['terraform'] = _get_terraform_rows
+    github_pat = os_environ.get('GITHUB_PERSONAL_ACCESS_TOKEN')
+    if github_pat:
+        queries['github:repositories'] = partial(
+            _get_github_repository_rows, github_pat)
+        for environment_name in github_backend.environment_mapping.values():
+            for secret_name in AWS_SECRET_NAMES:
+                queries[f'github:{environment_name}:{secret_name}'] = partial(
+                    _get_github_environment_rows,
+                    github_pat, environment_name, secret_name)
+    return queries
+
+
+def collect_status():
+    """Query all targets at once, so that it takes about as long as the
+    slowest of them."""
+    queries = _get_queries()
+    if not queries:
+        logger.error('No credentials were found in environment variables.')
+        return []
+    # As in the pre-flight checks, queries stuck on an unresponsive API are
+    # not waited for.
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    futures = {executor.submit(query): name for name, query in queries.items()}
+    done, not_done = wait(futures, timeout=STATUS_TIMEOUT)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    rows = []
+    for future, name in futures.items():
+        if future in not_done:
+            rows.append(_row(name, '', state='timed out'))
+            continue
+        try:
+            rows.extend(future.result())
+        except Exception as error:
+            logger.exception(f"Status of '{name}' could not be queried.")
+            rows.append(_row(name, '', state=f'error: {type(error).__name__}'))
+
+    now = datetime.now(timezone.utc)
+    for row in rows:
+        changed_at = _parse_time(row['changed_at'])
+        row['age'] = (now - changed_at).days if changed_at else None
+        for field in ('changed_at', 'expires_at'):
+            value = _parse_time(row[field])
+            row[field] = value.isoformat(timespec='seconds') if value else None
+    return rows
+
+
+def _read_cache(cache_ttl):
+    try:
+        with open(STATUS_CACHE_FILE) as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, ValueError):
+        return None
+    generated_at = datetime.fromisoformat(cache['generated_at'])
+    if (datetime.now(timezone.utc) - generated_at).total_seconds() > cache_ttl:
+        return None
+    logger.debug(f'Using status cached at {generated_at}.')
+    return cache
+
+
+def get_status(cache_ttl=0):
+    if cache_ttl:
+        cache = _read_cache(cache_ttl)
+        if cache:
+            return cache
+    status = {
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'credentials': collect_status(),
+    }
+    if cache_ttl:
+        with open(STATUS_CACHE_FILE, 'w') as cache_file:
+            json.dump(status, cache_file)
+    return status
+
+
+def format_table(rows):
+    table = [[header for _, header in COLUMNS]]
+    for row in rows:
+        table.append([
+            '' if row[field] is None else
+            f'{row[field]}d' if field == 'age' else str(row[field])
+            for field, _ in COLUMNS
+        ])
+    widths = [max(len(line[index]) for line in table)
+              for index in range(len(COLUMNS))]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        for line in table)
+
+
+def print_status(as_json=False, cache_ttl=0):
+    status = get_status(cache_ttl)
+    if as_json:
+        print(json.dumps(status, indent=2))
+    else:
+        print(format_table(status['credentials']))
@@ -0,0 +1,120 @@
+# Tests of the publishing of repository secrets as an organization secret,
+# against a fake of the Github API. Run from `builders` with
+# `python -m pytest keyrotators/tests`.
+import keyrotators
+import pytest
+from keyrotators.backends import fingerprints, github
+from nacl import encoding, public
+
+ORG_NAME = 'example'
+SECRET_NAME = 'TF_API_TOKEN'
+REPOSITORIES = [(ORG_NAME, name) for name in ('alpha', 'beta', 'gamma')]
+API_URL = 'https://api.github.test'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.links = {}
+        self.text = ''
+        self._body = body if body is not None else {}
+
+    def json(self):
+        return self._body
+
+
+class FakeGithub:
+    """Answers the calls made to set secrets, with repository secrets of
+    `SECRET_NAME` in `repo_secrets`."""
+
+    def __init__(self, repo_secrets, deletable=True):
+        self.repo_secrets = set(repo_secrets)
+        self.deletable = deletable
+        self.org_secret = None
+        self.calls = []
+        key = public.PrivateKey.generate().public_key.encode(
+            encoding.Base64Encoder).decode()
+        self.public_key = {'key_id': 'key', 'key': key}
+
+    def get(self, url, headers=None, params=None):
+        self.calls.append(('GET', url))
+        path = url[len(API_URL):]
+        if path.endswith('/actions/secrets/public-key'):
+            return FakeResponse(200, self.public_key)
+        if path == f'/orgs/{ORG_NAME}/actions/secrets/{SECRET_NAME}/repositories':
+            return FakeResponse(404)
+        if path.endswith(f'/actions/secrets/{SECRET_NAME}'):
+            repo_name = path.split('/')[3]
+            if repo_name in self.repo_secrets:
+                return FakeResponse(200, {'name': SECRET_NAME})
+            return FakeResponse(404)
+        repo_name = path.split('/')[3]
+        return FakeResponse(200, {'id': hash(repo_name)})
+
+    def put(self, url, headers=None, data=None):
+        self.calls.append(('PUT', url))
+        path = url[len(API_URL):]
+        if path.startswith('/orgs/'):
+            self.org_secret = data
+            return FakeResponse(201)
+        self.repo_secrets.add(path.split('/')[3])
+        return FakeResponse(201)
+
+    def delete(self, url, headers=None):
+        self.calls.append(('DELETE', url))
+        if not self.deletable:
+            return FakeResponse(403)
+        self.repo_secrets.discard(url[len(API_URL):].split('/')[3])
+        return FakeResponse(204)
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch, tmp_path):
+    for handler in (keyrotators.logFileHandler, keyrotators.errorFileHandler):
+        monkeypatch.setattr(
+            handler, 'baseFilename', str(tmp_path / 'keyrotation.log'))
+    monkeypatch.setenv('GITHUB_PERSONAL_ACCESS_TOKEN', 'token')
+    monkeypatch.setenv('KEYROTATION_STATE_FILE', str(tmp_path / 'state.json'))
+    monkeypatch.setenv('KEYROTATION_FINGERPRINT_KEY', 'fingerprint-key')
+    monkeypatch.delenv('GITHUB_ORG_SECRET_MIN_REPOSITORIES', raising=False)
+    monkeypatch.setattr(fingerprints, '_key', None)
+    monkeypatch.setattr(fingerprints, '_without_key', False)
+    monkeypatch.setattr(fingerprints, '_fingerprints', None)
+    monkeypatch.setattr(github, 'GITHUB_API_URL', API_URL)
+    monkeypatch.setattr(github, '_repo_public_keys', {})
+    monkeypatch.setattr(github, '_org_public_keys', {})
+    monkeypatch.setattr(github, '_repo_ids', {})
+    monkeypatch.setattr(github, '_orgs_without_secrets', set())
+
+
+def _delete_calls(fake):
+    return sorted(url.split('/')[-4] for method, url in fake.calls
+                  if method == 'DELETE')
+
+
+def test_org_secret_deletes_repo_secret(monkeypatch):
+    fake = FakeGithub(repo_secrets={'beta'})
+    monkeypatch.setattr(github, '_session', fake)
+
+    results = github.publish_repo_secret(SECRET_NAME, 'value', REPOSITORIES)
+
+    assert all(results.values()) and len(results) == len(REPOSITORIES)
+    assert fake.org_secret is not None
+    # The repository secret would have hidden the organization secret.
+    assert _delete_calls(fake) == ['beta']
+    assert fake.repo_secrets == set()
+
+
+def test_repo_secrets_kept_when_they_cannot_be_deleted(monkeypatch):
+    fake = FakeGithub(repo_secrets={'beta'}, deletable=False)
+    monkeypatch.setattr(github, '_session', fake)
+
+    results = github.publish_repo_secret(SECRET_NAME, 'value', REPOSITORIES)
+
+    assert all(results.values()) and len(results) == len(REPOSITORIES)
+    # Every repository gets the new value in a repository secret instead.
+    repo_puts = [url for method, url in fake.calls
+                 if method == 'PUT' and '/repos/' in url]
+    assert len(repo_puts) == len(REPOSITORIES)
+    assert fake.repo_secrets == {name for _, name in REPOSITORIES}
@@ -0,0 +1,257 @@
+"""Benchmark of the HTTP transports of the Github backend.
+
+Usage: python -m keyrotators.transportbench [--secrets 10 100 1000]
+
+A repository secret is published to every one of a number of repositories,
+once over HTTP/1.1 with `requests` and once over HTTP/2 with `httpx`, against
+a local stub of the Github API. The stub answers both protocols on the same
+port (HTTP/2 without TLS, with prior knowledge) and delays every answer, to
+stand in for the round trip to api.github.com. It runs in a process of its
+own, so that it does not compete with the client for the interpreter.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from base64 import b64encode
+from secrets import token_hex
+from time import perf_counter
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.settings
+from keyrotators.backends import fingerprints, github, transports
+from nacl import public
+
+HTTP2_PREFACE = b'PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n'
+
+
+class StubServer:
+    def __init__(self, latency):
+        self.latency = latency
+        self.public_key = b64encode(
+            bytes(public.PrivateKey.generate().public_key)).decode()
+        # Counters shared with the server process.
+        self._connections = multiprocessing.Value('i', 0)
+        self._requests = multiprocessing.Value('i', 0)
+        self.port = None
+        self._process = None
+
+    @property
+    def connections(self):
+        return self._connections.value
+
+    @property
+    def requests(self):
+        return self._requests.value
+
+    def _route(self, method, path):
+        with self._requests.get_lock():
+            self._requests.value += 1
+        if method == 'PUT':
+            return 204, b''
+        if path.endswith('/public-key'):
+            body = {'key_id': 'benchmark', 'key': self.public_key}
+        else:
+            body = {'id': abs(hash(path)) % 10 ** 9}
+        return 200, json.dumps(body).encode()
+
+    async def _serve_http1(self, reader, writer, buffer):
+        while True:
+            while b'\r\n\r\n' not in buffer:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                buffer += data
+            head, buffer = buffer.split(b'\r\n\r\n', 1)
+            request_line, *header_lines = head.decode().split('\r\n')
+            method, path, _ = request_line.split(' ', 2)
+            headers = dict(
+                line.lower().split(': ', 1) for line in header_lines)
+            length = int(headers.get('content-length', 0))
+            while len(buffer) < length:
+                buffer += await reader.read(65536)
+            buffer = buffer[length:]
+
+            await asyncio.sleep(self.latency)
+            status, body = self._route(method, path)
+            writer.write(
+                f'HTTP/1.1 {status} OK\r\n'
+                'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+            await writer.drain()
+
+    async def _serve_http2(self, reader, writer, data):
+        connection = h2.connection.H2Connection(
+            h2.config.H2Configuration(client_side=False))
+        connection.local_settings = h2.settings.Settings(
+            client=False,
+            initial_values={h2.settings.SettingCodes.MAX_CONCURRENT_STREAMS: 1000})
+        connection.initiate_connection()
+        requests = {}
+
+        async def respond(stream_id, method, path):
+            await asyncio.sleep(self.latency)
+            status, body = self._route(method, path)
+            headers = [(':status', str(status)),
+                       ('content-length', str(len(body)))]
+            connection.send_headers(stream_id, headers, end_stream=not body)
+            if body:
+                connection.send_data(stream_id, body, end_stream=True)
+            writer.write(connection.data_to_send())
+
+        tasks = set()
+        while data:
+            for event in connection.receive_data(data):
+                if isinstance(event, h2.events.RequestReceived):
+                    headers = dict(event.headers)
+                    requests[event.stream_id] = (
+                        headers[b':method'].decode(),
+                        headers[b':path'].decode())
+                elif isinstance(event, h2.events.DataReceived):
+                    connection.acknowledge_received_data(
+                        event.flow_controlled_length, event.stream_id)
+                elif isinstance(event, h2.events.StreamEnded):
+                    task = asyncio.create_task(
+                        respond(event.stream_id, *requests.pop(event.stream_id)))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            writer.write(connection.data_to_send())
+            await writer.drain()
+            data = await reader.read(65536)
+
+    async def _handle(self, reader, writer):
+        with self._connections.get_lock():
+            self._connections.value += 1
+        try:
+            data = b''
+            while len(data) < len(HTTP2_PREFACE):
+                chunk = await reader.read(65536)
+                if not chunk:
+                    return
+                data += chunk
+                if not HTTP2_PREFACE.startswith(data[:len(HTTP2_PREFACE)]):
+                    break
+            if data.startswith(HTTP2_PREFACE):
+                await self._serve_http2(reader, writer, data)
+            else:
+                await self._serve_http1(reader, writer, data)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, ports):
+        server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        ports.put(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    def _run(self, ports):
+        asyncio.run(self._serve(ports))
+
+    def start(self):
+        ports = multiprocessing.Queue()
+        self._process = multiprocessing.Process(
+            target=self._run, args=(ports,), daemon=True)
+        self._process.start()
+        self.port = ports.get()
+
+    def stop(self):
+        self._process.terminate()
+        self._process.join()
+
+    def reset(self):
+        with self._connections.get_lock():
+            self._connections.value = 0
+        with self._requests.get_lock():
+            self._requests.value = 0
+
+
+def run(server, transport, secrets):
+    github._session = transports.create_session(
+        github.MAX_PUBLISH_WORKERS, transport, prior_knowledge=True)
+    github._repo_public_keys.clear()
+    repositories = [('benchmark', f'repository-{index}')
+                    for index in range(secrets)]
+    server.reset()
+    started = perf_counter()
+    results = github.publish_repo_secret(
+        'BENCHMARK_SECRET', 'value', repositories)
+    elapsed = perf_counter() - started
+    github._session.close()
+    return {
+        'transport': transport,
+        'secrets': secrets,
+        'published': sum(results.values()),
+        'seconds': elapsed,
+        'requests_per_second': server.requests / elapsed,
+        'requests': server.requests,
+        'connections': server.connections,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m keyrotators.transportbench',
+        description='Compare the HTTP/1.1 and HTTP/2 transports of the '
+                    'Github backend against a local stub server.',
+    )
+    parser.add_argument(
+        '--secrets', type=int, nargs='+', default=[10, 100, 1000],
+        help='Numbers of repositories to publish a secret to.')
+    parser.add_argument(
+        '--latency', type=float, default=0.02,
+        help='Seconds the stub server waits before every answer.')
+    parser.add_argument(
+        '--workers', type=int, default=github.MAX_PUBLISH_WORKERS,
+        help='Number of repositories published to at once.')
+    parser.add_argument(
+        '--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args(argv)
+
+    # Logging every secret would be measured along with the transports.
+    logging.getLogger('keyrotators').setLevel(logging.WARNING)
+
+    server = StubServer(args.latency)
+    server.start()
+    github.GITHUB_API_URL = f'http://127.0.0.1:{server.port}'
+    github.MAX_PUBLISH_WORKERS = args.workers
+    # Every secret goes to its own repository secret, and is always written.
+    os.environ['GITHUB_PERSONAL_ACCESS_TOKEN'] = 'benchmark'
+    os.environ['GITHUB_ORG_SECRET_MIN_REPOSITORIES'] = str(max(args.secrets) + 1)
+    fingerprints.force_writes = True
+    # Fingerprints are still recorded, with a throwaway key, so that no key
+    # file is left behind.
+    os.environ['KEYROTATION_FINGERPRINT_KEY'] = token_hex(32)
+
+    with tempfile.TemporaryDirectory() as state_directory:
+        os.environ['KEYROTATION_STATE_FILE'] = os.path.join(
+            state_directory, 'state.json')
+        try:
+            results = [
+                run(server, transport, secrets)
+                for secrets in args.secrets
+                for transport in ('http1', 'http2')
+            ]
+        finally:
+            server.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'transport':<10}{'secrets':>8}{'seconds':>10}"
+          f"{'requests/s':>12}{'connections':>13}")
+    for result in results:
+        print(f"{result['transport']:<10}{result['secrets']:>8}"
+              f"{result['seconds']:>10.2f}"
+              f"{result['requests_per_second']:>12.0f}"
+              f"{result['connections']:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -15,14 +15,37 @@
 # $ python3 build_tfw.py
 # Workspace named 'workspace_dev' with ID 'ws-123456789abcdea' created.
 # Variable set named 'variables_dev' created under workspace 'workspace_dev'.
+#
+# Alternatively, the script can reconcile the organization against a
+# desired-state file instead of creating resources. See `reconcile.py`.
+# $ python3 build_tfw.py --reconcile desired_state.json [--plan]
 
+import argparse
 import os
 
 from terrasnek.api import TFC
 from terrasnek.exceptions import (TFCHTTPNotFound, TFCHTTPUnclassified,
                                   TFCHTTPUnprocessableEntity)
 
+from reconcile import reconcile
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Create or reconcile a Terraform Cloud workspace.')
+    parser.add_argument(
+        '--reconcile',
+        metavar='STATE_FILE',
+        help='Reconcile the organization with the given desired-state file.')
+    parser.add_argument(
+        '--plan',
+        action='store_true',
+        help='Only print the changes needed to reconcile. '
+             'Used along with --reconcile.')
+    args = parser.parse_args()
+
+    if args.reconcile:
+        exit(reconcile(args.reconcile, plan_only=args.plan))
+
     try:
         tf_token = os.environ['TF_API_TOKEN']
         tf_organization_name = os.environ['TF_CLOUD_ORGANIZATION']
@@ -117,6 +140,7 @@ if __name__ == '__main__':
                             "type": "vars",
                             "attributes": {
                                 "key": 'AWS_ACCESS_KEY_ID',
+                                "description": 'Autorotated AWS access key for effective-fishstick',
                                 "value": aws_key,
                                 "category": "env",
                                 "sensitive": True
@@ -126,6 +150,7 @@ if __name__ == '__main__':
                             "type": "vars",
                             "attributes": {
                                 "key": 'AWS_SECRET_ACCESS_KEY',
+                                "description": 'Autorotated AWS secret key for effective-fishstick',
                                 "value": aws_secret_key,
                                 "category": "env",
                                 "sensitive": True
@@ -0,0 +1,382 @@
+# This code reconciles an existing organization in the Terraform cloud against
+# a desired-state file. Instead of blindly creating resources like
+# `build_tfw.py` does, the current state is fetched with paginated bulk reads,
+# diffed against the desired state, and only the create/update/delete calls
+# needed to converge are made. Independent calls of the same phase are made in
+# parallel. The environment variables required for this script are as follows:
+#
+# `TF_API_TOKEN`: A user token which has access to the organization.
+# `TF_CLOUD_ORGANIZATION`: Name of your existing organization.
+#
+# Any environment variable referenced using `value_from_env` in the
+# desired-state file is also required. See `desired_state.json` for a sample
+# desired-state file which mirrors what `build_tfw.py` creates.
+#
+# Only the workspaces and variable sets listed in the desired-state file are
+# managed. Variables of a managed variable set which are not listed are deleted,
+# and so are attachments of a managed variable set to unlisted workspaces.
+# Values of sensitive variables cannot be read back from the API, so they are
+# only written when the variable is created. The AWS key variables are
+# rewritten by `keyrotators` on every rotation, so their category and
+# description in the desired state must match what it writes, or every
+# rotation shows up as drift.
+#
+# Sample usage:
+# $ python3 build_tfw.py --reconcile desired_state.json --plan
+# + create workspace 'workspace_dev'
+# ~ update var 'AWS_REGION' in varset 'variables_dev'
+# Plan: 1 to create, 1 to update, 0 to delete.
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from terrasnek.api import TFC
+from terrasnek.endpoint import MAX_PAGE_SIZE
+from terrasnek.exceptions import TFCException
+
+# Number of API calls which are made in parallel within one phase.
+MAX_WORKERS = 8
+
+# Attributes of a variable which are compared to detect drift.
+VAR_ATTRIBUTES = ('value', 'description', 'category', 'sensitive', 'hcl')
+
+# Symbols used for printing the plan.
+ACTION_SYMBOLS = {
+    'create': '+',
+    'update': '~',
+    'delete': '-',
+}
+
+
+def load_desired_state(state_path):
+    with open(state_path) as state_file:
+        state = json.load(state_file)
+
+    # Resolve variable values which are to be read from environment.
+    for varset in state.get('varsets', []):
+        for var in varset.get('vars', []):
+            if 'value_from_env' in var:
+                var['value'] = os.environ[var.pop('value_from_env')]
+            var.setdefault('description', '')
+            var.setdefault('category', 'env')
+            var.setdefault('sensitive', False)
+            var.setdefault('hcl', False)
+    return state
+
+
+def _list_all_vars_in_varset(api, varset_id):
+    # `terrasnek` only reads the first page of the variables of a variable
+    # set, so the pages are read here the same way its `list_all` methods do.
+    url = f'{api.var_sets._endpoint_base_url}/{varset_id}/relationships/vars'
+    data = []
+    page = 1
+    while True:
+        response = api.var_sets._list(
+            url, page=page, page_size=MAX_PAGE_SIZE)
+        data += response['data']
+        pagination = response.get('meta', {}).get('pagination', {})
+        if page >= pagination.get('total-pages', 1):
+            return {'data': data}
+        page += 1
+
+
+def fetch_current_state(api, desired_state):
+    # One paginated bulk read each for workspaces and variable sets.
+    workspaces = {
+        workspace['attributes']['name']: workspace
+        for workspace in api.workspaces.list_all()['data']
+    }
+    varsets = {
+        varset['attributes']['name']: varset
+        for varset in api.var_sets.list_all_for_org()['data']
+    }
+
+    # Variables are only read for variable sets which are managed.
+    managed_varsets = [
+        varsets[varset['name']]
+        for varset in desired_state.get('varsets', [])
+        if varset['name'] in varsets
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        varset_vars = executor.map(
+            lambda varset: _list_all_vars_in_varset(api, varset['id']),
+            managed_varsets)
+        for varset, var_list in zip(managed_varsets, varset_vars):
+            varset['vars'] = {
+                var['attributes']['key']: var for var in var_list['data']
+            }
+    return workspaces, varsets
+
+
+def _action(phase, action, kind, name, call):
+    return {
+        'phase': phase,
+        'action': action,
+        'kind': kind,
+        'name': name,
+        'call': call,
+    }
+
+
+def _workspace_payload(workspace):
+    return {
+        "data": {
+            "type": "workspaces",
+            "attributes": {
+                "name": workspace['name'],
+                "description": workspace.get('description', ''),
+            }
+        }
+    }
+
+
+def _var_payload(var):
+    return {
+        "data": {
+            "type": "vars",
+            "attributes": {
+                attribute: var[attribute]
+                for attribute in ('key',) + VAR_ATTRIBUTES
+            }
+        }
+    }
+
+
+def _workspaces_payload(workspace_ids):
+    return {
+        "data": [
+            {"type": "workspaces", "id": workspace_id}
+            for workspace_id in workspace_ids
+        ]
+    }
+
+
+def _var_differs(desired_var, current_var):
+    current_attributes = current_var['attributes']
+    for attribute in VAR_ATTRIBUTES:
+        # Sensitive values are write-only and are never returned by the API.
+        if attribute == 'value' and current_attributes['sensitive']:
+            continue
+        if desired_var[attribute] != current_attributes[attribute]:
+            return True
+    return False
+
+
+def diff_workspaces(api, desired_state, workspaces):
+    actions = []
+    for workspace in desired_state.get('workspaces', []):
+        name = workspace['name']
+        payload = _workspace_payload(workspace)
+        if name not in workspaces:
+            actions.append(_action(
+                0, 'create', 'workspace', f"'{name}'",
+                lambda payload=payload: api.workspaces.create(payload)))
+        elif workspaces[name]['attributes']['description'] != \
+                workspace.get('description', ''):
+            workspace_id = workspaces[name]['id']
+            actions.append(_action(
+                0, 'update', 'workspace', f"'{name}'",
+                lambda payload=payload, workspace_id=workspace_id:
+                    api.workspaces.update(payload, workspace_id=workspace_id)))
+    return actions
+
+
+def diff_varsets(api, desired_state, workspace_ids, varsets):
+    # `workspace_ids` is resolved lazily, as workspaces created in the first
+    # phase only get their IDs once that phase has been applied.
+    actions = []
+    for varset in desired_state.get('varsets', []):
+        name = varset['name']
+        attributes = {
+            "name": name,
+            "description": varset.get('description', ''),
+            "global": varset.get('global', False),
+        }
+
+        if name not in varsets:
+            # A new variable set is created along with all its variables and
+            # workspace attachments in a single call.
+            def create(varset=varset, attributes=attributes):
+                return api.var_sets.create({
+                    "data": {
+                        "type": "varsets",
+                        "attributes": attributes,
+                        "relationships": {
+                            "workspaces": _workspaces_payload(
+                                workspace_ids()[workspace]
+                                for workspace in varset.get('workspaces', [])),
+                            "vars": {
+                                "data": [
+                                    _var_payload(var)['data']
+                                    for var in varset.get('vars', [])
+                                ]
+                            },
+                        }
+                    }
+                })
+            actions.append(_action(
+                1, 'create', 'varset', f"'{name}'", create))
+            continue
+
+        current = varsets[name]
+        varset_id = current['id']
+        current_attributes = {
+            attribute: current['attributes'][attribute]
+            for attribute in attributes
+        }
+        if current_attributes != attributes:
+            payload = {"data": {"type": "varsets", "attributes": attributes}}
+            actions.append(_action(
+                1, 'update', 'varset', f"'{name}'",
+                lambda varset_id=varset_id, payload=payload:
+                    api.var_sets.update(varset_id, payload)))
+
+        # Variables of an existing variable set.
+        desired_vars = {var['key']: var for var in varset.get('vars', [])}
+        for key, var in desired_vars.items():
+            payload = _var_payload(var)
+            if key not in current['vars']:
+                actions.append(_action(
+                    2, 'create', 'var', f"'{key}' in varset '{name}'",
+                    lambda varset_id=varset_id, payload=payload:
+                        api.var_sets.add_var_to_varset(varset_id, payload)))
+            elif _var_differs(var, current['vars'][key]):
+                var_id = current['vars'][key]['id']
+                if current['vars'][key]['attributes']['sensitive']:
+                    # Do not overwrite a sensitive value which is unknown.
+                    del payload['data']['attributes']['value']
+                actions.append(_action(
+                    2, 'update', 'var', f"'{key}' in varset '{name}'",
+                    lambda varset_id=varset_id, var_id=var_id, payload=payload:
+                        api.var_sets.update_var_in_varset(
+                            varset_id, var_id, payload)))
+        for key, current_var in current['vars'].items():
+            if key not in desired_vars:
+                var_id = current_var['id']
+                actions.append(_action(
+                    2, 'delete', 'var', f"'{key}' in varset '{name}'",
+                    lambda varset_id=varset_id, var_id=var_id:
+                        api.var_sets.delete_var_from_varset(varset_id, var_id)))
+
+        # Workspace attachments of an existing variable set.
+        desired_workspaces = set(varset.get('workspaces', []))
+        current_workspace_ids = {
+            workspace['id']
+            for workspace in current['relationships']['workspaces']['data']
+        }
+        for workspace in sorted(desired_workspaces):
+            if workspace_ids(resolved=False).get(workspace) not in current_workspace_ids:
+                actions.append(_action(
+                    2, 'create', 'attachment',
+                    f"of varset '{name}' to workspace '{workspace}'",
+                    lambda varset_id=varset_id, workspace=workspace:
+                        api.var_sets.apply_varset_to_workspace(
+                            varset_id,
+                            _workspaces_payload([workspace_ids()[workspace]]))))
+        workspace_names = {
+            workspace_id: workspace
+            for workspace, workspace_id in workspace_ids(resolved=False).items()
+        }
+        for workspace_id in sorted(current_workspace_ids):
+            workspace = workspace_names.get(workspace_id, workspace_id)
+            if workspace not in desired_workspaces:
+                actions.append(_action(
+                    2, 'delete', 'attachment',
+                    f"of varset '{name}' to workspace '{workspace}'",
+                    lambda varset_id=varset_id, workspace_id=workspace_id:
+                        api.var_sets.remove_varset_from_workspace(
+                            varset_id, _workspaces_payload([workspace_id]))))
+    return actions
+
+
+def compute_plan(api, desired_state, workspaces, varsets):
+    workspace_ids = {
+        name: workspace['id'] for name, workspace in workspaces.items()
+    }
+
+    def resolve_workspace_ids(resolved=True):
+        # Once applied, created workspaces are looked up again by name. This
+        # is only one extra bulk read, and only if workspaces were created.
+        if resolved and any(
+                workspace['name'] not in workspace_ids
+                for workspace in desired_state.get('workspaces', [])):
+            workspace_ids.update({
+                workspace['attributes']['name']: workspace['id']
+                for workspace in api.workspaces.list_all()['data']
+            })
+        return workspace_ids
+
+    return diff_workspaces(api, desired_state, workspaces) + \
+        diff_varsets(api, desired_state, resolve_workspace_ids, varsets)
+
+
+def print_plan(plan):
+    for action in plan:
+        print(f"{ACTION_SYMBOLS[action['action']]} {action['action']} "
+              f"{action['kind']} {action['name']}")
+    counts = {
+        action: sum(1 for item in plan if item['action'] == action)
+        for action in ACTION_SYMBOLS
+    }
+    print(f"Plan: {counts['create']} to create, {counts['update']} to update, "
+          f"{counts['delete']} to delete.")
+
+
+def apply_plan(plan):
+    # Phases are applied in order, as variable sets depend on workspaces and
+    # variables depend on variable sets. Calls within a phase are independent.
+    failures = 0
+    for phase in sorted({action['phase'] for action in plan}):
+        phase_actions = [action for action in plan if action['phase'] == phase]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(action['call']) for action in phase_actions
+            ]
+        for action, future in zip(phase_actions, futures):
+            try:
+                future.result()
+            except (TFCException, KeyError) as error:
+                failures += 1
+                print(f"Failed to {action['action']} {action['kind']} "
+                      f"{action['name']}.")
+                print(error)
+            else:
+                print(f"Applied: {action['action']} {action['kind']} "
+                      f"{action['name']}.")
+        if failures:
+            # Later phases depend on this one, so do not continue.
+            break
+    return failures
+
+
+def reconcile(state_path, plan_only=False):
+    try:
+        tf_token = os.environ['TF_API_TOKEN']
+        tf_organization_name = os.environ['TF_CLOUD_ORGANIZATION']
+        desired_state = load_desired_state(state_path)
+    except KeyError as ke:
+        # Log the missing environment variable and exit.
+        print(f'Unable to find required environment variable: {ke}')
+        return 1
+
+    # Initialize the API with the user token.
+    api = TFC(tf_token)
+    api.set_org(tf_organization_name)
+
+    try:
+        workspaces, varsets = fetch_current_state(api, desired_state)
+    except TFCException as read_error:
+        print('Failed to read current state of the organization.')
+        print(read_error)
+        return 6
+
+    plan = compute_plan(api, desired_state, workspaces, varsets)
+    print_plan(plan)
+    if plan_only or not plan:
+        return 0
+
+    if apply_plan(plan):
+        return 7
+    print('Organization reconciled with desired state.')
+    return 0
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,12 +32,14 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rotations',
 ]
 
 MIDDLEWARE = [
@@ -69,6 +72,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'djangotest.wsgi.application'
 
+ASGI_APPLICATION = 'djangotest.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -121,3 +126,35 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'djangotest',
+    }
+}
+
+
+# Rotation history
+# Token which `keyrotators` must send as a bearer token to ingest runs. It is
+# read from the same environment variable as in `keyrotators`.
+
+ROTATIONS_HISTORY_TOKEN = os.environ.get('ROTATION_HISTORY_TOKEN', '')
+
+# Seconds for which a rendered rotation dashboard is kept in the cache.
+ROTATIONS_DASHBOARD_CACHE_TIMEOUT = 300
+
+# Log files of `keyrotators` which can be streamed, by source name.
+ROTATIONS_LOG_SOURCES = {
+    'keyrotation': BASE_DIR.parent / 'builders' / 'keyrotation.log',
+    'keyrotation-error': BASE_DIR.parent / 'builders' / 'keyrotation-error.log',
+}
+
+# Seconds between heartbeats on an idle log stream, and after which a log
+# stream is closed for the browser to reconnect.
+ROTATIONS_STREAM_HEARTBEAT = 15
+ROTATIONS_STREAM_MAX_DURATION = 3600
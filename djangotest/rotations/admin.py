@@ -0,0 +1,15 @@
+from django.contrib import admin
+
+from .models import RotationPhase, RotationRun
+
+
+class RotationPhaseInline(admin.TabularInline):
+    model = RotationPhase
+    extra = 0
+
+
+@admin.register(RotationRun)
+class RotationRunAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'environment', 'started_at', 'success']
+    list_filter = ['provider', 'environment', 'success']
+    inlines = [RotationPhaseInline]
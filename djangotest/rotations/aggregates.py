@@ -0,0 +1,79 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+from .models import EnvironmentStats, PhaseDurationStats
+
+# Upper bounds, in seconds, of the buckets of the phase duration histograms.
+# Buckets grow by 25%, so percentiles are estimated within 25% of the actual
+# value, from 10ms up to about 20 minutes.
+DURATION_BUCKETS = [0.01 * 1.25 ** i for i in range(53)]
+
+
+def _bucket(duration):
+    return min(bisect_left(DURATION_BUCKETS, duration), len(DURATION_BUCKETS) - 1)
+
+
+def percentile(histogram, fraction):
+    """Estimate a percentile from a histogram of `DURATION_BUCKETS`."""
+    total = sum(histogram)
+    if not total:
+        return None
+    threshold = fraction * total
+    cumulative = 0
+    for index, count in enumerate(histogram):
+        cumulative += count
+        if cumulative >= threshold:
+            return DURATION_BUCKETS[index]
+
+
+def record_runs(runs, phases):
+    """Fold newly ingested runs and phases into the aggregates.
+
+    Costs a couple of queries per (provider, environment) in the batch, no
+    matter how many runs have been stored before. Must be called in a
+    transaction: the aggregates are locked until it ends, so that concurrent
+    batches update them one after the other instead of overwriting each other.
+    """
+    runs_by_environment = defaultdict(list)
+    for run in runs:
+        runs_by_environment[(run.provider, run.environment)].append(run)
+
+    # Rows are locked in the same order by every batch, so that batches
+    # cannot deadlock.
+    for (provider, environment), environment_runs in \
+            sorted(runs_by_environment.items()):
+        stats, _ = EnvironmentStats.objects.select_for_update().get_or_create(
+            provider=provider, environment=environment)
+        for run in sorted(environment_runs, key=lambda run: run.started_at):
+            stats.total_runs += 1
+            if stats.last_run_at and run.started_at < stats.last_run_at:
+                # A run older than the latest one only counts towards totals.
+                stats.successful_runs += run.success
+                continue
+            stats.last_run_at = run.started_at
+            if run.success:
+                stats.successful_runs += 1
+                stats.last_success_at = run.started_at
+                stats.current_key_id = run.new_key_id
+                stats.failure_streak = 0
+            else:
+                stats.failure_streak += 1
+                stats.longest_failure_streak = max(
+                    stats.longest_failure_streak, stats.failure_streak)
+        stats.save()
+
+    durations_by_phase = defaultdict(list)
+    for phase in phases:
+        if phase.duration is not None:
+            key = (phase.run.provider, phase.run.environment, phase.name)
+            durations_by_phase[key].append(phase.duration)
+
+    for (provider, environment, name), durations in \
+            sorted(durations_by_phase.items()):
+        stats, _ = PhaseDurationStats.objects.select_for_update().get_or_create(
+            provider=provider, environment=environment, phase=name,
+            defaults={'histogram': [0] * len(DURATION_BUCKETS)})
+        for duration in durations:
+            stats.histogram[_bucket(duration)] += 1
+        stats.count += len(durations)
+        stats.save()
@@ -0,0 +1,107 @@
+import random
+from datetime import timedelta
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from rotations import aggregates
+from rotations.models import (EnvironmentStats, PhaseDurationStats,
+                              RotationPhase, RotationRun)
+
+BENCHMARK_PROVIDER = 'benchmark'
+ENVIRONMENTS = ['DEV', 'TEST', 'PROD']
+PHASES = ['creation', 'testing', 'deactivation', 'github', 'terraform']
+
+
+class Command(BaseCommand):
+    help = ('Load synthetic rotation runs into the configured database and '
+            'measure dashboard response times.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=200_000,
+            help='Number of synthetic runs to load.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5_000,
+            help='Number of runs ingested per batch.')
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Number of dashboard requests to time.')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the synthetic runs after the benchmark.')
+
+    def _load(self, rows, batch_size):
+        started_at = timezone.now() - timedelta(hours=rows)
+        for offset in range(0, rows, batch_size):
+            runs, phases = [], []
+            for index in range(offset, min(offset + batch_size, rows)):
+                run = RotationRun(
+                    provider=BENCHMARK_PROVIDER,
+                    environment=ENVIRONMENTS[index % len(ENVIRONMENTS)],
+                    started_at=started_at + timedelta(hours=index),
+                    finished_at=started_at + timedelta(hours=index, minutes=1),
+                    success=random.random() > 0.05,
+                    new_key_id=f'AKIABENCHMARK{index:07d}',
+                )
+                runs.append(run)
+                phases.extend(
+                    RotationPhase(
+                        run=run, name=name, success=run.success,
+                        duration=random.lognormvariate(0, 0.5))
+                    for name in PHASES)
+            # Same path as the ingestion endpoint.
+            with transaction.atomic():
+                RotationRun.objects.bulk_create(runs)
+                RotationPhase.objects.bulk_create(phases)
+                aggregates.record_runs(runs, phases)
+
+    def _time_requests(self, client, count, **headers):
+        timings = []
+        for _ in range(count):
+            request_started = perf_counter()
+            response = client.get(reverse('rotations:dashboard'), **headers)
+            timings.append((perf_counter() - request_started) * 1000)
+        return response, timings
+
+    def _report(self, label, timings):
+        timings = sorted(timings)
+        p95 = timings[int(0.95 * (len(timings) - 1))]
+        self.stdout.write(
+            f'{label}: median {median(timings):.2f}ms, p95 {p95:.2f}ms, '
+            f'max {timings[-1]:.2f}ms over {len(timings)} request(s).')
+
+    def handle(self, *args, **options):
+        if 'testserver' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS.append('testserver')
+
+        self.stdout.write(
+            f"Loading {options['rows']} synthetic runs into "
+            f"'{settings.DATABASES['default']['NAME']}'.")
+        load_started = perf_counter()
+        self._load(options['rows'], options['batch_size'])
+        self.stdout.write(
+            f'Loaded in {perf_counter() - load_started:.1f}s. '
+            f'{RotationRun.objects.count()} run(s) in the database.')
+
+        client = Client()
+        cache.clear()
+        response, timings = self._time_requests(client, 1)
+        self._report('Cold (render and cache)', timings)
+        _, timings = self._time_requests(client, options['requests'])
+        self._report('Warm (cached)', timings)
+        _, timings = self._time_requests(
+            client, options['requests'], HTTP_IF_NONE_MATCH=response['ETag'])
+        self._report('Revalidation (304)', timings)
+
+        if not options['keep']:
+            RotationRun.objects.filter(provider=BENCHMARK_PROVIDER).delete()
+            EnvironmentStats.objects.filter(provider=BENCHMARK_PROVIDER).delete()
+            PhaseDurationStats.objects.filter(provider=BENCHMARK_PROVIDER).delete()
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.5 on 2026-10-19 04:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RotationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32)),
+                ('environment', models.CharField(blank=True, max_length=32)),
+                ('started_at', models.DateTimeField()),
+                ('finished_at', models.DateTimeField()),
+                ('success', models.BooleanField()),
+                ('previous_key_id', models.CharField(blank=True, max_length=128)),
+                ('new_key_id', models.CharField(blank=True, max_length=128)),
+                ('deleted_keys', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['provider', 'environment', 'started_at'], name='rotations_run_lookup_idx'), models.Index(condition=models.Q(('success', True)), fields=['provider', 'environment', '-started_at'], name='rotations_run_success_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RotationPhase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('success', models.BooleanField(null=True)),
+                ('duration', models.FloatField(null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phases', to='rotations.rotationrun')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='rotationphase',
+            constraint=models.UniqueConstraint(fields=('run', 'name'), name='rotations_phase_unique'),
+        ),
+    ]
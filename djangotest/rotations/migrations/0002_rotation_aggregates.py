@@ -0,0 +1,48 @@
+# Generated by Django 4.2.5 on 2026-10-19 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rotations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnvironmentStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32)),
+                ('environment', models.CharField(blank=True, max_length=32)),
+                ('total_runs', models.PositiveIntegerField(default=0)),
+                ('successful_runs', models.PositiveIntegerField(default=0)),
+                ('last_run_at', models.DateTimeField(null=True)),
+                ('last_success_at', models.DateTimeField(null=True)),
+                ('current_key_id', models.CharField(blank=True, max_length=128)),
+                ('failure_streak', models.PositiveIntegerField(default=0)),
+                ('longest_failure_streak', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhaseDurationStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=32)),
+                ('environment', models.CharField(blank=True, max_length=32)),
+                ('phase', models.CharField(max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('histogram', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='phasedurationstats',
+            constraint=models.UniqueConstraint(fields=('provider', 'environment', 'phase'), name='rotations_phasestats_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='environmentstats',
+            constraint=models.UniqueConstraint(fields=('provider', 'environment'), name='rotations_envstats_unique'),
+        ),
+    ]
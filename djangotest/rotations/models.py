@@ -0,0 +1,107 @@
+from django.db import models
+from django.db.models import Q
+
+
+class RotationRunQuerySet(models.QuerySet):
+    def last_successful(self, provider, environment):
+        """Return the latest successful run, using the partial index."""
+        return self.filter(
+            provider=provider, environment=environment, success=True,
+        ).order_by('-started_at').first()
+
+
+class RotationRun(models.Model):
+    """A single key rotation performed by `keyrotators`."""
+    provider = models.CharField(max_length=32)
+    environment = models.CharField(max_length=32, blank=True)
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField()
+    success = models.BooleanField()
+    previous_key_id = models.CharField(max_length=128, blank=True)
+    new_key_id = models.CharField(max_length=128, blank=True)
+    deleted_keys = models.PositiveIntegerField(default=0)
+
+    objects = RotationRunQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['provider', 'environment', 'started_at'],
+                name='rotations_run_lookup_idx',
+            ),
+            # Keeps "last successful rotation per environment" an index lookup.
+            models.Index(
+                fields=['provider', 'environment', '-started_at'],
+                condition=Q(success=True),
+                name='rotations_run_success_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.provider}/{self.environment} at {self.started_at}'
+
+
+class RotationPhase(models.Model):
+    """Result of one phase (creation, testing, ...) of a rotation run."""
+    run = models.ForeignKey(
+        RotationRun, on_delete=models.CASCADE, related_name='phases')
+    name = models.CharField(max_length=32)
+    success = models.BooleanField(null=True)
+    duration = models.FloatField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['run', 'name'], name='rotations_phase_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} of {self.run}'
+
+
+class EnvironmentStats(models.Model):
+    """Aggregates of the runs of a provider in an environment.
+
+    Maintained incrementally as runs are ingested, so that the dashboard never
+    has to scan the runs table.
+    """
+    provider = models.CharField(max_length=32)
+    environment = models.CharField(max_length=32, blank=True)
+    total_runs = models.PositiveIntegerField(default=0)
+    successful_runs = models.PositiveIntegerField(default=0)
+    last_run_at = models.DateTimeField(null=True)
+    last_success_at = models.DateTimeField(null=True)
+    current_key_id = models.CharField(max_length=128, blank=True)
+    failure_streak = models.PositiveIntegerField(default=0)
+    longest_failure_streak = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['provider', 'environment'],
+                name='rotations_envstats_unique'),
+        ]
+
+    @property
+    def success_rate(self):
+        if not self.total_runs:
+            return None
+        return self.successful_runs / self.total_runs
+
+
+class PhaseDurationStats(models.Model):
+    """Histogram of the durations of a phase, for percentile estimates."""
+    provider = models.CharField(max_length=32)
+    environment = models.CharField(max_length=32, blank=True)
+    phase = models.CharField(max_length=32)
+    count = models.PositiveIntegerField(default=0)
+    # Counts per bucket of `aggregates.DURATION_BUCKETS`.
+    histogram = models.JSONField(default=list)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['provider', 'environment', 'phase'],
+                name='rotations_phasestats_unique'),
+        ]
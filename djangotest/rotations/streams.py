@@ -0,0 +1,139 @@
+import asyncio
+import json
+from collections import deque
+
+# Length of `asctime` in the format used by the `keyrotators` log files, which
+# is `%(asctime)s:%(name)s:%(levelname)s:%(message)s`.
+ASCTIME_LENGTH = len('2023-10-07 03:30:00,000')
+
+_tailers = {}
+
+
+def parse_log_line(line):
+    """Split a `keyrotators` log line into its fields."""
+    fields = line[ASCTIME_LENGTH + 1:].split(':', 2)
+    if len(fields) != 3:
+        return {'message': line}
+    name, level, message = fields
+    return {
+        'time': line[:ASCTIME_LENGTH],
+        'logger': name,
+        'level': level,
+        'message': message,
+    }
+
+
+class LogTailer:
+    """Follows one log file and fans its new lines out to all subscribers.
+
+    There is a single reader per file, however many viewers there are. It
+    reads from the last offset onwards, so the file is never re-read, and it
+    only runs while somebody is subscribed. Recent lines are kept in a backlog
+    so that viewers which connect or reconnect late can catch up.
+    """
+
+    def __init__(self, path, poll_interval, backlog_size, queue_size):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.backlog = deque(maxlen=backlog_size)
+        self.offset = None
+        self.subscribers = set()
+        self._partial = b''
+        self._task = None
+
+    def _read(self):
+        # Runs in a thread, as file I/O would block the event loop.
+        try:
+            with open(self.path, 'rb') as log_file:
+                log_file.seek(0, 2)
+                size = log_file.tell()
+                if self.offset is None or size < self.offset:
+                    # First read, or the file was truncated or replaced.
+                    self.offset = size if self.offset is None else 0
+                    self._partial = b''
+                log_file.seek(self.offset)
+                data = log_file.read()
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        events = []
+        offset = self.offset - len(self._partial)
+        for line in reversed(lines):
+            events.append((offset, line.decode('utf-8', 'replace')))
+            offset -= len(line) + 1
+        events.reverse()
+        return events
+
+    async def _follow(self):
+        try:
+            while self.subscribers:
+                for event in await asyncio.to_thread(self._read):
+                    self.backlog.append(event)
+                    for queue in list(self.subscribers):
+                        if queue.full():
+                            # A viewer which does not keep up is disconnected
+                            # instead of buffering without bounds. A line is
+                            # dropped to make room for the end of its stream.
+                            self.subscribers.discard(queue)
+                            queue.get_nowait()
+                            queue.put_nowait(None)
+                        else:
+                            queue.put_nowait(event)
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            # Lets the next subscriber start a new reader, however this one
+            # ended.
+            self._task = None
+
+    def subscribe(self, last_offset=None):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if last_offset is not None:
+            for event in self.backlog:
+                if event[0] > last_offset:
+                    queue.put_nowait(event)
+        self.subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.create_task(self._follow())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+
+def get_tailer(path, poll_interval=0.5, backlog_size=1000, queue_size=1000):
+    tailer = _tailers.get(path)
+    if tailer is None:
+        tailer = _tailers[path] = LogTailer(
+            path, poll_interval, backlog_size, queue_size)
+    return tailer
+
+
+async def server_sent_events(tailer, last_offset, heartbeat, max_duration):
+    """Yield the lines of a log as server-sent events.
+
+    The event ID is the offset of the end of the line in the file, so that a
+    reconnecting browser resumes from where it left off. The stream is closed
+    after `max_duration` seconds, and the browser reconnects on its own.
+    """
+    queue = tailer.subscribe(last_offset)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_duration
+    try:
+        yield 'retry: 1000\n\n'
+        while loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            if event is None:
+                break
+            offset, line = event
+            data = json.dumps(parse_log_line(line))
+            yield f'id: {offset}\nevent: log\ndata: {data}\n\n'
+    finally:
+        tailer.unsubscribe(queue)
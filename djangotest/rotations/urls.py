@@ -0,0 +1,13 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'rotations'
+
+urlpatterns = [
+    path('dashboard/', views.dashboard, name='dashboard'),
+    path('logs/<str:source>/stream/', views.stream_log, name='stream-log'),
+    path('runs/', views.ingest_runs, name='ingest-runs'),
+    path('<str:provider>/last-successful/', views.last_successful,
+         name='last-successful'),
+]
@@ -0,0 +1,252 @@
+import json
+from hmac import compare_digest
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.http import (Http404, HttpResponse, HttpResponseNotAllowed,
+                         JsonResponse, StreamingHttpResponse)
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from . import aggregates, streams
+from .models import (EnvironmentStats, PhaseDurationStats, RotationPhase,
+                     RotationRun)
+
+
+def _is_authorized(request):
+    token = settings.ROTATIONS_HISTORY_TOKEN
+    if not token:
+        return False
+    authorization = request.headers.get('Authorization', '')
+    return compare_digest(authorization, f'Bearer {token}')
+
+
+def _parse_datetime(value, field):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(f"'{field}' must be an ISO 8601 datetime.")
+    return parsed
+
+
+def _parse_string(value, field, max_length):
+    if value is None:
+        return ''
+    if not isinstance(value, str) or len(value) > max_length:
+        raise ValueError(
+            f"'{field}' must be a string of at most {max_length} characters.")
+    return value
+
+
+def _parse_count(value, field):
+    # `bool` is a subclass of `int`, but not a count.
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise ValueError(f"'{field}' must be a non-negative integer.")
+    return value
+
+
+def _parse_phase(name, phase):
+    if not isinstance(phase, dict):
+        raise ValueError(f"Phase '{name}' must be an object.")
+    success = phase.get('success')
+    if success is not None and not isinstance(success, bool):
+        raise ValueError(f"'success' of phase '{name}' must be a boolean.")
+    duration = phase.get('duration')
+    if duration is not None and (isinstance(duration, bool) or
+                                 not isinstance(duration, (int, float)) or
+                                 duration < 0):
+        raise ValueError(
+            f"'duration' of phase '{name}' must be a non-negative number.")
+    return RotationPhase(
+        name=_parse_string(name, 'phase name', 32),
+        success=success,
+        duration=duration,
+    )
+
+
+def _parse_run(payload):
+    """Build an unsaved run and its phases from one ingested record."""
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid run record: it must be an object.')
+    try:
+        phases = payload.get('phases', {})
+        if not isinstance(phases, dict):
+            raise ValueError("'phases' must be an object.")
+        phases = [_parse_phase(name, phase) for name, phase in phases.items()]
+        run = RotationRun(
+            provider=_parse_string(payload['provider'], 'provider', 32),
+            environment=_parse_string(
+                payload.get('environment'), 'environment', 32),
+            started_at=_parse_datetime(payload['started_at'], 'started_at'),
+            finished_at=_parse_datetime(payload['finished_at'], 'finished_at'),
+            previous_key_id=_parse_string(
+                payload.get('previous_key_id'), 'previous_key_id', 128),
+            new_key_id=_parse_string(
+                payload.get('new_key_id'), 'new_key_id', 128),
+            deleted_keys=_parse_count(
+                payload.get('deleted_keys', 0), 'deleted_keys'),
+        )
+    except KeyError as error:
+        raise ValueError(f'Invalid run record: missing {error}.')
+    if not run.provider:
+        raise ValueError("'provider' must not be empty.")
+    # A run without any phase which ran did not rotate anything, and must not
+    # count as a success.
+    results = [phase.success for phase in phases if phase.success is not None]
+    if not results:
+        raise ValueError(
+            'Invalid run record: it has no phase with a success flag.')
+    run.success = all(results)
+    return run, phases
+
+
+@csrf_exempt
+@require_POST
+def ingest_runs(request):
+    """Store a batch of rotation runs with two bulk inserts."""
+    if not _is_authorized(request):
+        return JsonResponse({'error': 'Unauthorized.'}, status=401)
+    try:
+        payload = json.loads(request.body)
+        records = payload['runs'] if isinstance(payload, dict) else payload
+        if not isinstance(records, list):
+            raise ValueError("'runs' must be a list.")
+        parsed = [_parse_run(record) for record in records]
+    except (ValueError, KeyError, TypeError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    with transaction.atomic():
+        runs = RotationRun.objects.bulk_create([run for run, _ in parsed])
+        phases = []
+        for run, (_, run_phases) in zip(runs, parsed):
+            for phase in run_phases:
+                phase.run = run
+                phases.append(phase)
+        RotationPhase.objects.bulk_create(phases)
+        aggregates.record_runs(runs, phases)
+
+    return JsonResponse({'ids': [run.pk for run in runs]}, status=201)
+
+
+@require_GET
+def last_successful(request, provider):
+    """Latest successful run of a provider, per environment.
+
+    The environments come from the aggregates, which have one row each, and
+    the latest successful run of each is an index lookup in a subquery, so
+    that the runs table is never scanned.
+    """
+    last_successful_runs = RotationRun.objects.filter(
+        provider=OuterRef('provider'),
+        environment=OuterRef('environment'),
+        success=True,
+    ).order_by('-started_at')
+    environments = list(EnvironmentStats.objects.filter(
+        provider=provider,
+    ).annotate(
+        last_successful_id=Subquery(last_successful_runs.values('pk')[:1]),
+    ).values_list('environment', 'last_successful_id').order_by('environment'))
+    runs = RotationRun.objects.in_bulk(
+        [run_id for _, run_id in environments if run_id is not None])
+    results = {}
+    for environment, run_id in environments:
+        run = runs.get(run_id)
+        results[environment] = run and {
+            'id': run.pk,
+            'started_at': run.started_at.isoformat(),
+            'finished_at': run.finished_at.isoformat(),
+            'new_key_id': run.new_key_id,
+        }
+    return JsonResponse({'provider': provider, 'environments': results})
+
+
+def _dashboard_etag(request):
+    """Version of the dashboard, from the small aggregates table only.
+
+    Key ages are shown in days, so the date is part of the version too.
+    """
+    if not hasattr(request, '_rotations_dashboard_etag'):
+        version = EnvironmentStats.objects.aggregate(
+            updated_at=Max('updated_at'), count=Count('id'))
+        updated_at = version['updated_at'] and version['updated_at'].timestamp()
+        request._rotations_dashboard_etag = \
+            f'{updated_at}-{version["count"]}-{timezone.now().date()}'
+    return request._rotations_dashboard_etag
+
+
+def _render_dashboard(request):
+    now = timezone.now()
+    phase_stats = {}
+    for stats in PhaseDurationStats.objects.all():
+        phase_stats.setdefault((stats.provider, stats.environment), []).append({
+            'phase': stats.phase,
+            'count': stats.count,
+            'p50': aggregates.percentile(stats.histogram, 0.5),
+            'p95': aggregates.percentile(stats.histogram, 0.95),
+        })
+    environments = [
+        {
+            'stats': stats,
+            'key_age_days': stats.last_success_at and
+                (now - stats.last_success_at).days,
+            'phases': sorted(
+                phase_stats.get((stats.provider, stats.environment), []),
+                key=lambda phase: phase['phase']),
+        }
+        for stats in EnvironmentStats.objects.order_by('provider', 'environment')
+    ]
+    return render_to_string(
+        'rotations/dashboard.html',
+        {'environments': environments, 'generated_at': now},
+        request=request,
+    )
+
+
+@require_GET
+@condition(etag_func=_dashboard_etag)
+def dashboard(request):
+    """Key age, success rate, phase durations and failure streaks.
+
+    Rendered from the precomputed aggregates, and cached until they change.
+    The `condition` decorator answers unchanged revalidations with a 304.
+    """
+    cache_key = f'rotations:dashboard:{_dashboard_etag(request)}'
+    content = cache.get(cache_key)
+    if content is None:
+        content = _render_dashboard(request)
+        cache.set(cache_key, content, settings.ROTATIONS_DASHBOARD_CACHE_TIMEOUT)
+    response = HttpResponse(content)
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def stream_log(request, source):
+    """Stream a rotation log to the browser with server-sent events.
+
+    Served asynchronously, so watchers do not hold on to worker threads.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        path = settings.ROTATIONS_LOG_SOURCES[source]
+    except KeyError:
+        raise Http404(f"No log source named '{source}'.")
+    try:
+        last_offset = int(request.headers['Last-Event-ID'])
+    except (KeyError, ValueError):
+        last_offset = None
+
+    tailer = streams.get_tailer(str(path))
+    response = StreamingHttpResponse(
+        streams.server_sent_events(
+            tailer, last_offset,
+            heartbeat=settings.ROTATIONS_STREAM_HEARTBEAT,
+            max_duration=settings.ROTATIONS_STREAM_MAX_DURATION),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response